@@ -9,10 +9,14 @@ from __future__ import division
 
 # python libs
 import copy
+import hashlib
+import json
 import os
 import sys
 import random
+import StringIO
 from itertools import chain, izip
+from collections import OrderedDict
 import traceback
 from math import *
 
@@ -38,7 +42,7 @@ from rasmus import stats, util, treelib
 from compbio import birthdeath, phylo
 
 # dlcoal libs
-from . import coal, duploss, sim
+from . import arraytree, coal, duploss, sim
 
 
 #=============================================================================
@@ -71,9 +75,23 @@ export = ex.export
 if dlcoalc:
     export(dlcoalc, "deleteTree", c_int, [c_void_p, "tree"])
     export(dlcoalc, "makeTree", c_void_p, [c_int, "nnodes",
-                                          c_int_p, "ptree"])
+                                          c_int_array, "ptree"])
     export(dlcoalc, "setTreeDists", c_void_p, [c_void_p, "tree",
-                                              c_float_p, "dists"])
+                                              c_float_array, "dists"])
+
+    export(dlcoalc, "new_random_stream", c_void_p,
+           [c_uint64, "seed", c_uint64, "family", c_uint64, "chain",
+            c_uint64, "thread"])
+    export(dlcoalc, "delete_random_stream", None, [c_void_p, "rand"])
+    export(dlcoalc, "seed_random_stream", None,
+           [c_void_p, "rand", c_uint64, "seed", c_uint64, "family",
+            c_uint64, "chain", c_uint64, "thread"])
+    export(dlcoalc, "random_stream_frand", c_double, [c_void_p, "rand"])
+    export(dlcoalc, "random_stream_get_state", None,
+           [c_void_p, "rand", c_array_arg(c_uint64, out=True), "state"])
+    export(dlcoalc, "random_stream_set_state", None,
+           [c_void_p, "rand", c_array_arg(c_uint64), "state"])
+    export(dlcoalc, "default_random_stream", c_void_p, [])
 
 
 
@@ -91,6 +109,9 @@ class NullLog (object):
     def flush(self):
         pass
 
+    def close(self):
+        pass
+
 
 
 #=============================================================================
@@ -102,11 +123,13 @@ def prob_dlcoal_recon_topology(coal_tree, coal_recon,
                                stree, n, duprate, lossrate,
                                pretime=None, premean=None,
                                nsamples=100,
-                               add_spec=True, info=None):
+                               add_spec=True, info=None,
+                               workspace=None, nthreads=1, rand=None,
+                               crn=None, first_sample=0):
     """
     Probability of a reconcile gene tree in the DLCoal model.
 
-    coal_tree    -- coalescent tree
+    coal_tree    -- coalescent tree (treelib.Tree or arraytree.ArrayTree)
     coal_recon   -- reconciliation of coalescent tree to locus tree
     locus_tree   -- locus tree (has dup-loss)
     locus_recon  -- reconciliation of locus tree to species tree
@@ -120,19 +143,38 @@ def prob_dlcoal_recon_topology(coal_tree, coal_recon,
     pretime      -- starting time before species tree
     premean      -- mean starting time before species tree
 
+    workspace    -- optional coal.LocusCoalWorkspace to reuse across calls
+    nthreads     -- number of native threads used for sampling
+    rand         -- RandomStream for sampling (default: library stream)
+    crn          -- RandomStream whose substreams give the random numbers
+                    of each sample instead of 'rand' (common random numbers)
+    first_sample -- index of the first sample in 'crn'
+
+    With 'nthreads' > 1, each thread samples from its own stream split from
+    'rand', so results are reproducible for a given stream and thread count
+    but differ between thread counts by Monte Carlo error.  With 'crn',
+    results do not depend on the thread count.
     """
 
     
+    cstree = compile_species_tree(stree)
+
     # init popsizes for locus tree
-    stree_popsizes = coal.init_popsizes(stree, n)
+    stree_popsizes = cstree.get_popsizes(n)
     popsizes = {}
     for node in locus_tree:
         popsizes[node.name] = stree_popsizes[locus_recon[node].name]
+
+    # convert the locus tree once for the native functions
+    if dlcoalc:
+        locus_array = arraytree.ArrayTree(locus_tree)
+    else:
+        locus_array = locus_tree
     
     
     # duploss probability
     dl_prob = duploss.prob_dup_loss(
-        locus_tree, stree, locus_recon, locus_events,
+        locus_array, cstree, locus_recon, locus_events,
         duprate, lossrate)
     
     # daughters probability
@@ -140,13 +182,13 @@ def prob_dlcoal_recon_topology(coal_tree, coal_recon,
     d_prob = dups * log(.5)
     
     # integrate over duplication times using sampling
-    stimes = treelib.get_tree_timestamps(stree)
     prob = prob_locus_coal_recon_topology_samples(
         coal_tree, coal_recon,
-        locus_tree, locus_recon, locus_events, popsizes,
-        stree, stimes,
+        locus_array, locus_recon, locus_events, popsizes,
+        cstree, cstree.times,
         daughters, duprate, lossrate, nsamples,
-        pretime, premean)
+        pretime, premean, workspace=workspace, nthreads=nthreads, rand=rand,
+        crn=crn, first_sample=first_sample, info=info)
 
     
     # logging info
@@ -159,13 +201,99 @@ def prob_dlcoal_recon_topology(coal_tree, coal_recon,
     return dl_prob + d_prob + prob - log(nsamples)
 
 
+def prob_dlcoal_recon_topology_batch(coal_tree, coal_recons,
+                                     locus_tree, locus_recon, locus_events,
+                                     daughters_list,
+                                     stree, n, duprate, lossrate,
+                                     pretime=None, premean=None,
+                                     nsamples=100,
+                                     add_spec=True,
+                                     workspace=None, nthreads=1, rand=None,
+                                     crn=None):
+    """
+    Probabilities of several reconciliations of a coal tree to one locus
+    tree in the DLCoal model.
+
+    coal_recons    -- list of reconciliations of coal tree to locus tree
+    daughters_list -- daughters set for each reconciliation
+
+    Returns a list of log probabilities, one per reconciliation.  All
+    reconciliations share the duplication-loss prior and the samples of
+    duplication times.  See prob_dlcoal_recon_topology() for the other
+    arguments.
+    """
+
+    cstree = compile_species_tree(stree)
+
+    # init popsizes for locus tree
+    stree_popsizes = cstree.get_popsizes(n)
+    popsizes = {}
+    for node in locus_tree:
+        popsizes[node.name] = stree_popsizes[locus_recon[node].name]
+
+    # convert the locus tree once for the native functions
+    if dlcoalc:
+        locus_array = arraytree.ArrayTree(locus_tree)
+    else:
+        locus_array = locus_tree
+
+    # duploss probability
+    dl_prob = duploss.prob_dup_loss(
+        locus_array, cstree, locus_recon, locus_events,
+        duprate, lossrate)
+    
+    # daughters probability
+    dups = phylo.count_dup(locus_tree, locus_events)
+    d_prob = dups * log(.5)
+
+    # integrate over duplication times using sampling
+    if dlcoalc:
+        probs = coal.prob_locus_coal_recon_topology_samples_batch(
+            coal_tree, coal_recons,
+            locus_array, locus_recon, locus_events, popsizes,
+            cstree, cstree.times,
+            daughters_list, duprate, lossrate, nsamples,
+            pretime, premean, workspace=workspace, nthreads=nthreads,
+            rand=rand, crn=crn)
+    else:
+        probs = [prob_locus_coal_recon_topology_samples(
+                     coal_tree, coal_recon,
+                     locus_tree, locus_recon, locus_events, popsizes,
+                     cstree, cstree.times,
+                     daughters, duprate, lossrate, nsamples,
+                     pretime, premean)
+                 for coal_recon, daughters in izip(coal_recons,
+                                                   daughters_list)]
+
+    return [dl_prob + d_prob + prob - log(nsamples) for prob in probs]
+
+
 def prob_locus_coal_recon_topology_samples(
         coal_tree, coal_recon,
         locus_tree, locus_recon, locus_events, popsizes,
         stree, stimes,
         daughters, duprate, lossrate, nsamples,
-        pretime=None, premean=None):
+        pretime=None, premean=None, workspace=None, nthreads=1, rand=None,
+        crn=None, first_sample=0, info=None):
+    """
+    Returns the log probability of a reconciled coal tree within a locus
+    tree integrated over duplication times by sampling
+
+    If 'info' is given, info["coal_prob_sq"] is set to the log mean of the
+    squared sample probabilities.
+    """
     
+    cstree = compile_species_tree(stree)
+    stree = cstree.tree
+
+    if isinstance(coal_tree, arraytree.ArrayTree) and not dlcoalc:
+        coal_tree = coal_tree.tree
+    if isinstance(locus_tree, arraytree.ArrayTree):
+        locus_array = locus_tree
+        locus_tree = locus_tree.tree
+    else:
+        locus_array = locus_tree
+
     if dlcoalc:
         # sample some reason branch lengths just for logging purposes
         locus_times = duploss.sample_dup_times(
@@ -175,14 +303,20 @@ def prob_locus_coal_recon_topology_samples(
         treelib.set_dists_from_timestamps(locus_tree, locus_times)
 
         # use C code
-        return coal.prob_locus_coal_recon_topology_samples(
-            coal_tree, coal_recon,
-            locus_tree, locus_recon, locus_events, popsizes,
-            stree, stimes,
-            daughters, duprate, lossrate, nsamples, pretime, premean)
+        probs, sqprobs = coal.prob_locus_coal_recon_topology_samples_batch(
+            coal_tree, [coal_recon],
+            locus_array, locus_recon, locus_events, popsizes,
+            cstree, stimes,
+            [daughters], duprate, lossrate, nsamples, pretime, premean,
+            workspace=workspace, nthreads=nthreads, rand=rand, crn=crn,
+            first_sample=first_sample, return_squares=True)
+        if info is not None:
+            info["coal_prob_sq"] = sqprobs[0]
+        return probs[0]
     else:
         # python backup    
         prob = 0.0
+        sqprob = 0.0
         for i in xrange(nsamples):
             # sample duplication times
             locus_times = duploss.sample_dup_times(
@@ -196,7 +330,10 @@ def prob_locus_coal_recon_topology_samples(
                 coal_tree, coal_recon, locus_tree, popsizes, daughters)
             
             prob += exp(coal_prob)
+            sqprob += exp(2 * coal_prob)
         prob = util.safelog(prob / nsamples)
+        if info is not None:
+            info["coal_prob_sq"] = util.safelog(sqprob / nsamples)
 
         return prob
 
@@ -274,27 +411,47 @@ def write_dlcoal_recon(filename, coal_tree, extra,
                        filenames={}):
     """Writes a reconciled gene tree to files"""
 
+    # reconciliations are written in tree order, so that files do not
+    # depend on the hashing of nodes
+    def tree_order(tree, recon):
+        return OrderedDict((node, recon[node]) for node in tree.preorder()
+                           if node in recon)
+    locus_tree = extra["locus_tree"]
+
     # coal
     coal_tree.write(filenames.get("coal_tree", filename + exts["coal_tree"]),
                     rootData=True)
     phylo.write_recon_events(
         filenames.get("coal_recon", filename + exts["coal_recon"]),
-        extra["coal_recon"], noevent="none")
+        tree_order(coal_tree, extra["coal_recon"]), noevent="none")
 
     # locus
-    extra["locus_tree"].write(
+    locus_tree.write(
         filenames.get("locus_tree", filename + exts["locus_tree"]),
         rootData=True)
     phylo.write_recon_events(
         filenames.get("locus_recon", filename + exts["locus_recon"]),
-        extra["locus_recon"], extra["locus_events"])
+        tree_order(locus_tree, extra["locus_recon"]), extra["locus_events"])
 
     util.write_list(
         filenames.get("daughters", filename + exts["daughters"]),
-        [x.name for x in extra["daughters"]])
+        [x.name for x in locus_tree.preorder() if x in extra["daughters"]])
 
 
 
+def format_dlcoal_recon(coal_tree, extra):
+    """
+    Returns the files of a reconciled gene tree from write_dlcoal_recon()
+    as a dict of strings
+    """
+    streams = dict((key, StringIO.StringIO()) for key in
+                   ("coal_tree", "coal_recon", "locus_tree", "locus_recon",
+                    "daughters"))
+    write_dlcoal_recon("", coal_tree, extra, filenames=streams)
+    return dict((key, stream.getvalue())
+                for key, stream in streams.iteritems())
+
+
 def read_dlcoal_recon(filename, stree,
                       exts={"coal_tree": ".coal.tree",
                             "coal_recon": ".coal.recon",
@@ -329,19 +486,154 @@ def read_dlcoal_recon(filename, stree,
     return coal_tree, extra
 
 
+class LogWriter (object):
+    """
+    Writes a search log as JSON lines
+
+    Each locus tree with its reconciliations is written once as a record
+
+      {"type": "locus", "id": ID, "locus_tree": NEWICK, "locus_top": HASH,
+       "locus_recon": [[NODE, SNODE], ...],
+       "locus_events": [[NODE, EVENT], ...],
+       "coal_recon": [[NODE, LNODE], ...]}
+
+    and proposals refer to it by id
+
+      {"type": "recon", "iter": ITER, "locus": ID,
+       "daughters": [NODE, ...], "data": {...}}
+
+    Only every 'interval' proposal is written.  The stream is not flushed
+    after each record.
+    """
+
+    def __init__(self, stream, interval=1):
+        self.stream = stream
+        self.interval = interval
+        self.enabled = not isinstance(stream, NullLog)
+        self.loci = {}
+        self.nrecons = 0
+
+
+    def write_recon(self, recon):
+        """Writes a Recon, if it is sampled"""
+
+        self.nrecons += 1
+        if not self.enabled or (self.nrecons - 1) % self.interval != 0:
+            return
+
+        locus_tree = recon.locus_tree.get_one_line_newick(root_data=True)
+        locus_recon = sorted([x.name, y.name]
+                             for x, y in recon.locus_recon.iteritems())
+        locus_events = sorted([x.name, y]
+                              for x, y in recon.locus_events.iteritems())
+        coal_recon = sorted([x.name, y.name]
+                            for x, y in recon.coal_recon.iteritems())
+        key = (locus_tree, json.dumps(locus_recon), json.dumps(locus_events),
+               json.dumps(coal_recon))
+
+        locus = self.loci.get(key)
+        if locus is None:
+            locus = self.loci[key] = len(self.loci)
+            self._write({"type": "locus", "id": locus,
+                         "locus_tree": locus_tree,
+                         "locus_top": phylo.hash_tree(recon.locus_tree),
+                         "locus_recon": locus_recon,
+                         "locus_events": locus_events,
+                         "coal_recon": coal_recon})
+
+        self._write({"type": "recon", "iter": self.nrecons - 1,
+                     "locus": locus,
+                     "daughters": sorted(x.name for x in recon.daughters),
+                     "data": recon.data})
+
+
+    def _write(self, record):
+        self.stream.write(json.dumps(record, separators=(",", ":"),
+                                     sort_keys=True))
+        self.stream.write("\n")
+
+
+    def flush(self):
+        self.stream.flush()
+
+
+    def get_state(self):
+        """
+        Returns the writer state for a checkpoint, including the position
+        of a file stream
+        """
+        offset = None
+        if self.enabled and hasattr(self.stream, "tell"):
+            self.stream.flush()
+            offset = self.stream.tell()
+        return (self.loci, self.nrecons, offset)
+
+
+    def set_state(self, state, truncate=True):
+        """
+        Restores the writer state from get_state() and moves a file stream
+        back to the saved position
+
+        If 'truncate' is True, the records written after the saved position
+        are removed.  Otherwise they are overwritten as they are written
+        again.
+        """
+        self.loci, self.nrecons, offset = state
+        if (self.enabled and offset is not None and
+            hasattr(self.stream, "seek")):
+            self.stream.seek(offset)
+            if truncate:
+                self.stream.truncate()
+
+
 def read_log(filename):
-    """Reads a DLCoal log"""
+    """
+    Reads a DLCoal log written by LogWriter
+
+    Yields one dict per logged proposal with the keys 'locus_tree',
+    'locus_top', 'locus_recon', 'locus_events', 'coal_recon', 'daughters',
+    'data', and 'iter'.  Logs in the older repr() format are passed to
+    read_log_repr().
+    """
     stream = util.open_stream(filename)
+    loci = {}
+
     for line in stream:
-        if line.startswith("seed:"):
+        if not line.startswith("{"):
             continue
-        yield eval(line, {"inf": util.INF})
+        if line.startswith("{'"):
+            stream.close()
+            for data in read_log_repr(filename):
+                yield data
+            return
+
+        record = json.loads(line)
+        if record["type"] == "locus":
+            loci[record["id"]] = record
+        elif record["type"] == "recon":
+            locus = loci[record["locus"]]
+            yield {"locus_tree": locus["locus_tree"],
+                   "locus_top": locus["locus_top"],
+                   "locus_recon": locus["locus_recon"],
+                   "locus_events": locus["locus_events"],
+                   "coal_recon": locus["coal_recon"],
+                   "daughters": record["daughters"],
+                   "data": record["data"],
+                   "iter": record["iter"]}
   
 
+def read_log_repr(filename):
+    """Reads a DLCoal log in the older repr() format"""
+    stream = util.open_stream(filename)
+    for line in stream:
+        if not line.startswith("{"):
+            continue
+        yield eval(line, {"inf": util.INF})
+
+
 def read_log_all(filename):
     """Reads a DLCoal log"""
-    stream = util.open_stream(filename)
-    return map(eval, stream)
+    return list(read_log(filename))
     
 
 
@@ -362,21 +654,9 @@ def make_ptree(tree):
         nodes.append(node)
     walk(tree.root)
 
-    # ensure sort is stable
-    def leafsort(a, b):
-        if a.is_leaf():
-            if b.is_leaf():
-                return 0
-            else:
-                return -1
-        else:
-            if b.is_leaf():
-                return 1
-            else:
-                return 0
-    
-    # bring leaves to front
-    nodes.sort(cmp=leafsort)
+    # bring leaves to front (stable)
+    nodes = ([node for node in nodes if node.is_leaf()] +
+             [node for node in nodes if not node.is_leaf()])
     nodelookup = {}
     for i, n in enumerate(nodes):
         nodelookup[n] = i
@@ -392,6 +672,24 @@ def make_ptree(tree):
     return ptree, nodes, nodelookup
 
 
+def set_tree_ptree(tree, ptree, nodes):
+    """
+    Sets the topology of 'tree' from a parent array over its 'nodes'
+    (as returned by make_ptree)
+    """
+
+    for node in nodes:
+        node.children = []
+    for i, node in enumerate(nodes):
+        if ptree[i] == -1:
+            node.parent = None
+            tree.root = node
+        else:
+            parent = nodes[ptree[i]]
+            node.parent = parent
+            parent.children.append(node)
+
+
 def ptree2ctree(ptree):
     """Makes a c++ Tree from a parent array"""
     pint = c_int * len(ptree)
@@ -408,6 +706,353 @@ def tree2ctree(tree):
     return ctree
 
 
+class CompiledSpeciesTree (object):
+    """
+    A species tree prepared for the native probability functions
+
+    The species tree does not change during a reconciliation search, so its
+    parent array, node lookup, C++ Tree, and timestamps are built once here
+    and shared by every evaluation.  Any function that takes a species tree
+    'stree' also accepts a CompiledSpeciesTree.
+
+    tree       -- the original treelib.Tree
+    ptree      -- parent array
+    nodes      -- nodes in parent array order
+    nodelookup -- node to parent array index
+    ctree      -- C++ Tree (None if the native library is not available)
+    times      -- timestamps dict
+
+    The C++ Tree and timestamps are built on first use, so that trees that
+    are only reconciled need not be binary or ultrametric.  The native
+    functions require a binary species tree.
+
+    Population sizes and the duplication-loss doom table are also cached
+    here and only recomputed when their parameters change.
+
+    An LCA index (an Euler tour of the tree with a sparse table of range
+    minimum depths) answers lca() in constant time, so that reconcile()
+    maps each gene node to its species with one lookup.  It is built on
+    the first call to lca() or reconcile().
+    """
+
+    def __init__(self, stree, n=None):
+        self._ctree = None
+        self._native = False
+        self._times = None
+        self.tree = stree
+        self.ptree, self.nodes, self.nodelookup = make_ptree(stree)
+
+        self._n = None
+        self.popsizes = None
+        self.popsizes_array = None
+        if n is not None:
+            self.get_popsizes(n)
+
+        self._rates = None
+        self.doomtable = None
+
+        self._lca_table = None
+
+
+    def _init_native(self):
+        """Builds the C++ Tree and arrays used by the native functions"""
+
+        # the native tree has room for two children per node
+        for node in self.nodes:
+            if len(node.children) > 2:
+                raise Exception("species tree must be binary, but node '%s' "
+                                "has %d children" %
+                                (node.name, len(node.children)))
+
+        self._native = True
+        self._ptree_array = None
+        self._times_array = None
+        if dlcoalc:
+            self._ctree = ptree2ctree(self.ptree)
+            self._ctree_owner = _NativeTree(self._ctree)
+            setTreeDists(self._ctree, c_list(c_float,
+                                             [x.dist for x in self.nodes]))
+            self._ptree_array = c_list(c_int, self.ptree)
+            self._times_array = c_list(c_double,
+                                       [self.times[x] for x in self.nodes])
+
+
+    @property
+    def ctree(self):
+        if not self._native:
+            self._init_native()
+        return self._ctree
+
+    @property
+    def ptree_array(self):
+        if not self._native:
+            self._init_native()
+        return self._ptree_array
+
+    @property
+    def times_array(self):
+        if not self._native:
+            self._init_native()
+        return self._times_array
+
+    @property
+    def times(self):
+        if self._times is None:
+            self._times = treelib.get_tree_timestamps(self.tree)
+        return self._times
+
+
+    def _init_lca_index(self):
+        """Builds the Euler tour and sparse table used by lca()"""
+
+        # Euler tour, with each entry encoded as depth * size + index so
+        # that the shallowest entry of a range is its minimum
+        size = len(self.nodes)
+        tour = []
+        first = {}
+        stack = [(self.tree.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if node not in first:
+                first[node] = len(tour)
+                for child in reversed(node.children):
+                    stack.append((node, depth))
+                    stack.append((child, depth + 1))
+            tour.append(depth * size + self.nodelookup[node])
+
+        # table[k][i] is the minimum of tour[i:i + 2**k]
+        table = [tour]
+        k = 1
+        while 2**k <= len(tour):
+            row = table[-1]
+            half = 2**(k-1)
+            table.append([min(row[i], row[i + half])
+                          for i in xrange(len(tour) - 2**k + 1)])
+            k += 1
+
+        self._lca_first = first
+        self._lca_table = table
+        self._lca_log2 = [0] + [i.bit_length() - 1
+                                for i in xrange(1, len(tour) + 1)]
+
+
+    def lca(self, node1, node2):
+        """Returns the lowest common ancestor of two species nodes"""
+        if self._lca_table is None:
+            self._init_lca_index()
+        i = self._lca_first[node1]
+        j = self._lca_first[node2]
+        if i > j:
+            i, j = j, i
+        k = self._lca_log2[j - i + 1]
+        row = self._lca_table[k]
+        return self.nodes[min(row[i], row[j - (1 << k) + 1]) % len(self.nodes)]
+
+
+    def reconcile_node(self, node, recon):
+        """Reconciles gene node 'node' given the recon of its children"""
+        children = node.children
+        snode = recon[children[0]]
+        for child in children[1:]:
+            snode = self.lca(snode, recon[child])
+        return snode
+
+
+    def reconcile(self, gtree, gene2species=phylo.gene2species,
+                  _species=None):
+        """
+        Returns the LCA reconciliation of gene tree 'gtree' (the same as
+        phylo.reconcile)
+        """
+
+        # species of each gene name, which is shared by reconcile_many()
+        if _species is None:
+            _species = {}
+        if self._lca_table is None:
+            self._init_lca_index()
+        snodes = self.tree.nodes
+        first = self._lca_first
+        table = self._lca_table
+        log2 = self._lca_log2
+        nodes = self.nodes
+        size = len(nodes)
+
+        # nodes in reverse preorder, so that children come before parents
+        order = []
+        stack = [gtree.root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.children)
+
+        recon = {}
+        for node in reversed(order):
+            children = node.children
+            if not children:
+                name = node.name
+                snode = _species.get(name)
+                if snode is None:
+                    snode = _species[name] = snodes[gene2species(name)]
+                recon[node] = snode
+            elif len(children) == 2:
+                i = first[recon[children[0]]]
+                j = first[recon[children[1]]]
+                if i > j:
+                    i, j = j, i
+                k = log2[j - i + 1]
+                row = table[k]
+                recon[node] = nodes[min(row[i], row[j - (1 << k) + 1]) % size]
+            else:
+                recon[node] = self.reconcile_node(node, recon)
+        return recon
+
+
+    def reconcile_many(self, gtrees, gene2species=phylo.gene2species):
+        """
+        Returns the LCA reconciliations of each gene tree in 'gtrees'
+
+        The species of each gene name is looked up once for all trees.
+        """
+        species = {}
+        return [self.reconcile(gtree, gene2species, species)
+                for gtree in gtrees]
+
+
+    def get_popsizes(self, n):
+        """
+        Returns a dict of population sizes for species tree given 'n'
+        (a number or dict, as for coal.init_popsizes)
+        """
+        if self.popsizes is None or n != self._n:
+            self._n = n
+            self.popsizes = coal.init_popsizes(self.tree, n)
+            self.popsizes_array = c_list(
+                c_double, [self.popsizes[x.name] for x in self.nodes])
+        return self.popsizes
+
+
+    def get_doomtable(self, duprate, lossrate):
+        """
+        Returns the doom table (C array) for the given duplication and
+        loss rates
+        """
+        if self.doomtable is None or (duprate, lossrate) != self._rates:
+            self._rates = (duprate, lossrate)
+            self.doomtable = c_list(c_double, [0] * len(self.nodes))
+            duploss.calcDoomTable(self.ctree, duprate, lossrate,
+                                  self.doomtable)
+        return self.doomtable
+
+
+class _NativeTree (object):
+    """Owns a C++ Tree, which is deleted with this object"""
+
+    def __init__(self, ptr):
+        self.ptr = ptr
+
+    def __del__(self):
+        if self.ptr is not None:
+            deleteTree(self.ptr)
+            self.ptr = None
+
+
+def compile_species_tree(stree, n=None):
+    """
+    Returns a CompiledSpeciesTree for 'stree', which may already be one
+
+    The compiled tree is kept on 'stree', so that functions given the same
+    treelib species tree compile it only once.  A species tree should not
+    be changed after it is compiled.
+    """
+    if isinstance(stree, CompiledSpeciesTree):
+        cstree = stree
+    else:
+        cstree = getattr(stree, "_compiled", None)
+        if cstree is None:
+            cstree = stree._compiled = CompiledSpeciesTree(stree)
+    if n is not None:
+        cstree.get_popsizes(n)
+    return cstree
+
+
+def reconcile_many(gtrees, stree, gene2species=phylo.gene2species):
+    """
+    Returns the LCA reconciliations of each gene tree in 'gtrees' to
+    species tree 'stree', which is indexed once for all of them
+    """
+    return compile_species_tree(stree).reconcile_many(gtrees, gene2species)
+
+
+
+class RandomStream (object):
+    """
+    A random number stream for the native library
+
+    Streams with different (seed, family, chain) keys are independent.
+    Multithreaded native code splits per-thread streams from the stream it
+    is given, so results are reproducible for a given key and thread count.
+    A stream should not be used by two calls at the same time.
+    """
+
+    def __init__(self, seed=0, family=0, chain=0):
+        self.ptr = new_random_stream(seed, family, chain, 0)
+
+    def __del__(self):
+        if self.ptr:
+            delete_random_stream(self.ptr)
+            self.ptr = None
+
+    def seed(self, seed, family=0, chain=0):
+        seed_random_stream(self.ptr, seed, family, chain, 0)
+
+    def random(self):
+        """Returns a uniform random number in [0, 1)"""
+        return random_stream_frand(self.ptr)
+
+    def get_state(self):
+        """Returns the generator state as a tuple of integers"""
+        return _get_stream_state(self.ptr)
+
+    def set_state(self, state):
+        """Restores a generator state from get_state()"""
+        _set_stream_state(self.ptr, state)
+
+
+def mix_seed(*values):
+    """
+    Returns a random seed mixed from 'values' (integers or strings)
+
+    Unlike hash(), the seed is the same on every platform and python build.
+    """
+    text = ":".join("%s" % value for value in values)
+    return int(hashlib.md5(text).hexdigest()[:15], 16)
+
+
+def seed_random(seed, family=0, chain=0):
+    """Seeds the native library's default random stream"""
+    seed_random_stream(default_random_stream(), seed, family, chain, 0)
+
+
+def get_random_state():
+    """Returns the state of the native library's default random stream"""
+    return _get_stream_state(default_random_stream())
+
+
+def set_random_state(state):
+    """Restores the state of the native library's default random stream"""
+    _set_stream_state(default_random_stream(), state)
+
+
+def _get_stream_state(ptr):
+    state = [0] * 4
+    random_stream_get_state(ptr, state)
+    return tuple(state)
+
+
+def _set_stream_state(ptr, state):
+    random_stream_set_state(ptr, list(state))
+
+
 
 def make_recon_array(tree, recon, nodes, snodelookup):
     """Make a reconciliation array from recon dict"""
@@ -0,0 +1,216 @@
+"""
+
+   Indexed archives of reconciled gene trees
+
+   An archive keeps the files of many reconciled gene trees (see
+   dlcoal.write_dlcoal_recon) in one file, as one JSON line per family:
+
+     #dlcoal-archive 1
+     {"coal_recon": TEXT, "coal_tree": TEXT, "daughters": TEXT,
+      "famid": FAMID, "locus_recon": TEXT, "locus_tree": TEXT}
+     ...
+     {"index": {FAMID: OFFSET, ...}}
+     #index OFFSET
+
+   When a writer is closed, the offsets of the records are written as an
+   index after them, followed by a fixed-length trailer with the offset
+   of the index.  Opening an archive reads only the trailer and the index,
+   and each family is then read with one seek.  Appending to an archive
+   writes new records over the old index, and the index is written again
+   on close.  If a writer does not close, the index is rebuilt by scanning
+   the records the next time the archive is opened, and an incomplete last
+   record is ignored.  A family that is written again replaces its earlier
+   record in the index.
+
+"""
+
+import os
+import json
+import fcntl
+import StringIO
+from collections import OrderedDict
+
+import dlcoal
+
+
+MAGIC = "#dlcoal-archive 1\n"
+TRAILER = "#index %020d\n"
+TRAILER_SIZE = len(TRAILER % 0)
+
+
+class ReconArchive (object):
+    """
+    An archive of reconciled gene trees by family id
+
+    mode -- "r" to read, "w" to create a new archive, or "a" to append to
+            an archive (created if it does not exist)
+
+    Only one writer may have an archive open at a time.  A writer in mode
+    "a" waits for the archive to be closed by other writers, and a writer
+    in mode "w" raises an exception instead.
+    """
+
+    def __init__(self, filename, mode="r"):
+        if mode not in ("r", "w", "a"):
+            raise Exception("unknown archive mode '%s'" % mode)
+        self.filename = filename
+        self.mode = mode
+        self._dirty = False
+
+        if mode == "r":
+            self.stream = open(filename, "rb")
+            self._read_index()
+            return
+
+        # the file is only truncated once this writer holds the lock
+        self.stream = os.fdopen(os.open(filename, os.O_RDWR | os.O_CREAT),
+                                "r+b")
+        self._lock()
+        self.stream.seek(0, 2)
+        if mode == "w" or self.stream.tell() == 0:
+            self.stream.seek(0)
+            self.stream.truncate()
+            self.stream.write(MAGIC)
+            self.index = OrderedDict()
+            self._end = len(MAGIC)
+            self._dirty = True
+        else:
+            self.stream.seek(0)
+            self._read_index()
+
+
+    def _lock(self):
+        # appending writers queue up, so that finished results are kept
+        if self.mode == "a":
+            fcntl.lockf(self.stream, fcntl.LOCK_EX)
+            return
+        try:
+            fcntl.lockf(self.stream, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            self.stream.close()
+            raise Exception("archive is open by another writer: %s" %
+                            self.filename)
+
+
+    def _read_index(self):
+        """Reads the index from the trailer, or by scanning the records"""
+
+        stream = self.stream
+        if stream.read(len(MAGIC)) != MAGIC:
+            raise Exception("not a dlcoal archive: %s" % self.filename)
+        stream.seek(0, 2)
+        size = stream.tell()
+
+        if size >= len(MAGIC) + TRAILER_SIZE:
+            stream.seek(size - TRAILER_SIZE)
+            trailer = stream.read(TRAILER_SIZE)
+            if trailer.startswith("#index ") and trailer.endswith("\n"):
+                offset = int(trailer[len("#index "):-1])
+                stream.seek(offset)
+                index = json.loads(stream.readline(),
+                                   object_pairs_hook=OrderedDict)["index"]
+                self.index = OrderedDict((str(famid), offset2)
+                                         for famid, offset2 in
+                                         index.iteritems())
+                self._end = offset
+                return
+
+        # the archive was not closed
+        self.index = OrderedDict()
+        offset = len(MAGIC)
+        stream.seek(offset)
+        for line in iter(stream.readline, ""):
+            if not line.endswith("\n") or line.startswith('{"index"'):
+                break
+            try:
+                famid = json.loads(line)["famid"]
+            except ValueError:
+                break
+            self.index[str(famid)] = offset
+            offset += len(line)
+        self._end = offset
+
+        # a writer repairs the archive
+        if self.mode != "r":
+            stream.seek(offset)
+            stream.truncate()
+            self._dirty = True
+
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __contains__(self, famid):
+        return str(famid) in self.index
+
+    def keys(self):
+        """Returns the family ids in the order they were first written"""
+        return self.index.keys()
+
+
+    def read_files(self, famid):
+        """
+        Returns the files of family 'famid' as a dict of strings, with the
+        keys of the 'exts' of write_dlcoal_recon()
+        """
+        self.stream.seek(self.index[str(famid)])
+        record = json.loads(self.stream.readline())
+        del record["famid"]
+        return dict((str(key), value.encode("utf-8"))
+                    for key, value in record.iteritems())
+
+
+    def read(self, famid, stree):
+        """Reads family 'famid' as in dlcoal.read_dlcoal_recon()"""
+        streams = dict((key, StringIO.StringIO(text)) for key, text in
+                       self.read_files(famid).iteritems())
+        return dlcoal.read_dlcoal_recon("", stree, filenames=streams)
+
+
+    def write_files(self, famid, files):
+        """Writes the files of family 'famid' from a dict of strings"""
+
+        if self.mode == "r":
+            raise Exception("archive is not open for writing: %s" %
+                            self.filename)
+
+        # write over the old index
+        if not self._dirty:
+            self.stream.seek(self._end)
+            self.stream.truncate()
+            self._dirty = True
+
+        record = dict(files)
+        record["famid"] = str(famid)
+        line = json.dumps(record, separators=(",", ":"), sort_keys=True)
+        self.stream.seek(self._end)
+        self.stream.write(line + "\n")
+        self.index[str(famid)] = self._end
+        self._end += len(line) + 1
+
+
+    def write(self, famid, coal_tree, extra):
+        """Writes family 'famid' as in dlcoal.write_dlcoal_recon()"""
+        self.write_files(famid, dlcoal.format_dlcoal_recon(coal_tree, extra))
+
+
+    def flush(self):
+        """Writes the index, so that the archive can be opened quickly"""
+
+        if not self._dirty:
+            return
+        self.stream.seek(self._end)
+        self.stream.write(json.dumps({"index": self.index},
+                                     separators=(",", ":")) + "\n")
+        self.stream.write(TRAILER % self._end)
+        self.stream.flush()
+        self._dirty = False
+
+
+    def close(self):
+        if self.mode != "r":
+            self.flush()
+        self.stream.close()
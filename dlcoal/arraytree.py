@@ -0,0 +1,112 @@
+"""
+
+   Array representation of binary trees
+
+   Nodes are numbered with leaves first and the root last, with internal
+   nodes in post-order, matching the parent arrays from dlcoal.make_ptree()
+   and the native intnode layout.
+
+"""
+
+from array import array
+
+from rasmus import treelib
+
+import dlcoal
+
+
+class ArrayTree (object):
+    """
+    A rooted binary tree stored as parallel arrays
+
+    parent     -- parent index of each node (-1 for root)
+    left       -- first child index of each node (-1 for leaves)
+    right      -- second child index of each node (-1 for leaves)
+    dists      -- branch length of each node
+    names      -- name of each node
+    nodes      -- treelib nodes for each index (if built from a treelib.Tree)
+    nodelookup -- treelib node to index (if built from a treelib.Tree)
+
+    'parent' can be passed directly to the native library as a parent tree.
+    A tree that is evaluated several times (such as the coal tree, which is
+    fixed during a reconciliation search) is converted once.  The arrays
+    are a snapshot: tree searches move the treelib tree, which must then be
+    converted again.
+    """
+
+    def __init__(self, tree=None):
+        self.parent = array("i")
+        self.left = array("i")
+        self.right = array("i")
+        self.dists = array("d")
+        self.names = []
+        self.nleaves = 0
+        self.tree = None
+        self.nodes = None
+        self.nodelookup = None
+
+        if tree is not None:
+            self.set_tree(tree)
+
+
+    def __len__(self):
+        return len(self.parent)
+
+
+    def set_tree(self, tree):
+        """Sets the arrays from a treelib.Tree"""
+
+        ptree, nodes, nodelookup = dlcoal.make_ptree(tree)
+        nnodes = len(nodes)
+
+        self.parent = array("i", ptree)
+        self.left = array("i", [-1] * nnodes)
+        self.right = array("i", [-1] * nnodes)
+        for i, node in enumerate(nodes):
+            if node.children:
+                assert len(node.children) == 2, "tree must be binary"
+                self.left[i] = nodelookup[node.children[0]]
+                self.right[i] = nodelookup[node.children[1]]
+        self.dists = array("d", [node.dist for node in nodes])
+        self.names = [node.name for node in nodes]
+        self.nleaves = len([node for node in nodes if node.is_leaf()])
+
+        self.tree = tree
+        self.nodes = nodes
+        self.nodelookup = nodelookup
+
+
+    def get_tree(self):
+        """Returns a new treelib.Tree with the same topology"""
+
+        tree = treelib.Tree()
+        nodes = [treelib.TreeNode(name) for name in self.names]
+        for i, node in enumerate(nodes):
+            node.dist = self.dists[i]
+            tree.add(node)
+        for i, node in enumerate(nodes):
+            if self.left[i] != -1:
+                tree.add_child(node, nodes[self.left[i]])
+                tree.add_child(node, nodes[self.right[i]])
+        tree.root = nodes[-1]
+
+        ints = [name for name in self.names if isinstance(name, int)]
+        if ints:
+            tree.nextname = max(ints) + 1
+
+        return tree
+
+
+    def root(self):
+        """Returns the index of the root"""
+        return len(self.parent) - 1
+
+
+    def is_leaf(self, node):
+        return self.left[node] == -1
+
+
+    def children(self, node):
+        if self.left[node] == -1:
+            return []
+        return [self.left[node], self.right[node]]
@@ -2,12 +2,14 @@
 from __future__ import division
 
 from math import *
+from array import array
 
-from rasmus import stats, treelib
+from rasmus import stats, treelib, util
 import compbio.coal
 from compbio.coal import *
 
 import dlcoal
+from dlcoal.arraytree import ArrayTree
 from dlcoal.ctypes_export import *
 
 
@@ -26,25 +28,89 @@ if dlcoal.dlcoalc:
     compbio.coal.prob_coal_counts = prob_coal_counts
 
     export(dlcoal.dlcoalc, "prob_multicoal_recon_topology", c_double,
-           [c_int_p, "ptree", c_int, "nnodes", c_int_p, "recon", 
-            c_int_p, "pstree", c_int, "nsnodes", c_double_p, "sdists",
-            c_double_p, "popsizes"])
+           [c_int_array, "ptree", c_int, "nnodes", c_int_array, "recon", 
+            c_int_array, "pstree", c_int, "nsnodes", c_double_array, "sdists",
+            c_double_array, "popsizes"])
 
     export(dlcoal.dlcoalc, "prob_locus_coal_recon_topology", c_double,
-           [c_int_p, "ptree", c_int, "nnodes", c_int_p, "recon", 
-            c_int_p, "plocus_tree", c_void_p, "iltree", c_int, "nlnodes", 
-            c_double_p, "popsizes", c_double_p, "stimes",
-            c_int_p, "daughters", c_int, "ndaughters"])
+           [c_int_array, "ptree", c_int, "nnodes", c_int_array, "recon", 
+            c_int_array, "plocus_tree", c_void_p, "iltree", c_int, "nlnodes", 
+            c_double_array, "popsizes", c_double_array, "stimes",
+            c_int_array, "daughters", c_int, "ndaughters"])
 
     export(dlcoal.dlcoalc, "prob_locus_coal_recon_topology_samples", c_double,
-           [c_int_p, "ptree", c_int, "nnodes", c_int_p, "recon", 
-            c_int_p, "plocus_tree", c_int, "nlocus_nodes", 
-            c_int_p, "locus_recon", c_int_p, "locus_events",
-            c_double_p, "popsizes", 
-            c_int_p, "pstree", c_int, "nsnodes", c_double_p, "stimes",
-            c_int_p, "daughters", c_int, "ndaughters", 
+           [c_int_array, "ptree", c_int, "nnodes", c_int_array, "recon", 
+            c_int_array, "plocus_tree", c_int, "nlocus_nodes", 
+            c_int_array, "locus_recon", c_int_array, "locus_events",
+            c_double_array, "popsizes", 
+            c_int_array, "pstree", c_int, "nsnodes", c_double_array, "stimes",
+            c_int_array, "daughters", c_int, "ndaughters", 
             c_double, "birth", c_double, "death",
-            c_int, "nsamples", c_double, "pretime", c_double, "premean"])
+            c_int, "nsamples", c_double, "pretime", c_double, "premean",
+            c_void_p, "workspace", c_int, "nthreads", c_void_p, "rand"])
+
+    export(dlcoal.dlcoalc, "prob_locus_coal_recon_topology_samples_batch",
+           None,
+           [c_int_array, "ptree", c_int, "nnodes",
+            c_int_array, "recons", c_int, "nrecons",
+            c_int_array, "plocus_tree", c_int, "nlocus_nodes", 
+            c_int_array, "locus_recon", c_int_array, "locus_events",
+            c_double_array, "popsizes", 
+            c_int_array, "pstree", c_int, "nsnodes", c_double_array, "stimes",
+            c_int_array, "daughters", c_int_array, "ndaughters", 
+            c_double, "birth", c_double, "death",
+            c_int, "nsamples", c_double, "pretime", c_double, "premean",
+            c_void_p, "workspace", c_int, "nthreads", c_void_p, "rand",
+            c_void_p, "crn", c_int, "first_sample",
+            c_array_arg(c_double, out=True), "probs",
+            c_array_arg(c_double, out=True), "sqprobs"])
+
+    export(dlcoal.dlcoalc, "new_locus_coal_workspace", c_void_p,
+           [c_int, "nnodes", c_int, "nlocus_nodes"])
+    export(dlcoal.dlcoalc, "delete_locus_coal_workspace", None,
+           [c_void_p, "workspace"])
+
+
+class LocusCoalWorkspace (object):
+    """
+    Preallocated scratch space for the native locus coalescent likelihood
+
+    A workspace can be reused across any number of calls to
+    prob_locus_coal_recon_topology_samples() for coal trees with at most
+    'nnodes' nodes and locus trees with at most 'nlocus_nodes' nodes.  It
+    also keeps the array arguments of those calls (see get_array).
+    """
+
+    def __init__(self, nnodes, nlocus_nodes):
+        self.nnodes = nnodes
+        self.nlocus_nodes = nlocus_nodes
+        self.arrays = {}
+        self.ptr = new_locus_coal_workspace(nnodes, nlocus_nodes)
+
+    def __del__(self):
+        if self.ptr:
+            delete_locus_coal_workspace(self.ptr)
+            self.ptr = None
+
+    def get_array(self, name, typecode, values):
+        """
+        Returns the workspace's array.array 'name' refilled with 'values'
+
+        The array is only valid until the next call with the same name.
+        """
+        arr = self.arrays.get(name)
+        if arr is None:
+            arr = self.arrays[name] = array(typecode)
+        del arr[:]
+        arr.extend(values)
+        return arr
+
+
+def get_array(workspace, name, typecode, values):
+    """Returns 'values' as an array.array, reusing a workspace's if given"""
+    if workspace is None:
+        return array(typecode, values)
+    return workspace.get_array(name, typecode, values)
 
 
 
@@ -62,9 +128,9 @@ def prob_multicoal_recon_topology(tree, recon, stree, n,
     sdists = [snode.dist for snode in snodes]
     
     p = dlcoal.dlcoalc.prob_multicoal_recon_topology(
-        c_list(c_int, ptree), len(nodes), c_list(c_int, recon2),
-        c_list(c_int, pstree), len(snodes), c_list(c_double, sdists),
-        c_list(c_double, popsizes2))
+        c_array(c_int, ptree), len(nodes), c_array(c_int, recon2),
+        c_array(c_int, pstree), len(snodes), c_array(c_double, sdists),
+        c_array(c_double, popsizes2))
     
     return p
 compbio.coal.prob_multicoal_recon_topology = prob_multicoal_recon_topology
@@ -75,7 +141,12 @@ compbio.coal.prob_multicoal_recon_topology = prob_multicoal_recon_topology
 def prob_locus_coal_recon_topology(tree, recon, locus_tree, n, daughters):
 
     ptree, nodes, nodelookup = dlcoal.make_ptree(tree)
-    pltree, lnodes, lnodelookup = dlcoal.make_ptree(locus_tree)
+    if isinstance(locus_tree, ArrayTree):
+        pltree, lnodes = locus_tree.parent, locus_tree.nodes
+        lnodelookup = locus_tree.nodelookup
+        locus_tree = locus_tree.tree
+    else:
+        pltree, lnodes, lnodelookup = dlcoal.make_ptree(locus_tree)
     recon2 = dlcoal.make_recon_array(tree, recon, nodes, lnodelookup)
 
     popsizes = compbio.coal.init_popsizes(locus_tree, n)
@@ -87,49 +158,192 @@ def prob_locus_coal_recon_topology(tree, recon, locus_tree, n, daughters):
     daughters2 = [lnodelookup[lnode] for lnode in daughters]
     
     p = dlcoal.dlcoalc.prob_locus_coal_recon_topology(
-        c_list(c_int, ptree), len(nodes), c_list(c_int, recon2),
-        c_list(c_int, pltree), 0, len(lnodes),
-        c_list(c_double, popsizes2), c_list(c_double, ltimes2),
-        c_list(c_int, daughters2), len(daughters))
+        c_array(c_int, ptree), len(nodes), c_array(c_int, recon2),
+        c_array(c_int, pltree), 0, len(lnodes),
+        c_array(c_double, popsizes2), c_array(c_double, ltimes2),
+        c_array(c_int, daughters2), len(daughters))
     
     return p
 
 
+def prob_coal_recon_topology_bound(lineages, branch_bound=None):
+    """
+    Returns an upper bound on the log probability of a reconciled coal tree
+    within a locus tree, given the lineage counts (a, b) of each locus
+    branch from count_lineages_per_branch()
+
+    Given its lineage counts, a coal tree topology has probability at most
+    the product of k! / num_labeled_histories(a, b) over branches with
+    k = a - b coalescences (coal_branch_bound).  The lineage counts have
+    probability at most one, which 'branch_bound(lnode, a, b)' may improve
+    on (see make_coal_branch_bound).  The bound holds for any duplication
+    times, and with daughters as long as one lineage leaves each daughter.
+    """
+    if branch_bound is None:
+        return sum(coal_branch_bound(a, b)
+                   for a, b in lineages.itervalues())
+    return sum(branch_bound(lnode, a, b)
+               for lnode, (a, b) in lineages.iteritems())
+
+
+def coal_branch_bound(a, b):
+    """Returns the topology term of a branch for a coal recon bound"""
+    return stats.logfactorial(a - b) - log_num_labeled_histories(a, b)
+
+
+def make_coal_branch_bound(locus_tree, locus_recon, locus_events, daughters,
+                           stimes, popsizes):
+    """
+    Returns a function bound(lnode, a, b) for the term of a locus branch in
+    prob_coal_recon_topology_bound()
+
+    stimes   -- timestamps of the species tree
+    popsizes -- population sizes of the species tree by name
+
+    Branches between speciations have fixed lengths, so the probability of
+    their lineage counts is known.  Branches next to a duplication only
+    have a range of lengths, within which a branch without coalescences is
+    most likely at its shortest.  Branches in a daughter subtree are
+    conditioned on coalescing before the duplication and are only bounded
+    by their topology.
+    """
+
+    # range of times of each locus node
+    tranges = {}
+    for node in locus_tree:
+        snode = locus_recon[node]
+        if locus_events[node] == "dup":
+            top = stimes[snode.parent] if snode.parent else util.INF
+            tranges[node] = (stimes[snode], top)
+        else:
+            tranges[node] = (stimes[snode], stimes[snode])
+
+    # branches of daughter subtrees
+    conditioned = set()
+    def walk(node):
+        conditioned.add(node)
+        for child in node.children:
+            if child not in daughters:
+                walk(child)
+    for daughter in daughters:
+        walk(daughter)
+
+    def bound(lnode, a, b):
+        p = coal_branch_bound(a, b)
+        if lnode.parent is None or lnode in conditioned:
+            return p
+        n = popsizes[locus_recon[lnode].name]
+        tmin = tranges[lnode.parent][0] - tranges[lnode][1]
+        tmax = tranges[lnode.parent][1] - tranges[lnode][0]
+        if a == b:
+            return p - a * (a - 1) / 2.0 * max(tmin, 0.0) / n
+        elif tmin == tmax:
+            return p + util.safelog(prob_coal_counts(a, b, tmin, n))
+        return p
+
+    return bound
+
+
 def prob_locus_coal_recon_topology_samples(
     coal_tree, coal_recon,
     locus_tree, locus_recon, locus_events, locus_popsizes,
     stree, stimes,
     daughters,
-    birth, death, nsamples, pretime=None, premean=100.0):
+    birth, death, nsamples, pretime=None, premean=100.0,
+    workspace=None, nthreads=1, rand=None, crn=None):
+
+    return prob_locus_coal_recon_topology_samples_batch(
+        coal_tree, [coal_recon],
+        locus_tree, locus_recon, locus_events, locus_popsizes,
+        stree, stimes, [daughters],
+        birth, death, nsamples, pretime, premean,
+        workspace=workspace, nthreads=nthreads, rand=rand, crn=crn)[0]
+
+
+def prob_locus_coal_recon_topology_samples_batch(
+    coal_tree, coal_recons,
+    locus_tree, locus_recon, locus_events, locus_popsizes,
+    stree, stimes,
+    daughters_list,
+    birth, death, nsamples, pretime=None, premean=100.0,
+    workspace=None, nthreads=1, rand=None, crn=None, first_sample=0,
+    return_squares=False):
+    """
+    Returns the log probabilities of several reconciliations of a coal tree
+    ('coal_recons' with matching 'daughters_list') to the same locus tree.
+
+    All reconciliations are evaluated against the same samples of
+    duplication times.  If 'return_squares' is True, the log mean squared
+    sample probabilities are also returned, as (probs, sqprobs).
+
+    If 'crn' is a dlcoal.RandomStream, sample i draws from its own substream
+    of 'crn' instead of from 'rand', and 'crn' is not advanced.  Calls with
+    the same 'crn' then share the random numbers of each sample.  The
+    samples are numbered from 'first_sample', so that more samples can be
+    added to an estimate.
+    """
 
     if pretime is None:
         pretime = -1
     
 
-    ptree, nodes, nodelookup = dlcoal.make_ptree(coal_tree)
-    pltree, lnodes, lnodelookup = dlcoal.make_ptree(locus_tree)
-    pstree, snodes, snodelookup = dlcoal.make_ptree(stree)
-    
-    crecon2 = dlcoal.make_recon_array(
-        coal_tree, coal_recon, nodes, lnodelookup)
-    lrecon2 = dlcoal.make_recon_array(
-        locus_tree, locus_recon, lnodes, snodelookup)
-    levents2 = dlcoal.make_events_array(lnodes, locus_events)
+    if isinstance(coal_tree, ArrayTree):
+        # coal tree already in array form
+        ptree, nodes = coal_tree.parent, coal_tree.nodes
+        coal_tree = coal_tree.tree
+    else:
+        ptree, nodes, nodelookup = dlcoal.make_ptree(coal_tree)
+    if isinstance(locus_tree, ArrayTree):
+        pltree, lnodes = locus_tree.parent, locus_tree.nodes
+        lnodelookup = locus_tree.nodelookup
+        locus_tree = locus_tree.tree
+    else:
+        pltree, lnodes, lnodelookup = dlcoal.make_ptree(locus_tree)
+    cstree = dlcoal.compile_species_tree(stree)
+
+    # per-call arrays are kept in the workspace across calls
+    crecons2 = get_array(workspace, "recons", "i", [])
+    for coal_recon in coal_recons:
+        crecons2.extend(dlcoal.make_recon_array(
+            coal_tree, coal_recon, nodes, lnodelookup))
+    lrecon2 = get_array(workspace, "locus_recon", "i",
+                        dlcoal.make_recon_array(
+                            locus_tree, locus_recon, lnodes,
+                            cstree.nodelookup))
+    levents2 = get_array(workspace, "locus_events", "i",
+                         dlcoal.make_events_array(lnodes, locus_events))
 
     locus_popsizes = compbio.coal.init_popsizes(locus_tree, locus_popsizes)
-    popsizes2 = [locus_popsizes[lnode.name] for lnode in lnodes]
-
-    stimes2 = [stimes[snode] for snode in snodes]
-
-    daughters2 = [lnodelookup[lnode] for lnode in daughters]
+    popsizes2 = get_array(workspace, "popsizes", "d",
+                          [locus_popsizes[lnode.name] for lnode in lnodes])
+
+    if stimes is cstree.times:
+        stimes2 = cstree.times_array
+    else:
+        stimes2 = c_array(c_double, [stimes[snode] for snode in cstree.nodes])
+
+    daughters2 = get_array(workspace, "daughters", "i", [])
+    for daughters in daughters_list:
+        daughters2.extend(lnodelookup[lnode] for lnode in daughters)
+    ndaughters = get_array(workspace, "ndaughters", "i",
+                           [len(daughters) for daughters in daughters_list])
+    probs = get_array(workspace, "probs", "d", [0.0] * len(coal_recons))
+    sqprobs = get_array(workspace, "sqprobs", "d", [0.0] * len(coal_recons))
     
-    p = dlcoal.dlcoalc.prob_locus_coal_recon_topology_samples(
-        c_list(c_int, ptree), len(nodes), c_list(c_int, crecon2),
-        c_list(c_int, pltree), len(lnodes),
-        c_list(c_int, lrecon2), c_list(c_int, levents2),
-        c_list(c_double, popsizes2),
-        c_list(c_int, pstree), len(snodes), c_list(c_double, stimes2),
-        c_list(c_int, daughters2), len(daughters),
-        birth, death, nsamples, pretime, premean)
+    dlcoal.dlcoalc.prob_locus_coal_recon_topology_samples_batch(
+        c_array(c_int, ptree), len(nodes),
+        c_array(c_int, crecons2), len(coal_recons),
+        c_array(c_int, pltree), len(lnodes),
+        c_array(c_int, lrecon2), c_array(c_int, levents2),
+        c_array(c_double, popsizes2),
+        cstree.ptree_array, len(cstree.nodes), stimes2,
+        c_array(c_int, daughters2), c_array(c_int, ndaughters),
+        birth, death, nsamples, pretime, premean,
+        workspace.ptr if workspace else None, nthreads,
+        rand.ptr if rand else None, crn.ptr if crn else None, first_sample,
+        c_array(c_double, probs), c_array(c_double, sqprobs))
+
+    if return_squares:
+        return list(probs), list(sqprobs)
+    return list(probs)
 
-    return p
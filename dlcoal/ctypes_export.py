@@ -15,6 +15,55 @@ def c_list(c_type, lst):
     list_type = c_type * len(lst)
     return list_type(* lst)
 
+
+# buffer typecodes (array module and numpy dtype.char) for each C type
+_c_typecodes = {c_int: "i", c_float: "f", c_double: "d"}
+
+def c_array(c_type, obj):
+    """
+    Make a C array from a sequence, sharing memory when possible
+
+    ctypes arrays of 'c_type' are passed through unchanged.  Contiguous,
+    writable buffers of the matching element type (array.array or numpy
+    arrays) are wrapped without copying, so that changes made by C are
+    visible to the caller.  Any other sequence is copied as with c_list().
+    """
+    if isinstance(obj, Array) and obj._type_ is c_type:
+        return obj
+
+    typecode = getattr(obj, "typecode", None)
+    if typecode is None:
+        dtype = getattr(obj, "dtype", None)
+        if dtype is not None and obj.flags["C_CONTIGUOUS"]:
+            typecode = dtype.char
+    if typecode is not None and typecode == _c_typecodes.get(c_type):
+        try:
+            return (c_type * len(obj)).from_buffer(obj)
+        except TypeError:
+            # read-only buffer
+            pass
+
+    return c_list(c_type, obj)
+
+
+class _ArrayArg (tuple):
+    """An array argument declaration: (pointer type, conversion function)"""
+    out = False
+
+
+def c_array_arg(c_type, out=False):
+    """
+    Declares an array argument of element type 'c_type' for Exporter.export()
+    
+    The argument accepts ctypes arrays, buffers (zero-copy) or lists.  If
+    'out' is True, the argument is written by C, and lists passed for it
+    are updated with its contents after the call.
+    """
+    arg = _ArrayArg((POINTER(c_type), lambda x: c_array(c_type, x)))
+    arg.out = out
+    return arg
+
+
 def c_matrix(c_type, mat):
     """Make a C matrix from a list of lists (mat)"""
 
@@ -38,6 +87,10 @@ c_float_list = (c_float_p, lambda x: c_list(c_float, x))
 c_float_matrix = (c_float_p_p, lambda x: c_matrix(c_float, x))
 c_int_matrix = (c_int_p_p, lambda x: c_matrix(c_int, x))
 
+c_int_array = c_array_arg(c_int)
+c_float_array = c_array_arg(c_float)
+c_double_array = c_array_arg(c_double)
+
 
 class Exporter (object):
 
@@ -54,6 +107,11 @@ class Exporter (object):
         return_type -- return type of function
         prototypes  -- a list defining the function prototype
                        e.g. [type1, name1, type2, name2, type3, name3, ...]
+                       Array arguments may be declared by element type with
+                       c_array_arg(c_type) (e.g. c_int_array), in which case
+                       buffers are passed to C without copying.  Only lists
+                       passed for output arrays (c_array_arg(c_type,
+                       out=True)) are updated after the call.
         env         -- environment to export to
         newname     -- if given, the name of the function after export
                        (default: funcname)
@@ -89,6 +147,10 @@ class Exporter (object):
             for i, argtype in enumerate(prototypes[0::2]):
                 if argtype in (c_int_list, c_float_list, c_float_matrix):
                     sizes[i] = len(args[i])
+                elif (isinstance(argtype, _ArrayArg) and argtype.out and
+                      isinstance(args[i], list)):
+                    # lists are copied, so pass back their contents
+                    sizes[i] = len(args[i])
 
             # convert arguments to c types
             cargs = [f(a) for f, a in zip(converts, args)]
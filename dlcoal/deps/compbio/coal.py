@@ -19,7 +19,7 @@ import itertools
 from itertools import chain, izip
 from math import *
 import random
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
 # rasmus imports
 from rasmus import treelib, stats, util, linked_list
@@ -1164,8 +1164,10 @@ def coal_cond_lineage_counts(lineages, sroot, sleaves, popsizes, stimes, T,
     """Sample coalescent times conditioned on lineage counts"""
 
     # init reconciliation and subtree dicts
+    # (subtrees are joined in queue order, so that a random seed gives the
+    # same tree in every process)
     recon = {}
-    subtrees = {}
+    subtrees = OrderedDict()
     caps = set()
 
     # sample coalescent times
@@ -1391,10 +1393,12 @@ def make_tree_from_times(times, k=None, t=None, leaves=None, capped=False):
     tree = treelib.Tree()
 
     # initialize k children
+    # (a list rather than a set, so that a random seed gives the same tree
+    # in every process)
     if leaves is None:
-        children = set(treelib.TreeNode(tree.new_name()) for i in xrange(k))
+        children = [treelib.TreeNode(tree.new_name()) for i in xrange(k)]
     else:
-        children = set(treelib.TreeNode(name) for name in leaves)
+        children = [treelib.TreeNode(name) for name in leaves]
     for child in children:
         tree.add(child)
         child.data["time"] = 0.0
@@ -1409,10 +1413,10 @@ def make_tree_from_times(times, k=None, t=None, leaves=None, capped=False):
         tree.add_child(parent, a)
         tree.add_child(parent, b)
 
-        # adjust children set
+        # adjust children list
         children.remove(a)
         children.remove(b)
-        children.add(parent)
+        children.append(parent)
 
 
     # set branch lengths
@@ -1,5 +1,6 @@
 
 import random
+from array import array
 
 from rasmus import treelib
 
@@ -9,6 +10,7 @@ import dlcoal
 
 
 import dlcoal
+from dlcoal.arraytree import ArrayTree
 from dlcoal.ctypes_export import *
 
 #=============================================================================
@@ -22,39 +24,73 @@ if dlcoal.dlcoalc:
 
     export(dlcoal.dlcoalc, "calcDoomTable", c_int,
            [c_void_p, "tree", c_float, "birth", c_float, "death",
-            c_double_p, "doomtable"])
+            c_array_arg(c_double, out=True), "doomtable"])
     
     export(dlcoal.dlcoalc, "birthDeathTreePriorFull", c_double,
            [c_void_p, "tree", c_void_p, "stree",
-            c_int_p, "recon", c_int_p, "events",
+            c_int_array, "recon", c_int_array, "events",
             c_float, "birth", c_float, "death",
-            c_double_p, "doomtable"])
+            c_double_array, "doomtable"])
 
+    export(dlcoal.dlcoalc, "new_prescreener", c_void_p,
+           [c_int_array, "pstree", c_int, "nsnodes",
+            c_float_array, "sdists"])
 
-def prob_dup_loss(tree, stree, recon, events, duprate, lossrate):
-    """Returns the topology prior of a gene tree"""
+    export(dlcoal.dlcoalc, "delete_prescreener", None,
+           [c_void_p, "pre"])
+
+    export(dlcoal.dlcoalc, "prescreen_propose", c_int,
+           [c_void_p, "pre", c_int_array, "ptree", c_int, "nnodes",
+            c_int_array, "gene2species", c_float, "birth", c_float, "death",
+            c_double_array, "doomtable", c_int, "npool",
+            c_double, "nni_weight", c_void_p, "rand",
+            c_array_arg(c_int, out=True), "chosen_ptree",
+            c_array_arg(c_double, out=True), "scores"])
+
+
+def prob_dup_loss(tree, stree, recon, events, duprate, lossrate,
+                  doomtable=None):
+    """
+    Returns the topology prior of a gene tree
+
+    'tree' may be a treelib.Tree or a dlcoal.arraytree.ArrayTree, and 'stree'
+    a treelib.Tree or a dlcoal.CompiledSpeciesTree.  The doom table is taken
+    from the compiled species tree's cache unless 'doomtable' is given.
+    """
+
+    cstree = dlcoal.compile_species_tree(stree)
+    stree = cstree.tree
+
+    if isinstance(tree, ArrayTree):
+        atree = tree
+        tree = tree.tree
+    else:
+        atree = None
 
     if dlcoal.dlcoalc:
         if events is None:
             events = phylo.label_events(tree, recon)
 
-        ptree, nodes, nodelookup = dlcoal.make_ptree(tree)
-        pstree, snodes, snodelookup = dlcoal.make_ptree(stree)
+        if atree is not None:
+            # tree already in array form
+            ptree, nodes = atree.parent, atree.nodes
+        else:
+            ptree, nodes, nodelookup = dlcoal.make_ptree(tree)
 
-        ctree = dlcoal.tree2ctree(tree)
-        cstree = dlcoal.tree2ctree(stree)
-        recon2 = dlcoal.make_recon_array(tree, recon, nodes, snodelookup)
+        ctree = dlcoal.ptree2ctree(ptree)
+        dlcoal.setTreeDists(ctree, c_list(c_float, [x.dist for x in nodes]))
+        recon2 = dlcoal.make_recon_array(tree, recon, nodes,
+                                         cstree.nodelookup)
         events2 = dlcoal.make_events_array(nodes, events)
 
-        doomtable = c_list(c_double, [0] * len(stree.nodes))
-        dlcoal.dlcoalc.calcDoomTable(cstree, duprate, lossrate, doomtable)
+        if doomtable is None:
+            doomtable = cstree.get_doomtable(duprate, lossrate)
 
-        p = dlcoal.dlcoalc.birthDeathTreePriorFull(ctree, cstree,
-                                    c_list(c_int, recon2), 
-                                    c_list(c_int, events2),
+        p = dlcoal.dlcoalc.birthDeathTreePriorFull(ctree, cstree.ctree,
+                                    c_array(c_int, recon2), 
+                                    c_array(c_int, events2),
                                     duprate, lossrate, doomtable)
         dlcoal.dlcoalc.deleteTree(ctree)
-        dlcoal.dlcoalc.deleteTree(cstree)
 
         return p
 
@@ -71,12 +107,70 @@ def prob_dup_loss(tree, stree, recon, events, duprate, lossrate):
             events=events)
 
 
+class Prescreener (object):
+    """
+    Native prescreening of gene tree proposals
+
+    Scores pools of NNI and SPR moves by their duplication-loss prior in
+    native code, as compbio.phylo.TreeSearchPrescreen does in python.
+    """
+
+    def __init__(self, stree):
+        self.cstree = dlcoal.compile_species_tree(stree)
+        self.ptr = new_prescreener(
+            self.cstree.ptree_array, len(self.cstree.nodes),
+            [node.dist for node in self.cstree.nodes])
+
+    def __del__(self):
+        if self.ptr:
+            delete_prescreener(self.ptr)
+            self.ptr = None
+
+    def get_species(self, nodes, gene2species):
+        """Returns the species index of each leaf in 'nodes' (-1 otherwise)"""
+        snodes = self.cstree.tree.nodes
+        return [self.cstree.nodelookup[snodes[gene2species(node.name)]]
+                if node.is_leaf() else -1
+                for node in nodes]
+
+    def propose(self, ptree, nodes, gene2species, duprate, lossrate,
+                poolsize, nni_weight=.4, rand=None, species=None):
+        """
+        Proposes a new gene tree topology from a prescreened pool
+
+        The gene tree is given as a parent array 'ptree' over 'nodes' (see
+        dlcoal.make_ptree).  The chosen topology keeps the indices of the
+        leaves and the root, so it can be passed back in as the next
+        'ptree', along with the 'species' of get_species().  Returns
+        (chosen, index, scores) where 'chosen' is the parent array of the
+        chosen topology, 'index' is its position in the pool, and 'scores'
+        are the log priors of the pool.
+        """
+
+        if species is None:
+            species = self.get_species(nodes, gene2species)
+        chosen = array("i", [0] * len(nodes))
+        scores = array("d", [0.0] * poolsize)
+
+        index = dlcoal.dlcoalc.prescreen_propose(
+            self.ptr, c_array(c_int, ptree), len(nodes),
+            c_array(c_int, species), duprate, lossrate,
+            self.cstree.get_doomtable(duprate, lossrate), poolsize,
+            nni_weight, rand.ptr if rand else None,
+            c_array(c_int, chosen), c_array(c_double, scores))
+
+        return list(chosen), index, list(scores)
+
+
 def sample_dup_times(tree, stree, recon, birth, death,
                      pretime=None, premean=None, events=None):
     """
     Sample duplication times for a gene tree in the dup-loss model
     """
 
+    if isinstance(stree, dlcoal.CompiledSpeciesTree):
+        stree = stree.tree
+
     if events is None:
         events = phylo.label_events(tree, recon)
 
@@ -1,5 +1,10 @@
 
-import sys, copy
+import sys, os, copy, random, time, weakref
+import cPickle
+from math import exp, log, sqrt
+import multiprocessing
+import StringIO
+from collections import OrderedDict
 
 import dlcoal
 from dlcoal import duploss
@@ -19,10 +24,57 @@ def dlcoal_recon(tree, stree, gene2species,
                  nsamples=100, nprescreen=20,
                  search=None,
                  init_locus_tree=None,
-                 log=sys.stdout):
+                 nthreads=1, rand=None, common_random=False,
+                 cache_size=1000,
+                 nchains=1, nprocs=1, share_interval=None,
+                 incremental=False, coal_recons=0,
+                 screen=None, stop=None, checkpoint=None,
+                 family=0, log=sys.stdout, log_interval=1, verbose=True):
     """
     Perform reconciliation using the DLCoal model
 
+    If 'common_random' is True, proposals are evaluated with common random
+    numbers, so that they are compared with less noise: sample i of every
+    proposal draws from the same substream of a fixed stream (see
+    dlcoal.coal.prob_locus_coal_recon_topology_samples_batch).  Identical
+    proposals then get identical estimates.  Duplication times are sampled
+    by rejection, so proposals with different duplications still share
+    the variates of a sample only up to the first difference.  This needs
+    the native library.
+
+    The probabilities of the last 'cache_size' distinct proposals are
+    cached, so that repeated proposals are not evaluated again.
+
+    If 'nchains' > 1, that many independent search chains are run with
+    different random seeds using 'nprocs' processes.  Every 'share_interval'
+    iterations (default: never) the chains whose best reconciliation is
+    worse than the best of all chains continue from the latter.
+    'init_locus_tree' may then also be a list of trees that are assigned to
+    the chains in turn.  The best reconciliation of all chains is returned.
+    The random numbers of a chain are keyed by the gene family id 'family'
+    and the chain (see dlcoal.RandomStream).
+
+    If 'incremental' is True, locus trees are not rerooted after each
+    search move, so that their reconciliations can be updated along the
+    changed paths only, and accepted reconciliations are kept as
+    copy-on-write snapshots (see DLCoalReconProposer).  Otherwise every
+    proposal copies and reconciles the whole locus tree.
+
+    If 'coal_recons' > 0, each locus tree is followed by up to that many
+    proposals of other coal reconciliations, enumerated with branch and
+    bound so that those that cannot beat the best reconciliation are not
+    evaluated (see enum_coal_recon_bounded).
+
+    Proposals are screened with few samples if 'screen' is a SearchScreen,
+    the search stops early by the rules of 'stop' if it is a SearchStop,
+    and the search state is written to a file if 'checkpoint' is a
+    SearchCheckpoint.  Checkpoints are not supported with multiple chains.
+    The reason for stopping is given in maxrecon['data']['stop_reason'].
+
+    Every 'log_interval' proposal is written to 'log' (see
+    dlcoal.LogWriter).  If 'verbose' is True, the search progress is written
+    with util.logger().
+
     Returns maxrecon defined as
 
     maxrecon = {'coal_recon': coal_recon,
@@ -34,21 +86,372 @@ def dlcoal_recon(tree, stree, gene2species,
     
     """
 
+    # prepare species tree once for all evaluations
+    stree = dlcoal.compile_species_tree(stree, n)
+
     if search is None:
         search = lambda tree: DLCoalTreeSearch(tree, stree, gene2species,
                                                duprate, lossrate,
                                                nprescreen=nprescreen)
 
-    reconer = DLCoalRecon(tree, stree, gene2species,
-                          n, duprate, lossrate,
-                          pretime=pretime, premean=premean,
-                          nsamples=nsamples, log=log,
-                          init_locus_tree=init_locus_tree)
-    reconer.set_proposer(DLCoalReconProposer(
-        tree, stree, gene2species, search=search))
+    kwargs = dict(tree=tree, stree=stree, gene2species=gene2species,
+                  n=n, duprate=duprate, lossrate=lossrate,
+                  pretime=pretime, premean=premean, nsamples=nsamples,
+                  search=search, nthreads=nthreads, rand=rand,
+                  common_random=common_random, cache_size=cache_size,
+                  incremental=incremental, coal_recons=coal_recons,
+                  screen=screen, stop=stop,
+                  log_interval=log_interval, verbose=verbose)
+
+    if checkpoint:
+        if nchains > 1:
+            raise Exception("checkpoints are not supported with "
+                            "multiple chains")
+        kwargs.update(checkpoint=checkpoint)
+
+    if nchains > 1:
+        if not isinstance(init_locus_tree, (list, tuple)):
+            init_locus_tree = [init_locus_tree]
+        return recon_chains(kwargs, nsearch, nchains, nprocs,
+                            share_interval, init_locus_tree, log,
+                            family=family)
+
+    reconer = make_recon(init_locus_tree=init_locus_tree, log=log, **kwargs)
     return reconer.recon(nsearch).get_dict()
 
 
+def make_recon(tree, stree, gene2species, n, duprate, lossrate, search,
+               incremental=False, coal_recons=0, **kwargs):
+    """Returns a DLCoalRecon that searches with 'search'"""
+    reconer = DLCoalRecon(tree, stree, gene2species,
+                          n, duprate, lossrate, **kwargs)
+    if coal_recons > 0:
+        proposer = DLCoalReconProposer(
+            tree, stree, gene2species, search=search,
+            incremental=incremental, num_coal_recons=coal_recons,
+            bound_coal_recons=True, n=n)
+    else:
+        proposer = DLCoalReconProposer(
+            tree, stree, gene2species, search=search,
+            incremental=incremental)
+    reconer.set_proposer(proposer)
+    return reconer
+
+
+#=============================================================================
+# multiple search chains
+
+# arguments of make_recon() for chain processes (inherited when forked)
+_chain_args = None
+
+
+def recon_chains(kwargs, nsearch, nchains, nprocs=1, share_interval=None,
+                 init_locus_trees=[None], log=sys.stdout, family=0):
+    """
+    Runs several search chains and returns the best reconciliation
+
+    kwargs           -- arguments for make_recon()
+    nsearch          -- number of search iterations per chain
+    nchains          -- number of chains
+    nprocs           -- number of processes
+    share_interval   -- number of iterations between sharing the best
+                        reconciliation (default: never)
+    init_locus_trees -- initial locus trees assigned to chains in turn
+    family           -- gene family id for the random streams of the chains
+
+    Between intervals each chain is kept as its search state (see
+    DLCoalRecon.get_state), so that it continues with its own cache, random
+    numbers and best reconciliation.
+    """
+    global _chain_args
+
+    if share_interval is None or share_interval <= 0:
+        share_interval = nsearch
+    seed = random.randint(0, sys.maxint)
+    logging = not isinstance(log, dlcoal.NullLog)
+    locus_trees = [init_locus_trees[i % len(init_locus_trees)]
+                   for i in xrange(nchains)]
+    locus_trees = [x.get_one_line_newick(root_data=True) if x else None
+                   for x in locus_trees]
+
+    _chain_args = kwargs
+    if nprocs > 1:
+        pool = multiprocessing.Pool(min(nprocs, nchains))
+        mapfunc = pool.map
+    else:
+        pool = None
+        mapfunc = map
+
+    states = [None] * nchains
+    best = None
+    try:
+        end = 0
+        while end < nsearch:
+            end = min(end + share_interval, nsearch)
+            results = mapfunc(_recon_chain, [
+                (chain, seed, family, end, locus_trees[chain], states[chain],
+                 best, logging)
+                for chain in xrange(nchains)])
+
+            # chains keep their best reconciliations, so the best of the
+            # last interval is the best of all
+            maxp = -util.INF
+            maxrecon = None
+            for chain, (p, recon, state, text) in enumerate(results):
+                log.write(text)
+                states[chain] = state
+                if maxrecon is None or p > maxp:
+                    maxp = p
+                    maxrecon = recon
+            log.flush()
+            best = (maxp, maxrecon)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        _chain_args = None
+
+    return unpack_recon(maxrecon, kwargs["tree"], kwargs["stree"])
+
+
+def _recon_chain(args):
+    """
+    Runs one chain up to iteration 'end', continuing from its search state
+    if given
+
+    A chain that is between the coal reconciliations of a locus tree at the
+    end of an interval skips the rest of them.
+    """
+
+    chain, seed, family, end, locus_tree, state, best, logging = args
+
+    # each chain has its own random numbers
+    random.seed(dlcoal.mix_seed(seed, family, chain))
+    kwargs = dict(_chain_args)
+    if dlcoal.dlcoalc:
+        kwargs["rand"] = dlcoal.RandomStream(seed, family=family, chain=chain)
+    if state:
+        # the search tree must have the node names of the state
+        locus_tree = make_tree_from_state(state["proposer"]["locus_tree"])
+
+        # each interval is logged to a new stream, which needs its own
+        # locus records
+        state["log"] = ({}, state["log"][1], None)
+    elif locus_tree:
+        locus_tree = treelib.parse_newick(locus_tree)
+
+    log = StringIO.StringIO() if logging else dlcoal.NullLog()
+    reconer = make_recon(init_locus_tree=locus_tree, chain=chain, log=log,
+                         **kwargs)
+    maxrecon = reconer.recon(end, state=state, share=best)
+
+    return (reconer.maxp, pack_recon(maxrecon.get_dict()),
+            reconer.get_state(end), log.getvalue() if logging else "")
+
+
+def pack_recon(recon):
+    """Converts a reconciliation dict into names for pickling"""
+    return {"locus_tree": recon["locus_tree"].get_one_line_newick(
+                root_data=True),
+            "coal_recon": [(x.name, y.name) for x, y in
+                           recon["coal_recon"].iteritems()],
+            "locus_recon": [(x.name, y.name) for x, y in
+                            recon["locus_recon"].iteritems()],
+            "locus_events": [(x.name, y) for x, y in
+                             recon["locus_events"].iteritems()],
+            "daughters": [x.name for x in recon["daughters"]],
+            "data": dict(recon["data"])}
+
+
+def unpack_recon(data, coal_tree, stree):
+    """Converts a reconciliation from pack_recon() back into a dict"""
+    if isinstance(stree, dlcoal.CompiledSpeciesTree):
+        stree = stree.tree
+    locus_tree = treelib.parse_newick(data["locus_tree"])
+    lnodes = locus_tree.nodes
+    return {"locus_tree": locus_tree,
+            "coal_recon": dict((coal_tree.nodes[x], lnodes[y])
+                               for x, y in data["coal_recon"]),
+            "locus_recon": dict((lnodes[x], stree.nodes[y])
+                                for x, y in data["locus_recon"]),
+            "locus_events": dict((lnodes[x], y)
+                                 for x, y in data["locus_events"]),
+            "daughters": set(lnodes[x] for x in data["daughters"]),
+            "data": dict(data["data"])}
+
+
+#=============================================================================
+# search options
+
+class SearchScreen (object):
+    """
+    Screening of proposals with few samples
+
+    Proposals are first evaluated with 'samples' samples and only evaluated
+    with all samples when the screening estimate plus 'z' standard errors
+    could beat the best so far.  The full evaluation then adds the
+    remaining samples to the screening samples.
+    """
+
+    def __init__(self, samples, z=2.0):
+        self.samples = samples
+        self.z = z
+        self.reset()
+
+    def reset(self):
+        """Clears the counts of screened and fully evaluated proposals"""
+        self.nscreened = 0
+        self.nfull = 0
+
+    def upper_bound(self, info):
+        """
+        Returns an upper confidence bound of the probability of a
+        proposal from the 'info' of its screening evaluation
+        """
+
+        coal_prob = info["coal_prob"]
+        if coal_prob == -util.INF:
+            return -util.INF
+
+        # relative standard error of the mean sample probability
+        relvar = max(exp(info["coal_prob_sq"] - 2 * coal_prob) - 1.0, 0.0)
+        relerr = sqrt(relvar / self.samples)
+
+        return info["prob"] + log(1.0 + self.z * relerr)
+
+    def get_state(self):
+        return (self.nscreened, self.nfull)
+
+    def set_state(self, state):
+        self.nscreened, self.nfull = state
+
+
+class SearchStop (object):
+    """
+    Rules for stopping a search early
+
+    The search stops after 'stop_iters' iterations without improvement,
+    after 'max_time' seconds, after 'max_evals' probability evaluations, or
+    when the best log probability improved by less than the fraction
+    'min_improve' over the last 'improve_window' iterations.  Rules that
+    are None are not used.
+    """
+
+    def __init__(self, stop_iters=None, max_time=None, max_evals=None,
+                 min_improve=None, improve_window=100):
+        self.stop_iters = stop_iters
+        self.max_time = max_time
+        self.max_evals = max_evals
+        self.min_improve = min_improve
+        self.improve_window = improve_window
+        self.reset()
+
+    def reset(self):
+        """Starts the rules for a new search"""
+        self.reason = None
+        self.start_time = time.time()
+        self.last_improve = 0
+        self.window_maxp = -util.INF
+
+    def check(self, niters, maxp, nevals):
+        """
+        Returns the reason for stopping the search after 'niters'
+        iterations with best probability 'maxp' and 'nevals' evaluations,
+        or None to continue.  The reason is also kept in self.reason.
+        """
+        self.reason = self._check(niters, maxp, nevals)
+        return self.reason
+
+    def _check(self, niters, maxp, nevals):
+        if (self.stop_iters is not None and
+            niters - self.last_improve >= self.stop_iters):
+            return "no improvement in %d iterations" % self.stop_iters
+
+        if (self.max_time is not None and
+            time.time() - self.start_time >= self.max_time):
+            return "time limit of %g seconds" % self.max_time
+
+        if self.max_evals is not None and nevals >= self.max_evals:
+            return "evaluation limit of %d" % self.max_evals
+
+        if self.min_improve is not None and \
+           niters % self.improve_window == 0:
+            if (self.window_maxp > -util.INF and
+                maxp - self.window_maxp <=
+                self.min_improve * abs(self.window_maxp)):
+                return "improvement below %g in %d iterations" % (
+                    self.min_improve, self.improve_window)
+            self.window_maxp = maxp
+
+        return None
+
+    def get_state(self):
+        return (self.reason, self.last_improve, self.window_maxp,
+                time.time() - self.start_time)
+
+    def set_state(self, state):
+        self.reason, self.last_improve, self.window_maxp, elapsed = state
+        self.start_time = time.time() - elapsed
+
+
+class SearchCheckpoint (object):
+    """
+    Checkpoints of a search in the file 'filename'
+
+    The search state is written about every 'interval' iterations and when
+    the search ends.  If 'resume' is True and the file exists, the search
+    continues from it with the same results as an uninterrupted search.
+    """
+
+    def __init__(self, filename, interval=100, resume=False):
+        self.filename = filename
+        self.interval = interval
+        self.resume = resume
+        self.reset()
+
+    def reset(self):
+        self.due = False
+
+    def can_resume(self):
+        """Returns True if the search should continue from the file"""
+        return self.resume and os.path.exists(self.filename)
+
+    def is_due(self, niters, ready):
+        """
+        Returns True if a checkpoint should be written after 'niters'
+        iterations.  A due checkpoint waits until the search is 'ready'.
+        """
+        if niters % self.interval == 0:
+            self.due = True
+        if self.due and ready:
+            self.due = False
+            return True
+        return False
+
+    def write(self, state):
+        """Writes a search state to the file"""
+        tmpfile = self.filename + ".tmp"
+        out = open(tmpfile, "wb")
+        cPickle.dump(state, out, cPickle.HIGHEST_PROTOCOL)
+        out.close()
+        os.rename(tmpfile, self.filename)
+
+    def read(self):
+        """Reads the search state written by write()"""
+        infile = open(self.filename, "rb")
+        state = cPickle.load(infile)
+        infile.close()
+        return state
+
+    def get_state(self):
+        return self.due
+
+    def set_state(self, state):
+        self.due = state
+
+
+#=============================================================================
+# search
 
 class DLCoalRecon (object):
 
@@ -57,11 +460,15 @@ class DLCoalRecon (object):
                  pretime=None, premean=None,
                  nsamples=100,
                  init_locus_tree=None,
-                 name_internal="n", log=sys.stdout):
+                 nthreads=1, rand=None, common_random=False,
+                 cache_size=1000, screen=None, stop=None, checkpoint=None,
+                 chain=None, name_internal="n", log=sys.stdout,
+                 log_interval=1, verbose=True):
 
         # init coal tree
         self.coal_tree = tree
-        self.stree = stree
+        self.cstree = dlcoal.compile_species_tree(stree, n)
+        self.stree = self.cstree.tree
         self.gene2species = gene2species
         self.n = n
         self.duprate = duprate
@@ -69,12 +476,36 @@ class DLCoalRecon (object):
         self.pretime = pretime
         self.premean = premean
         self.nsamples = nsamples
+        self.nthreads = nthreads
+        self.rand = rand
+        self.common_random = common_random
+        self.random_state = None
+        self.crn = None
+        self.chain = chain
         self.name_internal = name_internal
         self.log_stream = log
+        self.log_interval = log_interval
+        self.log_writer = dlcoal.LogWriter(log, log_interval)
+        self.verbose = verbose
         self.init_locus_tree = init_locus_tree \
                                if init_locus_tree else tree.copy()
+        self.workspace = None
+        self.coal_array = None
+
+        # cache of proposal probabilities (least recently used first)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
 
-        self.proposer = DLCoalReconProposer(tree, stree, gene2species)
+        # search options keep the state of one search, so each search
+        # has its own copy
+        self.screen = copy.copy(screen) if screen else None
+        self.stop = copy.copy(stop) if stop else SearchStop()
+        self.checkpoint = copy.copy(checkpoint) if checkpoint else None
+        self.nevals = 0
+
+        self.proposer = DLCoalReconProposer(tree, self.cstree, gene2species)
 
 
     def set_proposer(self, proposer):
@@ -84,33 +515,181 @@ class DLCoalRecon (object):
 
     def set_log(self, log):
         self.log_stream = log
+        self.log_writer = dlcoal.LogWriter(log, self.log_interval)
         
 
-    def recon(self, nsearch=1000):
-        """Perform reconciliation"""
+    def recon(self, nsearch=1000, state=None, share=None):
+        """
+        Perform reconciliation
+
+        If 'state' is given (see get_state), the search continues from it
+        up to 'nsearch' iterations in total.  If 'share' is the probability
+        and packed reconciliation (see pack_recon) of a better
+        reconciliation found by another chain, the search continues from
+        that one instead.
+        """
         
         self.init_search()
         proposal = self.proposer.init_proposal()
         self.maxrecon = proposal.copy()
-        for i in xrange(nsearch):
-            if i % 10 == 0:
-                print "search", i
+
+        start = 0
+        resumed = False
+        if state is None and self.checkpoint and self.checkpoint.can_resume():
+            state = self.checkpoint.read()
+            resumed = True
+        if state is not None:
+            start = self.set_state(state, nsearch)
+            if share and share[0] > self.maxp:
+                self.share_recon(share[0], share[1], start)
+            if not self.stop.reason and start < nsearch:
+                proposal = self.proposer.next_proposal()
+
+        for i in xrange(start, nsearch):
+            if self.stop.reason:
+                break
+            if self.verbose and i % 10 == 0:
+                util.logger("search", i)
 
             util.tic("eval")
             p = self.eval_proposal(proposal)
             util.toc()
 
             util.tic("prop")
+            maxp = self.maxp
             self.eval_search(p, proposal)
-            proposal = self.proposer.next_proposal()
+            if self.maxp > maxp:
+                self.stop.last_improve = i + 1
+
+            if not self.stop.check(i + 1, self.maxp, self.nevals):
+                self.checkpoint_search(i + 1)
+                proposal = self.proposer.next_proposal()
             util.toc()
-        
+
+        self.log_writer.flush()
+        if self.checkpoint:
+            self.checkpoint.write(self.get_state(nsearch))
+
         # rename locus tree nodes
         dlcoal.rename_nodes(self.maxrecon.locus_tree, self.name_internal)
+        self.maxrecon.data["stop_reason"] = (
+            self.stop.reason or "completed %d iterations" % nsearch)
+        if resumed:
+            self.maxrecon.data["resumed_at"] = start
+        if self.cache_size > 0:
+            self.maxrecon.data["cache_hits"] = self.cache_hits
+            self.maxrecon.data["cache_misses"] = self.cache_misses
+        if self.screen:
+            self.maxrecon.data["nscreened"] = self.screen.nscreened
+            self.maxrecon.data["nfull"] = self.screen.nfull
         
         return self.maxrecon
 
 
+    def checkpoint_search(self, niters):
+        """
+        Writes a checkpoint after 'niters' iterations if one is due
+
+        Checkpoints are only written before the proposal of a new locus
+        tree, so a due checkpoint may be delayed by a few iterations.
+        """
+
+        if self.checkpoint and self.checkpoint.is_due(
+                niters, self.proposer.at_locus_proposal()):
+            self.checkpoint.write(self.get_state(niters))
+
+
+    def get_state(self, niters):
+        """
+        Returns the search state after 'niters' iterations as a picklable
+        object
+
+        The state includes every random number stream used by the search,
+        so that a search continued with set_state() makes the same
+        proposals as an uninterrupted one.
+        """
+
+        state = {
+            "niters": niters,
+            "proposer": self.proposer.get_state(),
+            "maxp": self.maxp,
+            "maxrecon": pack_recon(self.maxrecon.get_dict()),
+            "cache": self.cache.items(),
+            "counts": (self.cache_hits, self.cache_misses, self.nevals),
+            "screen": self.screen.get_state() if self.screen else None,
+            "stop": self.stop.get_state(),
+            "checkpoint": (self.checkpoint.get_state()
+                           if self.checkpoint else None),
+            "log": self.log_writer.get_state(),
+            "random_state": self.random_state,
+            "random": random.getstate(),
+            "rand": self.rand.get_state() if self.rand else None,
+            "native_random": (dlcoal.get_random_state()
+                              if dlcoal.dlcoalc else None)}
+        return state
+
+
+    def set_state(self, state, nsearch=None):
+        """
+        Restores a search state from get_state() after init_search()
+
+        'nsearch' is the number of iterations of the continued search.  If
+        the search of the state is finished, the log written after it (by
+        the searches of other families) is kept.
+
+        Returns the number of iterations done.
+        """
+
+        self.proposer.set_state(state["proposer"])
+
+        self.maxp = state["maxp"]
+        self.maxrecon = self._unpack_recon(state["maxrecon"])
+        self.cache = OrderedDict(state["cache"])
+        (self.cache_hits, self.cache_misses, self.nevals) = state["counts"]
+        if self.screen and state["screen"]:
+            self.screen.set_state(state["screen"])
+        self.stop.set_state(state["stop"])
+        if self.checkpoint and state["checkpoint"]:
+            self.checkpoint.set_state(state["checkpoint"])
+        self.proposer.set_maxp(self.maxp)
+
+        # a finished search keeps the log of the searches after it
+        finished = (self.stop.reason or
+                    (nsearch is not None and state["niters"] >= nsearch))
+        self.log_writer.set_state(state["log"], truncate=not finished)
+
+        # random numbers are restored last, after the proposer has used them
+        self.set_crn(state["random_state"])
+        random.setstate(state["random"])
+        if self.rand and state["rand"]:
+            self.rand.set_state(state["rand"])
+        if dlcoal.dlcoalc and state["native_random"]:
+            dlcoal.set_random_state(state["native_random"])
+
+        return state["niters"]
+
+
+    def share_recon(self, maxp, maxrecon, niters):
+        """
+        Continues the search after 'niters' iterations from a better
+        reconciliation 'maxrecon' (see pack_recon) with probability 'maxp'
+        """
+
+        self.maxp = maxp
+        self.maxrecon = self._unpack_recon(maxrecon)
+        self.stop.last_improve = niters
+        self.proposer.set_maxp(maxp)
+        self.proposer.restart(self.maxrecon.locus_tree.copy())
+
+
+    def _unpack_recon(self, data):
+        """Returns a Recon from pack_recon()"""
+        recon = unpack_recon(data, self.coal_tree, self.stree)
+        return Recon(recon["coal_recon"], recon["locus_tree"],
+                     recon["locus_recon"], recon["locus_events"],
+                     recon["daughters"], data=recon["data"])
+
+
     def init_search(self):
         """Initialize new search"""
 
@@ -121,6 +700,42 @@ class DLCoalRecon (object):
         
         self.maxp = - util.INF
         self.maxrecon = None
+        self.proposer.set_maxp(self.maxp)
+        self.cache.clear()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.nevals = 0
+        if self.screen:
+            self.screen.reset()
+        self.stop.reset()
+        if self.checkpoint:
+            self.checkpoint.reset()
+
+        # the coal tree is fixed during search, so convert it once
+        self.coal_array = dlcoal.arraytree.ArrayTree(self.coal_tree)
+
+        # scratch space for the native likelihood, reused by every proposal
+        if dlcoal.dlcoalc:
+            nnodes = len(self.coal_tree.nodes)
+            self.workspace = dlcoal.coal.LocusCoalWorkspace(nnodes, nnodes)
+
+            # common random numbers: the substreams of a stream fixed at
+            # the start of the search give the variates of each sample
+            if self.common_random:
+                if self.rand:
+                    self.set_crn(self.rand.get_state())
+                else:
+                    self.set_crn(dlcoal.get_random_state())
+
+
+    def set_crn(self, state):
+        """Sets the stream of common random numbers from a stream state"""
+        self.random_state = state
+        if state is None:
+            self.crn = None
+        else:
+            self.crn = dlcoal.RandomStream()
+            self.crn.set_state(state)
 
 
     def next_proposal(self):
@@ -131,9 +746,29 @@ class DLCoalRecon (object):
     def eval_proposal(self, proposal):
         """Compute probability of proposal"""
 
-        #util.tic("eval")
-        # compute recon probability
-        info = {}
+        if self.cache_size <= 0:
+            return self._eval_proposal(proposal)
+
+        key = proposal.get_key()
+        entry = self.cache.pop(key, None)
+        if entry is not None:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            entry = (self._eval_proposal(proposal), proposal.data)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+        self.cache[key] = entry
+
+        p, data = entry
+        proposal.data = dict(data)
+        return p
+
+
+    def _eval_proposal(self, proposal):
+        """Compute probability of proposal without the cache"""
+
+        self.nevals += 1
 
         # DEBUG
         counts = coal.count_lineages_per_branch(self.coal_tree,
@@ -143,23 +778,90 @@ class DLCoalRecon (object):
         #util.logger("max lineage count %d" % maxcount)
         if maxcount > 10:
             return -util.INF
-        
-        p = dlcoal.prob_dlcoal_recon_topology(self.coal_tree,
+
+        # screen with fewer samples
+        screen = self.screen
+        if screen and self.maxp > -util.INF:
+            p, info = self._eval_samples(proposal, screen.samples)
+            if screen.upper_bound(info) < self.maxp:
+                info["stage"] = 1
+                proposal.data = info
+                screen.nscreened += 1
+                return p
+
+            # add the remaining samples to the screening samples
+            more = self.nsamples - screen.samples
+            if more > 0:
+                p2, info2 = self._eval_samples(
+                    proposal, more, first_sample=screen.samples)
+                p, info = self._combine_samples(
+                    info, screen.samples, info2, more)
+        else:
+            p, info = self._eval_samples(proposal, self.nsamples)
+
+        if screen:
+            info["stage"] = 2
+            screen.nfull += 1
+        proposal.data = info
+
+        return p
+
+
+    def _eval_samples(self, proposal, nsamples, first_sample=0):
+        """
+        Compute probability of proposal using 'nsamples' samples
+
+        Returns (p, info).  'p' is on the same scale as a full evaluation
+        with self.nsamples samples.  With common random numbers, the samples
+        are numbered from 'first_sample'.
+        """
+
+        info = {}
+
+        p = dlcoal.prob_dlcoal_recon_topology(self.coal_array,
                                               proposal.coal_recon,
                                               proposal.locus_tree,
                                               proposal.locus_recon,
                                               proposal.locus_events,
                                               proposal.daughters,
-                                              self.stree, self.n,
+                                              self.cstree, self.n,
                                               self.duprate, self.lossrate,
                                               self.pretime, self.premean,
-                                              nsamples=self.nsamples,
+                                              nsamples=nsamples,
                                               add_spec=False,
-                                              info=info)
-        proposal.data = info
-        #util.toc()
+                                              info=info,
+                                              workspace=self.workspace,
+                                              nthreads=self.nthreads,
+                                              rand=self.rand,
+                                              crn=self.crn,
+                                              first_sample=first_sample)
+        if nsamples != self.nsamples:
+            p += log(nsamples) - log(self.nsamples)
+            info["prob"] = p
         
-        return p
+        return p, info
+
+
+    def _combine_samples(self, info, nsamples, info2, nsamples2):
+        """
+        Combines the infos of two evaluations of a proposal with 'nsamples'
+        and 'nsamples2' samples into one with all of them
+
+        Returns (p, info) as _eval_samples() does.
+        """
+
+        total = nsamples + nsamples2
+        info2["coal_prob"] = stats.logadd(
+            info["coal_prob"] + log(nsamples),
+            info2["coal_prob"] + log(nsamples2)) - log(total)
+        info2["coal_prob_sq"] = stats.logadd(
+            info["coal_prob_sq"] + log(nsamples),
+            info2["coal_prob_sq"] + log(nsamples2)) - log(total)
+
+        p = (info2["duploss_prob"] + info2["daughters_prob"] +
+             info2["coal_prob"] - log(self.nsamples))
+        info2["prob"] = p
+        return p, info2
 
 
     def eval_search(self, p, proposal):
@@ -175,21 +877,52 @@ class DLCoalRecon (object):
             self.proposer.accept()
         else:
             self.proposer.reject()
+        self.proposer.set_maxp(self.maxp)
 
 
     def log_proposal(self, proposal):
-        self.log_stream.write(repr(proposal) + "\n")
-        self.log_stream.flush()
+        if self.chain is not None:
+            proposal.data["chain"] = self.chain
+        self.log_writer.write_recon(proposal)
 
 
 
 class DLCoalReconProposer (object):
+    """
+    Proposes reconciliations by searching over locus trees
+
+    By default every proposed locus tree is a rerooted copy that is
+    reconciled from scratch.  If 'incremental' is True, the search tree
+    itself is proposed without rerooting, and its reconciliations are
+    patched in place along the paths changed by each move (see
+    update_recon_lca).  The patches are undone when the move is reverted.
+    Proposals then share the search tree and are only valid until the next
+    proposal; Recon.copy() returns a ReconSnapshot of them (see ReconLog).
+    Only this mode keeps accepted reconciliations copy-on-write; by default
+    each proposal owns its tree copy and Recon.copy() shares it.
+
+    If 'bound_coal_recons' is True, each locus tree is followed by up to
+    'num_coal_recons' proposals of other coal reconciliations from
+    enum_coal_recon_bounded(), which skips those that cannot beat the best
+    probability given to set_maxp().  If the population size 'n' is
+    given, the bound includes the lineage counts of branches with known
+    lengths (see dlcoal.coal.make_coal_branch_bound).  Otherwise the
+    enumeration is not bounded and starts with the LCA reconciliation again.
+    """
 
     def __init__(self, coal_tree, stree, gene2species,
                  search=phylo.TreeSearchNni,
-                 num_coal_recons=1): # DEBUG
+                 num_coal_recons=1, # DEBUG
+                 incremental=False, bound_coal_recons=False,
+                 coal_recon_depth=2, n=None):
         self._coal_tree = coal_tree
-        self._stree = stree
+        self._cstree = dlcoal.compile_species_tree(stree)
+        if n is not None:
+            self._stimes = self._cstree.times
+            self._popsizes = self._cstree.get_popsizes(n)
+        else:
+            self._stimes = self._popsizes = None
+        self._stree = self._cstree.tree
         self._gene2species = gene2species
         self._locus_search = search(None)
 
@@ -197,10 +930,22 @@ class DLCoalReconProposer (object):
         self._num_coal_recons = num_coal_recons
         self._i_coal_recons = 0
         self._coal_recon_enum = None
-        self._coal_recon_depth = 2
+        self._coal_recon_depth = coal_recon_depth
         self._accept_locus = False
+        self._bound_coal_recons = bound_coal_recons
+        self._coal_recon_lca = None
+        self._maxp = -util.INF
 
         self._recon = None
+
+        # incremental reconciliation of the search tree
+        self._incremental = incremental
+        self._locus_recon = None
+        self._locus_events = None
+        self._coal_recon = None
+        self._coal_nodes = None
+        self._undo = None
+        self._log = None
         
 
     def set_locus_tree(self, locus_tree):
@@ -212,7 +957,11 @@ class DLCoalReconProposer (object):
         if self._locus_search.get_tree() is None:
             self._locus_search.set_tree(self._coal_tree.copy())
         self._i_coal_recons = 0
-        self._recon = self._recon_lca(self._locus_search.get_tree().copy())
+        if self._incremental:
+            self._recon = self._init_recon_lca(self._locus_search.get_tree())
+        else:
+            self._recon = self._recon_lca(
+                self._locus_search.get_tree().copy())
         
         return self._recon
 
@@ -226,12 +975,17 @@ class DLCoalReconProposer (object):
             # propose new locus_tree
             
             # if locus_tree has not yet been accepted, then revert it
-            if not self._accept_locus:
-                self._locus_search.revert()
+            self._revert_locus()
                 
             self._locus_search.propose()
             self._accept_locus = False
             self._i_coal_recons = 0
+
+            if self._incremental:
+                self._recon = self._update_recon_lca(
+                    self._locus_search.get_tree())
+                return self._recon
+                
             locus_tree = self._locus_search.get_tree().copy()
             
             # TODO: make recon root optional
@@ -247,18 +1001,125 @@ class DLCoalReconProposer (object):
             
             try:
                 self._i_coal_recons += 1
-                self._coal_recon_enum.next()
+                if self._bound_coal_recons:
+                    self._recon = self._next_coal_recon_bounded()
+                else:
+                    if self._coal_recon_enum is None:
+                        # enumerate on a copy to keep the live coal_recon
+                        self._recon.coal_recon = \
+                            self._recon.coal_recon.copy()
+                        self._coal_recon_enum = phylo.enum_recon(
+                            self._coal_tree, self._recon.locus_tree,
+                            recon=self._recon.coal_recon,
+                            depth=self._coal_recon_depth)
+                    self._coal_recon_enum.next()
             except StopIteration:
-                self._i_coal_recon = self._num_coal_recons
+                self._i_coal_recons = self._num_coal_recons
                 return self.next_proposal()
 
         return self._recon
 
 
+    def _next_coal_recon_bounded(self):
+        """
+        Returns the next proposal of a coal reconciliation to the current
+        locus tree, or raises StopIteration
+        """
+
+        if self._coal_recon_lca is None:
+            # the proposal before is the evaluated LCA reconciliation.  Its
+            # duplication-loss and daughters terms are the same for every
+            # coal reconciliation, so only the coal term is bounded.
+            lca = self._recon
+            if "duploss_prob" in lca.data and "daughters_prob" in lca.data:
+                base = lca.data["duploss_prob"] + lca.data["daughters_prob"]
+            else:
+                base = util.INF
+            if self._popsizes is not None:
+                branch_bound = dlcoal.coal.make_coal_branch_bound(
+                    lca.locus_tree, lca.locus_recon, lca.locus_events,
+                    lca.daughters, self._stimes, self._popsizes)
+            else:
+                branch_bound = None
+            self._coal_recon_lca = lca
+            self._coal_recon_enum = enum_coal_recon_bounded(
+                self._coal_tree, lca.locus_tree, lca.coal_recon,
+                lca.daughters, self._coal_recon_depth,
+                lambda: self._maxp - base, branch_bound)
+
+        lca = self._coal_recon_lca
+        return Recon(self._coal_recon_enum.next(), lca.locus_tree,
+                     lca.locus_recon, lca.locus_events, lca.daughters,
+                     source=lca.source)
+
+
+    def set_maxp(self, maxp):
+        """Sets the best probability found, for bounding coal recons"""
+        self._maxp = maxp
+
+
+    def _revert_locus(self):
+        """Reverts the last locus tree proposal unless it was accepted"""
+        if not self._accept_locus:
+            self._locus_search.revert()
+            if self._undo:
+                self._undo.undo()
+                self._undo = None
+            self._accept_locus = True
+
+
+    def at_locus_proposal(self):
+        """
+        Returns True if the next proposal is a new locus tree, so that the
+        search state can be saved with get_state()
+        """
+        return (self._i_coal_recons >= self._num_coal_recons or
+                len(self._locus_search.get_tree().leaves()) <= 2)
+
+
+    def get_state(self):
+        """
+        Returns the search state as a picklable object
+
+        Must only be called when at_locus_proposal() is True.  A rejected
+        locus tree is reverted first.
+        """
+        self._revert_locus()
+        return {"locus_tree": get_tree_state(self._locus_search.get_tree()),
+                "search": get_search_state(self._locus_search)}
+
+
+    def set_state(self, state):
+        """
+        Restores a search state from get_state()
+
+        The locus search tree must have the same node names as the one the
+        state was saved from.  The next call to next_proposal() proposes a
+        new locus tree.
+        """
+        set_tree_state(self._locus_search.get_tree(), state["locus_tree"])
+        set_search_state(self._locus_search, state["search"])
+        self.init_proposal()
+        self._i_coal_recons = self._num_coal_recons
+        self._accept_locus = True
+
+
+    def restart(self, locus_tree):
+        """
+        Continues the search from 'locus_tree'
+
+        The next call to next_proposal() proposes a new locus tree.
+        """
+        self._revert_locus()
+        self._locus_search.set_tree(locus_tree)
+        self.init_proposal()
+        self._i_coal_recons = self._num_coal_recons
+        self._accept_locus = True
+
+
     def _recon_lca(self, locus_tree):
         # get locus tree, and LCA locus_recon
-        locus_recon = phylo.reconcile(locus_tree, self._stree,
-                                      self._gene2species)
+        locus_recon = self._cstree.reconcile(locus_tree, self._gene2species)
         locus_events = phylo.label_events(locus_tree, locus_recon)
 
         # propose LCA coal_recon
@@ -275,12 +1136,57 @@ class DLCoalReconProposer (object):
             self._coal_tree, locus_tree,
             recon=coal_recon,
             depth=self._coal_recon_depth)
+        self._coal_recon_lca = None
 
 
         return Recon(coal_recon, locus_tree, locus_recon, locus_events,
                      daughters)
 
 
+    def _init_recon_lca(self, locus_tree):
+        """Reconciles the search tree from scratch for incremental updates"""
+
+        self._locus_recon = self._cstree.reconcile(locus_tree,
+                                                   self._gene2species)
+        self._locus_events = phylo.label_events(locus_tree,
+                                                self._locus_recon)
+        self._coal_recon = phylo.reconcile(self._coal_tree,
+                                           locus_tree, lambda x: x)
+        self._coal_nodes = get_recon_inverse(locus_tree, self._coal_recon)
+        self._undo = None
+        self._log = ReconLog(locus_tree, self._locus_recon,
+                             self._locus_events, self._coal_recon)
+
+        return self._make_recon(locus_tree)
+
+
+    def _update_recon_lca(self, locus_tree):
+        """Patches the search tree reconciliations after a move"""
+
+        changed = get_move_nodes(self._locus_search)
+        if changed is None:
+            changed = [node for node in locus_tree if not node.is_leaf()]
+
+        self._undo = ReconUndo()
+        update_recon_lca(changed, self._cstree,
+                         self._locus_recon, self._locus_events,
+                         self._coal_recon, self._coal_nodes, self._undo)
+        self._log.touch(changed, self._undo)
+
+        return self._make_recon(locus_tree)
+
+
+    def _make_recon(self, locus_tree):
+        daughters = self._propose_daughters(
+            self._coal_tree, self._coal_recon,
+            locus_tree, self._locus_recon, self._locus_events)
+        self._coal_recon_enum = None
+        self._coal_recon_lca = None
+
+        return Recon(self._coal_recon, locus_tree, self._locus_recon,
+                     self._locus_events, daughters, source=self._log)
+
+
     def _propose_daughters(self, coal_tree, coal_recon,
                            locus_tree, locus_recon, locus_events):
         return propose_daughters(coal_tree, coal_recon,
@@ -294,13 +1200,221 @@ class DLCoalReconProposer (object):
         pass
 
 
+#=============================================================================
+# incremental reconciliation
+
+class ReconUndo (object):
+    """An undo record for changes to reconciliation dicts"""
+
+    def __init__(self):
+        self.changes = []
+
+    def set(self, dct, key, value):
+        """Sets dct[key] to 'value' and records the old value"""
+        old = dct[key]
+        if old is not value:
+            self.changes.append((dct, key, old))
+            dct[key] = value
+
+    def undo(self):
+        """Restores all recorded values"""
+        for dct, key, value in reversed(self.changes):
+            dct[key] = value
+        self.changes = []
+
+
+def get_recon_inverse(tree, recon):
+    """
+    Returns a dict mapping each node of 'tree' to the frozenset of nodes
+    reconciled to it in 'recon'
+    """
+    inverse = dict((node, set()) for node in tree)
+    for node, snode in recon.iteritems():
+        inverse[snode].add(node)
+    return dict((node, frozenset(nodes)) for node, nodes in
+                inverse.iteritems())
+
+
+def get_move_nodes(search):
+    """
+    Returns the nodes whose children were changed by the last proposal of
+    a tree search, or None if they are not known
+    """
+
+    if isinstance(search, DLCoalTreeSearch):
+        return get_move_nodes(search.search)
+    elif isinstance(search, phylo.TreeSearchMix):
+        return get_move_nodes(search.methods[search.last_propose][0])
+    elif isinstance(search, phylo.TreeSearchUnique):
+        return get_move_nodes(search.search)
+    elif isinstance(search, phylo.TreeSearchNni):
+        if search.node1 is None:
+            return []
+        return [search.node1, search.node2]
+    elif isinstance(search, phylo.TreeSearchSpr):
+        if search.node1 is None:
+            return []
+        # new parent of subtree, its parent, and new parent of old sibling
+        c = search.node1.parent
+        return [c, c.parent, search.node2.parent]
+    elif isinstance(search, DLCoalPrescreen):
+        return search.changed
+    else:
+        return None
+
+
+def update_recon_lca(changed, stree, locus_recon, locus_events,
+                     coal_recon, coal_nodes, undo):
+    """
+    Updates LCA reconciliations after a topology change of a locus tree
+
+    changed      -- locus nodes whose children were changed
+    stree        -- species tree (or a CompiledSpeciesTree, whose LCA
+                    index is then reused)
+    locus_recon  -- LCA reconciliation of the locus tree to 'stree'
+    locus_events -- events of the locus tree
+    coal_recon   -- LCA reconciliation of a coal tree to the locus tree
+    coal_nodes   -- inverse of 'coal_recon' (see get_recon_inverse)
+    undo         -- ReconUndo recording every change
+
+    Only the locus nodes on the paths from 'changed' up to their LCA can
+    gain or lose leaves.  Since every other locus node keeps its leaf set,
+    only these nodes and the coal nodes reconciled to them are updated.
+    """
+
+    if not changed:
+        return
+    cstree = dlcoal.compile_species_tree(stree)
+
+    # locus nodes whose leaf sets may have changed
+    top = treelib.lca(changed)
+    path = set([top])
+    for node in changed:
+        while node not in path:
+            path.add(node)
+            node = node.parent
+
+    # update locus recon from the bottom of the paths up
+    def walk(node):
+        for child in node.children:
+            if child in path:
+                walk(child)
+        undo.set(locus_recon, node,
+                 cstree.reconcile_node(node, locus_recon))
+    walk(top)
+    for node in path:
+        undo.set(locus_events, node,
+                 phylo.label_events_node(node, locus_recon))
+
+    # update coal nodes reconciled to the paths
+    affected = set()
+    for node in path:
+        affected.update(coal_nodes[node])
+    def walk(node):
+        for child in node.children:
+            if child in affected:
+                walk(child)
+        old = coal_recon[node]
+        new = treelib.lca([coal_recon[child] for child in node.children])
+        if new is not old:
+            undo.set(coal_recon, node, new)
+            undo.set(coal_nodes, old, coal_nodes[old] - frozenset([node]))
+            undo.set(coal_nodes, new, coal_nodes[new] | frozenset([node]))
+    for node in affected:
+        if node.parent not in affected:
+            walk(node)
+
+
+#=============================================================================
+# search state
+
+def get_tree_state(tree):
+    """Returns the topology and branch lengths of a tree by node name"""
+    return (tree.root.name, tree.nextname,
+            [(node.name, [child.name for child in node.children], node.dist)
+             for node in tree])
+
+
+def make_tree_from_state(state):
+    """Returns a new tree from get_tree_state()"""
+    tree = treelib.Tree()
+    for name, children, dist in state[2]:
+        tree.add(treelib.TreeNode(name))
+    set_tree_state(tree, state)
+    return tree
+
+
+def set_tree_state(tree, state):
+    """
+    Sets the topology and branch lengths of a tree from get_tree_state()
+
+    The tree must have the same node names.  Its nodes are kept, so that
+    iteration over tree.nodes is unchanged.
+    """
+    root, nextname, nodes = state
+    for name, children, dist in nodes:
+        node = tree.nodes[name]
+        node.children = [tree.nodes[child] for child in children]
+        for child in node.children:
+            child.parent = node
+        node.dist = dist
+    tree.root = tree.nodes[root]
+    tree.root.parent = None
+    tree.nextname = nextname
+
+
+def get_search_state(search):
+    """
+    Returns the state that a tree search keeps between proposals, other
+    than its tree (see set_search_state)
+    """
+
+    if isinstance(search, DLCoalTreeSearch):
+        return get_search_state(search.search)
+    elif isinstance(search, phylo.TreeSearchMix):
+        return [get_search_state(method) for method, weight in
+                search.methods]
+    elif isinstance(search, phylo.TreeSearchUnique):
+        return (set(search.seen), get_search_state(search.search))
+    elif isinstance(search, phylo.TreeSearchPrescreen):
+        return get_search_state(search.search)
+    elif isinstance(search, DLCoalPrescreen):
+        if search.prescreener:
+            return search.rand.get_state()
+        return None
+    else:
+        return None
+
+
+def set_search_state(search, state):
+    """Restores the state of a tree search from get_search_state()"""
+
+    if isinstance(search, DLCoalTreeSearch):
+        set_search_state(search.search, state)
+    elif isinstance(search, phylo.TreeSearchMix):
+        for (method, weight), state2 in zip(search.methods, state):
+            set_search_state(method, state2)
+    elif isinstance(search, phylo.TreeSearchUnique):
+        search.seen = set(state[0])
+        set_search_state(search.search, state[1])
+    elif isinstance(search, phylo.TreeSearchPrescreen):
+        set_search_state(search.search, state)
+    elif isinstance(search, DLCoalPrescreen):
+        search._ptree = None
+        if search.prescreener and state:
+            search.rand.set_state(state)
+
+
 def propose_daughters(coal_tree, coal_recon, locus_tree, locus_events):
 
     lineages = coal.count_lineages_per_branch(
         coal_tree, coal_recon, locus_tree)
     daughters = set()
 
-    for node, event in locus_events.iteritems():
+    # visit nodes in a fixed order, so that the same random numbers choose
+    # the same daughters
+    for node, event in sorted(locus_events.iteritems(),
+                              key=lambda x: x[0].name):
         if event == "dup":
             # choose one of the children of node to be a daughter
             children = [child for child in node.children
@@ -312,28 +1426,153 @@ def propose_daughters(coal_tree, coal_recon, locus_tree, locus_events):
 
 
 
+#=============================================================================
+# bounded coal recon enumeration
+
+def enum_coal_recon_bounded(coal_tree, locus_tree, coal_recon, daughters,
+                            depth, get_minp, branch_bound=None):
+    """
+    Enumerates coal reconciliations near 'coal_recon' with branch and bound
+
+    As in phylo.enum_recon(), reconciliations are made by moving up to
+    'depth' coal nodes up one locus branch each, and moving them again.
+    Each is yielded as a new dict, except 'coal_recon' itself.
+
+    Every reconciliation is scored with the upper bound from
+    dlcoal.coal.prob_coal_recon_topology_bound() with 'branch_bound', which
+    is updated after each move from the two changed locus branches.
+    Reconciliations whose bound is below get_minp() are not yielded, and
+    further moves are not made when no sequence of them can raise the
+    topology part of the bound above get_minp().
+    Reconciliations that leave more than one lineage above a daughter are
+    impossible and also not yielded.
+    """
+
+    recon = dict(coal_recon)
+    lineages = coal.count_lineages_per_branch(coal_tree, recon, locus_tree)
+    preorder = list(coal_tree.preorder())
+    topology_bound = dlcoal.coal.coal_branch_bound
+    if branch_bound is None:
+        branch_bound = lambda lnode, a, b: topology_bound(a, b)
+    bounds = dict((lnode, branch_bound(lnode, a, b))
+                  for lnode, (a, b) in lineages.iteritems())
+    tops = dict((lnode, topology_bound(a, b))
+                for lnode, (a, b) in lineages.iteritems())
+    score = [sum(bounds.itervalues()), sum(tops.itervalues())]
+
+    def move(node, lnode, lnode2):
+        # move node from locus branch 'lnode' to its parent 'lnode2', or
+        # back if 'lnode2' is the child
+        if lnode2 == lnode.parent:
+            lineages[lnode][1] += 1
+            lineages[lnode2][0] += 1
+        else:
+            lineages[lnode][0] -= 1
+            lineages[lnode2][1] -= 1
+        recon[node] = lnode2
+        for x in (lnode, lnode2):
+            a, b = lineages[x]
+            p = branch_bound(x, a, b)
+            score[0] += p - bounds[x]
+            bounds[x] = p
+            p = topology_bound(a, b)
+            score[1] += p - tops[x]
+            tops[x] = p
+
+    def max_gain(nmoves):
+        # the rest of branch_bound() is at most zero, and a move from
+        # branch L changes the topology part by at most
+        # log(C(b+1, 2) / k) with b and k after earlier moves, and a move
+        # into the parent branch never raises it
+        gain = 0.0
+        for lnode, (a, b) in lineages.iteritems():
+            if lnode.parent is None or b + nmoves < 2:
+                continue
+            k = max(1, a - b - nmoves + 1)
+            gain = max(gain, log((b + nmoves) * (b + nmoves - 1) / 2.0 / k))
+        return nmoves * gain
+
+    def walk(step, depth):
+        for i in xrange(step, len(preorder)):
+            node = preorder[i]
+            if not phylo.can_change_recon_up(recon, node):
+                continue
+            lnode = recon[node]
+            move(node, lnode, lnode.parent)
+
+            if (score[0] >= get_minp() and
+                all(lineages[d][1] == 1 for d in daughters)):
+                yield dict(recon)
+            if depth > 1 and score[1] + max_gain(depth - 1) >= get_minp():
+                for recon2 in walk(i, depth - 1):
+                    yield recon2
+
+            move(node, lnode.parent, lnode)
+
+    if depth > 0 and score[0] + max_gain(depth) >= get_minp():
+        for recon2 in walk(0, depth):
+            yield recon2
+
+
+
 class Recon (object):
     """
     The reconciliation datastructure for the DLCoal model
     """
     
     def __init__(self, coal_recon, locus_tree, locus_recon, locus_events,
-                 daughters, data=None):
+                 daughters, data=None, source=None):
         self.coal_recon = coal_recon
         self.locus_tree = locus_tree
         self.locus_recon = locus_recon
         self.locus_events = locus_events
         self.daughters = daughters
 
+        # ReconLog of a proposer that still changes the locus tree and dicts
+        self.source = source
+
         if data is None:
             self.data = {}
         else:
             self.data = data
 
     def copy(self):
+        """
+        Returns a copy that stays valid after later proposals
+
+        With a 'source' (incremental proposals only) this is a snapshot of
+        the source log, otherwise the tree and dicts are shared.
+        """
+        if self.source:
+            return self.source.snapshot(self)
         return Recon(self.coal_recon,
                      self.locus_tree, self.locus_recon, self.locus_events,
-                     self.daughters, data=copy.deepcopy(self.data))
+                     self.daughters, data=dict(self.data))
+
+
+    def get_key(self):
+        """
+        Returns a canonical key for the reconciliation
+
+        Locus tree nodes are identified by their subtree topology, so that
+        the key does not depend on internal node names.
+        """
+
+        hashes = {}
+        for node in self.locus_tree.postorder():
+            if node.is_leaf():
+                hashes[node] = node.name
+            else:
+                hashes[node] = "(%s)" % ",".join(
+                    sorted(hashes[child] for child in node.children))
+
+        return (hashes[self.locus_tree.root],
+                tuple(sorted((hashes[node], self.locus_recon[node].name,
+                              self.locus_events[node])
+                             for node in self.locus_tree)),
+                tuple(sorted((node.name, hashes[lnode])
+                             for node, lnode in self.coal_recon.iteritems())),
+                tuple(sorted(hashes[node] for node in self.daughters)))
 
 
     def get_dict(self):
@@ -341,7 +1580,8 @@ class Recon (object):
                 "locus_tree": self.locus_tree,
                 "locus_recon": self.locus_recon,
                 "locus_events": self.locus_events,
-                "daughters": self.daughters}
+                "daughters": self.daughters,
+                "data": self.data}
     
     
     def __repr__(self):
@@ -358,6 +1598,170 @@ class Recon (object):
                      "data": self.data})
 
 
+
+class ReconLog (object):
+    """
+    A log of changes to a live locus tree and its reconciliations
+
+    The live tree and dicts are copied once as a base.  Each snapshot then
+    stores only the children and dict values changed since the snapshot
+    before it, and is only built into a full reconciliation when it is
+    read (see ReconSnapshot).  Changes older than every live snapshot are
+    merged into the base.  Only DLCoalReconProposer with 'incremental' set
+    uses a log.
+    """
+
+    def __init__(self, locus_tree, locus_recon, locus_events, coal_recon):
+        self.locus_tree = locus_tree
+        self.dicts = (locus_recon, locus_events, coal_recon)
+
+        self.base_children = dict((node, tuple(node.children))
+                                  for node in locus_tree)
+        self.base_dicts = tuple(dict(dct) for dct in self.dicts)
+        self.entries = []
+        self.offset = 0
+        self.snapshots = []
+
+        # changes since the last snapshot
+        self.touched = set()
+        self.touched_keys = tuple(set() for dct in self.dicts)
+
+
+    def touch(self, nodes, undo):
+        """
+        Records that 'nodes' had their children changed, and that the
+        changes in the ReconUndo 'undo' were made
+        """
+        self.touched.update(nodes)
+        for dct, key, value in undo.changes:
+            for dct2, keys in zip(self.dicts, self.touched_keys):
+                if dct is dct2:
+                    keys.add(key)
+
+
+    def snapshot(self, recon):
+        """Returns a ReconSnapshot of the live reconciliation 'recon'"""
+
+        self.entries.append((
+            dict((node, tuple(node.children)) for node in self.touched),
+            tuple(dict((key, dct[key]) for key in keys)
+                  for dct, keys in zip(self.dicts, self.touched_keys))))
+        self.touched = set()
+        self.touched_keys = tuple(set() for dct in self.dicts)
+
+        # a coal recon being enumerated is not logged
+        coal_recon = None
+        if recon.coal_recon is not self.dicts[2]:
+            coal_recon = dict(recon.coal_recon)
+
+        return self.add_snapshot(ReconSnapshot(
+            self, self.offset + len(self.entries),
+            recon.daughters, coal_recon, dict(recon.data)))
+
+
+    def add_snapshot(self, snap):
+        """Registers a snapshot that needs the log to be built"""
+        self.snapshots.append(weakref.ref(snap))
+        self._merge()
+        return snap
+
+
+    def _merge(self):
+        """Merges entries that no unbuilt snapshot needs into the base"""
+
+        self.snapshots = [ref for ref in self.snapshots
+                          if ref() is not None and ref().log is not None]
+        version = min([ref().version for ref in self.snapshots] +
+                      [self.offset + len(self.entries)])
+        while self.offset < version:
+            children, changes = self.entries.pop(0)
+            self.base_children.update(children)
+            for dct, changes2 in zip(self.base_dicts, changes):
+                dct.update(changes2)
+            self.offset += 1
+
+
+    def build(self, version):
+        """
+        Returns (locus_tree, locus_recon, locus_events, coal_recon, lnodes)
+        as of snapshot 'version', where 'lnodes' maps live locus nodes to
+        nodes of the new locus tree
+        """
+
+        children = dict(self.base_children)
+        dicts = tuple(dict(dct) for dct in self.base_dicts)
+        for children2, changes in self.entries[:version - self.offset]:
+            children.update(children2)
+            for dct, changes2 in zip(dicts, changes):
+                dct.update(changes2)
+
+        # copy live tree and set its topology
+        locus_tree = self.locus_tree.copy()
+        names = locus_tree.nodes
+        lnodes = dict((node, names[node.name]) for node in children)
+        for node, nodes in children.iteritems():
+            node2 = lnodes[node]
+            node2.children = [lnodes[child] for child in nodes]
+            for child in node2.children:
+                child.parent = node2
+        locus_tree.root = lnodes[self.locus_tree.root]
+
+        locus_recon, locus_events, coal_recon = dicts
+        return (locus_tree,
+                dict((lnodes[node], snode)
+                     for node, snode in locus_recon.iteritems()),
+                dict((lnodes[node], event)
+                     for node, event in locus_events.iteritems()),
+                coal_recon, lnodes)
+
+
+class ReconSnapshot (Recon):
+    """
+    An immutable reconciliation saved from a ReconLog
+
+    The locus tree and reconciliations are built on first access.
+    """
+
+    def __init__(self, log, version, daughters, coal_recon=None, data=None):
+        self.log = log
+        self.version = version
+        self._daughters = daughters
+        self._coal_recon = coal_recon
+        self._recon = None
+        self.source = None
+        self.data = data if data is not None else {}
+
+    def _build(self):
+        if self._recon is None:
+            locus_tree, locus_recon, locus_events, coal_recon, lnodes = \
+                self.log.build(self.version)
+            if self._coal_recon is not None:
+                coal_recon = self._coal_recon
+            self._recon = Recon(
+                dict((node, lnodes[lnode])
+                     for node, lnode in coal_recon.iteritems()),
+                locus_tree, locus_recon, locus_events,
+                set(lnodes[node] for node in self._daughters))
+            self.log = None
+        return self._recon
+
+    coal_recon = property(lambda self: self._build().coal_recon)
+    locus_tree = property(lambda self: self._build().locus_tree)
+    locus_recon = property(lambda self: self._build().locus_recon)
+    locus_events = property(lambda self: self._build().locus_events)
+    daughters = property(lambda self: self._build().daughters)
+
+    def copy(self):
+        if self._recon is not None:
+            recon = self._recon
+            return Recon(recon.coal_recon, recon.locus_tree,
+                         recon.locus_recon, recon.locus_events,
+                         recon.daughters, data=dict(self.data))
+        return self.log.add_snapshot(ReconSnapshot(
+            self.log, self.version, self._daughters, self._coal_recon,
+            dict(self.data)))
+
+
 #=============================================================================
 # tree search
 
@@ -367,7 +1771,8 @@ class DLCoalTreeSearch (phylo.TreeSearch):
                  tree_hash=None, nprescreen=20, weight=.2):
         phylo.TreeSearch.__init__(self, tree)
 
-        self.stree = stree
+        self.cstree = dlcoal.compile_species_tree(stree)
+        self.stree = self.cstree.tree
         self.gene2species = gene2species
         self.duprate = duprate
         self.lossrate = lossrate
@@ -382,12 +1787,12 @@ class DLCoalTreeSearch (phylo.TreeSearch):
         mix.add_proposer(phylo.TreeSearchSpr(tree), .6)        
         #self.search = phylo.TreeSearchUnique(tree, mix, tree_hash)
 
-        prescreen = phylo.TreeSearchPrescreen(tree, mix,
-                                              self.prescreen,
-                                              poolsize=nprescreen)
+        self.prescreen = DLCoalPrescreen(
+            tree, self.cstree, gene2species, duprate, lossrate,
+            poolsize=nprescreen)
 
         mix2 = phylo.TreeSearchMix(tree)
-        mix2.add_proposer(prescreen, 1.0-weight)
+        mix2.add_proposer(self.prescreen, 1.0-weight)
         mix2.add_proposer(mix, weight)
 
         self.search = mix2
@@ -404,23 +1809,251 @@ class DLCoalTreeSearch (phylo.TreeSearch):
 
     def propose(self):
         self.search.propose()
+        self.prescreen.sync(get_move_nodes(self.search))
         return self.tree
         
     def revert(self):
+        changed = get_move_nodes(self.search)
         self.search.revert()
+        self.prescreen.sync(changed)
         return self.tree
 
 
-    def prescreen(self, tree):
+class DLCoalPrescreen (phylo.TreeSearch):
+    """
+    Prescreens NNI and SPR proposals by their duplication-loss prior
+
+    With the native library, the pool of subproposals is made, reconciled,
+    and scored in native code (see duploss.Prescreener) and only the chosen
+    topology is copied back.  Moves are then drawn from a native random
+    stream seeded from the python 'random' module, so that common random
+    numbers in DLCoalRecon do not repeat them.
+
+    Otherwise, the pool is made in python on the tree itself.  Each
+    subproposal is kept as a move in an undo log instead of a tree copy,
+    and the chosen tree is rebuilt by undoing and redoing moves.
+
+    In both cases, a subproposal whose topology is already in the pool is
+    replaced by a new one, up to 'maxtries' tries.
+
+    The native parent array of the tree is made once and then kept in step
+    with the tree: by the chosen topologies of this proposer, and by sync()
+    for moves made by other proposers on the same tree.
+    """
+
+    def __init__(self, tree, stree, gene2species, duprate, lossrate,
+                 poolsize, nni_weight=.4, maxtries=5):
+        phylo.TreeSearch.__init__(self, tree)
+        self.cstree = dlcoal.compile_species_tree(stree)
+        self.gene2species = gene2species
+        self.duprate = duprate
+        self.lossrate = lossrate
+        self.poolsize = poolsize
+        self.nni_weight = nni_weight
+        self.maxtries = maxtries
+        self.old = None
+        self.moves = []
+        self.changed = []
+        self._ptree = None
+
+        if dlcoal.dlcoalc:
+            self.prescreener = duploss.Prescreener(self.cstree)
+            self.rand = dlcoal.RandomStream(random.randint(0, sys.maxint))
+        else:
+            self.prescreener = None
+
 
-        recon = phylo.reconcile(tree, self.stree, self.gene2species)
+    def propose(self):
+        if self.prescreener:
+            self._propose_native()
+        else:
+            self._propose_python()
+        return self.tree
+
+
+    def set_tree(self, tree):
+        self.tree = tree
+        self._ptree = None
+
+
+    def sync(self, changed):
+        """
+        Updates the native parent array after the children of the nodes
+        'changed' were moved by another proposer (None if not known)
+        """
+        if self._ptree is None or not changed:
+            return
+        if self.tree.root is not self._nodes[-1]:
+            self._ptree = None
+            return
+        for node in changed:
+            if node is None:
+                continue
+            for child in node.children:
+                self._ptree[self._nodelookup[child]] = self._nodelookup[node]
+
+
+    def _propose_native(self):
+        if self._ptree is None:
+            self._ptree, self._nodes, self._nodelookup = \
+                dlcoal.make_ptree(self.tree)
+            self._species = self.prescreener.get_species(
+                self._nodes, self.gene2species)
+        ptree = self._ptree
+        nodes = self._nodes
+        chosen, index, scores = self.prescreener.propose(
+            ptree, nodes, self.gene2species, self.duprate, self.lossrate,
+            self.poolsize, self.nni_weight, self.rand, self._species)
+
+        # move only the nodes whose parents changed
+        self.old = ptree
+        self.changed = self._set_parents(ptree, chosen)
+        self._ptree = chosen
+
+
+    def _set_parents(self, ptree, chosen):
+        """
+        Moves the nodes of the tree from parent array 'ptree' to 'chosen'
+        and returns the nodes whose children changed
+        """
+        nodes = self._nodes
+        moved = [i for i in xrange(len(nodes)) if ptree[i] != chosen[i]]
+        changed = set()
+        for i in moved:
+            parent = nodes[ptree[i]]
+            parent.children.remove(nodes[i])
+            changed.add(parent)
+        for i in moved:
+            parent = nodes[chosen[i]]
+            nodes[i].parent = parent
+            parent.children.append(nodes[i])
+            changed.add(parent)
+        return list(changed)
+
+
+    def _propose_python(self):
+        self.moves = []
+        self.changed = []
+        if len(self.tree.nodes) < 5:
+            return
+
+        # make pool of subproposals
+        pool = []
+        seen = set([phylo.hash_tree(self.tree)])
+        best_score = self.score(self.tree)
+        total = -util.INF
+        for i in xrange(self.poolsize):
+            for j in xrange(self.maxtries):
+                if j > 0:
+                    undo_move(self.tree, move)
+                move = self._propose_move()
+                perform_move(self.tree, move)
+                top = phylo.hash_tree(self.tree)
+                if top not in seen:
+                    break
+            seen.add(top)
+            nodes = move_nodes(move)
+            score = self.score(self.tree)
+            total = stats.logadd(total, score)
+
+            kept = score > best_score
+            if kept:
+                best_score = score
+            else:
+                undo_move(self.tree, move)
+            pool.append((move, score, kept, nodes))
+
+        # choose one of the subproposals
+        choice = random.random()
+        partsum = -util.INF
+        chosen = len(pool) - 1
+        for i, (move, score, kept, nodes) in enumerate(pool):
+            partsum = stats.logadd(partsum, score)
+            if choice < exp(partsum - total):
+                chosen = i
+                break
+
+        # rewind the kept moves made after the chosen one
+        for move, score, kept, nodes in reversed(pool[chosen+1:]):
+            if kept:
+                undo_move(self.tree, move)
+        move, score, kept, nodes = pool[chosen]
+        if not kept:
+            perform_move(self.tree, move)
+
+        # moves from the old tree to the chosen one
+        chain = [entry for entry in pool[:chosen] if entry[2]] + \
+                [pool[chosen]]
+        self.moves = [entry[0] for entry in chain]
+        self.changed = list(set(node for entry in chain
+                                for node in entry[3]))
+
+
+    def _propose_move(self):
+        if random.random() < self.nni_weight:
+            return ("nni",) + phylo.propose_random_nni(self.tree)
+        else:
+            a, e = phylo.propose_random_spr(self.tree)
+            c = a.parent
+            return ("spr", a, e, c.children[1] if c.children[0] == a
+                    else c.children[0])
+
+
+    def score(self, tree):
+        """Returns the duplication-loss prior of a tree"""
+        recon = self.cstree.reconcile(tree, self.gene2species)
         events = phylo.label_events(tree, recon)
+        return duploss.prob_dup_loss(tree, self.cstree, recon, events,
+                                     self.duprate, self.lossrate)
 
-        #print tree.root.name
-        #treelib.draw_tree_names(tree, maxlen=8)
-        
-        return duploss.prob_dup_loss(
-            tree, self.stree, recon, events,
-            self.duprate, self.lossrate)
 
-    
+    def revert(self):
+        if self.old:
+            self._set_parents(self._ptree, self.old)
+            self._ptree = self.old
+        for move in reversed(self.moves):
+            undo_move(self.tree, move)
+        self.old = None
+        self.moves = []
+        return self.tree
+
+
+    def reset(self):
+        self.old = None
+        self.moves = []
+        self.changed = []
+
+
+#=============================================================================
+# topology moves
+#
+# A move is ("nni", node1, node2, change) for phylo.perform_nni or
+# ("spr", subtree, newpos, sibling) for phylo.perform_spr, where 'sibling'
+# is the original sibling of 'subtree'.
+
+def perform_move(tree, move):
+    """Performs a topology move on 'tree'"""
+    if move[0] == "nni":
+        phylo.perform_nni(tree, move[1], move[2], move[3])
+    else:
+        phylo.perform_spr(tree, move[1], move[2])
+
+
+def undo_move(tree, move):
+    """Undoes a topology move made with perform_move()"""
+    if move[0] == "nni":
+        phylo.perform_nni(tree, move[1], move[2], move[3])
+    else:
+        phylo.perform_spr(tree, move[1], move[3])
+
+
+def move_nodes(move):
+    """
+    Returns the nodes whose children were changed by a move, after it is
+    performed
+    """
+    if move[0] == "nni":
+        return [move[1], move[2]]
+    else:
+        c = move[1].parent
+        return [c, c.parent, move[3].parent]
@@ -1,8 +1,10 @@
 
 # python imports
 import os
+import sys
 import random
-from itertools import chain
+import multiprocessing
+from itertools import chain, imap
 
 # rasmus, compbio imports
 from rasmus import treelib, util
@@ -15,18 +17,76 @@ from . import coal
 
 
 def dlcoal_sims(outdir, nsims, stree, n, duprate, lossrate,
-                start=0,
+                start=0, seed=None, nprocs=1, archive=None,
                 **options):
-    
-    for i in xrange(start, nsims):
-        outfile = phylo.phylofile(outdir, str(i), "")
-        util.makedirs(os.path.dirname(outfile))
-        print "simulating", outfile
+    """
+    Simulates gene trees 'start' to 'nsims'-1 into 'outdir'/i/i.*
+
+    Replicate i is sampled from its own random seed from get_sim_seed(),
+    so its files do not depend on 'start' or the number of processes
+    'nprocs'.  If 'seed' is not given, it is drawn from the random module.
+
+    If 'archive' (a dlcoal.archive.ReconArchive) is given, replicate i is
+    written to it as family i instead of to 'outdir'.
+    """
+    global _sim_args
+
+    if seed is None:
+        seed = random.randint(0, sys.maxint)
+
+    _sim_args = (outdir if archive is None else None,
+                 stree, n, duprate, lossrate, options)
+    if nprocs > 1:
+        pool = multiprocessing.Pool(nprocs)
+        mapfunc = pool.imap
+    else:
+        pool = None
+        mapfunc = imap
+
+    try:
+        for i, outfile, files in mapfunc(_dlcoal_sim, [
+                (i, get_sim_seed(seed, i)) for i in xrange(start, nsims)]):
+            if archive is not None:
+                archive.write_files(i, files)
+            print "simulating", outfile
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        _sim_args = None
+
+
+def get_sim_seed(seed, i):
+    """Returns the random seed of replicate 'i' of a simulation"""
+    return dlcoal.mix_seed(seed, i)
+
+
+# arguments of dlcoal_sims() for simulation processes (inherited when forked)
+_sim_args = None
+
+
+def _dlcoal_sim(args):
+    """
+    Simulates one replicate and returns its index, output prefix, and
+    files to archive
+    """
+
+    i, seed = args
+    outdir, stree, n, duprate, lossrate, options = _sim_args
+
+    # sample a new tree from DLCoal model
+    random.seed(seed)
+    coal_tree, ex = sample_dlcoal(stree, n, duprate, lossrate, **options)
+
+    # the parent process writes to the archive
+    if outdir is None:
+        return i, str(i), dlcoal.format_dlcoal_recon(coal_tree, ex)
+
+    outfile = phylo.phylofile(outdir, str(i), "")
+    util.makedirs(os.path.dirname(outfile))
+    dlcoal.write_dlcoal_recon(outfile, coal_tree, ex)
 
-        # sample a new tree from DLCoal model
-        coal_tree, ex = sample_dlcoal(stree, n, duprate, lossrate,
-                                      **options)
-        dlcoal.write_dlcoal_recon(outfile, coal_tree, ex)
+    return i, outfile, None
 
 
 
@@ -161,8 +221,10 @@ def sample_multilocus_tree(stree, n, leaf_counts=None,
                 else:
                     get_subtree(child, leaves, leaf_counts2)
 
-    # loop through subtrees
-    for snode in chain(daughters, [stree.root]):
+    # loop through subtrees (in tree order, so that a random seed gives the
+    # same tree in every process)
+    daughters_order = [node for node in stree.preorder() if node in daughters]
+    for snode in chain(daughters_order, [stree.root]):
         # determine leaves of the coal subtree
         leaves = set()
         leaf_counts2 = {}
@@ -191,7 +253,7 @@ def sample_multilocus_tree(stree, n, leaf_counts=None,
 
     # sample coal times
     tree, recon = coal.coal_cond_lineage_counts(
-        lineages, stree.root, set(stree.leaves()),
+        lineages, stree.root, stree.leaves(),
         popsizes, stimes, None, namefunc)
     
     return tree, recon
@@ -3,9 +3,11 @@
 #include <math.h>
 #include <stdio.h>
 #include <assert.h>
+#include <pthread.h>
 
 #include "common.h"
 #include "itree.h"
+#include "random.h"
 #include "spidir/birthdeath.h"
 #include "duploss.h"
 
@@ -71,22 +73,24 @@ public:
 class ProbCounts
 {
 public:
-    ProbCounts(int nsnodes) :
+    ProbCounts(int nsnodes, int maxcount) :
         nsnodes(nsnodes)
     {    
         starts = new double* [nsnodes];
-        for (int i=0; i<nsnodes; i++) starts[i] = NULL;
         ends = new double* [nsnodes];
-        for (int i=0; i<nsnodes; i++) ends[i] = NULL;
+        for (int i=0; i<nsnodes; i++) {
+            starts[i] = new double [maxcount+1];
+            ends[i] = new double [maxcount+1];
+        }
     }
 
     ~ProbCounts() {
         for (int i=0; i<nsnodes; i++) {
-            if (starts[i])
-                delete [] starts[i];
-            if (ends[i])
-                delete [] ends[i];
+            delete [] starts[i];
+            delete [] ends[i];
         }
+        delete [] starts;
+        delete [] ends;
     }
 
     int nsnodes;
@@ -95,6 +99,178 @@ public:
 };
 
 
+// The probabiluty of going from 'a' lineages to 'b' lineages in time 't'
+// with population size 'n'
+double prob_coal_counts(int a, int b, double t, double n);
+
+
+// Caches a table of lineage count transition probabilities for each branch
+// of the locus tree
+//
+// table[i][k] = prob_coal_counts(i, k, t, n)   for 1 <= k <= i <= M
+//
+// A branch's table is keyed by its length 't' and population size 'n' and
+// is only rebuilt when either changes (or more lineages are requested).
+// Speciation branches have the same length in every sample of duplication
+// times, so their tables are computed once per evaluation.  A table built
+// for M lineages also serves any request for fewer lineages, so coal
+// reconciliations evaluated against the same locus times share tables.
+class CoalCountsCache
+{
+public:
+    CoalCountsCache(int nnodes) :
+        nnodes(nnodes)
+    {
+        tables = new double* [nnodes];
+        sizes = new int [nnodes];
+        capacities = new int [nnodes];
+        times = new double [nnodes];
+        popsizes = new double [nnodes];
+        for (int i=0; i<nnodes; i++) {
+            tables[i] = NULL;
+            sizes[i] = 0;
+            capacities[i] = 0;
+        }
+    }
+
+    ~CoalCountsCache() {
+        for (int i=0; i<nnodes; i++)
+            if (tables[i])
+                delete [] tables[i];
+        delete [] tables;
+        delete [] sizes;
+        delete [] capacities;
+        delete [] times;
+        delete [] popsizes;
+    }
+
+    // Returns the table for branch 'node' with length 't', popsize 'n',
+    // and at least 'M' starting lineages.  Entry (i, k) is at 
+    // i*stride + k, where 'stride' is set on return.
+    const double *get(int node, double t, double n, int M, int *stride) {
+        if (sizes[node] < M || times[node] != t || popsizes[node] != n) {
+            if (capacities[node] < M) {
+                if (tables[node])
+                    delete [] tables[node];
+                tables[node] = new double [(M+1) * (M+1)];
+                capacities[node] = M;
+            }
+            
+            double *table = tables[node];
+            for (int i=1; i<=M; i++)
+                for (int k=1; k<=i; k++)
+                    table[i*(M+1) + k] = prob_coal_counts(i, k, t, n);
+
+            sizes[node] = M;
+            times[node] = t;
+            popsizes[node] = n;
+        }
+        *stride = sizes[node] + 1;
+        return tables[node];
+    }
+
+    int nnodes;
+    double **tables;
+    int *sizes;          // number of lineages the current table covers
+    int *capacities;     // number of lineages the allocation can hold
+    double *times;
+    double *popsizes;
+};
+
+
+// Preallocated scratch space for the locus coalescent likelihood
+//
+// A workspace is created for a coal tree with 'nnodes' nodes and a locus
+// tree with 'nlocus_nodes' nodes.  It can be reused for any number of
+// evaluations on trees of (at most) those sizes, so that no memory is
+// allocated within the duplication time sampling loop.
+class LocusCoalWorkspace
+{
+public:
+    LocusCoalWorkspace(int nnodes, int nlocus_nodes) :
+        nnodes(nnodes),
+        nlocus_nodes(nlocus_nodes),
+        counts(nlocus_nodes),
+        top_stats(nnodes, nlocus_nodes),
+        // a locus subtree is entered by at most one lineage per coal leaf
+        // and one per daughter
+        prob_counts(nlocus_nodes, (nnodes + 1) / 2 + (nlocus_nodes + 1) / 2),
+        cache(nlocus_nodes),
+        nthreads(0),
+        thread_ws(NULL)
+    {
+        itree = new intnode [nnodes];
+        iltree = new intnode [nlocus_nodes];
+        ltimes = new double [nlocus_nodes];
+        stack = new int [max(nnodes, nlocus_nodes)];
+        stack_pushes = new int [nlocus_nodes];
+        sizes = new int [nlocus_nodes];
+        gene_counts = new int [nlocus_nodes];
+        subleaves = new int [nlocus_nodes];
+        daughters_set = new bool [nlocus_nodes];
+    }
+
+    ~LocusCoalWorkspace() {
+        delete [] itree;
+        delete [] iltree;
+        delete [] ltimes;
+        delete [] stack;
+        delete [] stack_pushes;
+        delete [] sizes;
+        delete [] gene_counts;
+        delete [] subleaves;
+        delete [] daughters_set;
+
+        for (int i=1; i<nthreads; i++)
+            delete thread_ws[i];
+        delete [] thread_ws;
+    }
+
+    // Returns true if the workspace can hold trees of the given sizes
+    bool fits(int nnodes2, int nlocus_nodes2) const {
+        return nnodes2 <= nnodes && nlocus_nodes2 <= nlocus_nodes;
+    }
+
+    // Ensures there is one workspace for each of 'nthreads2' threads.
+    // This workspace serves as the first thread's.
+    void alloc_threads(int nthreads2) {
+        if (nthreads2 <= nthreads)
+            return;
+        LocusCoalWorkspace **thread_ws2 = new LocusCoalWorkspace* [nthreads2];
+        for (int i=0; i<nthreads; i++)
+            thread_ws2[i] = thread_ws[i];
+        for (int i=nthreads; i<nthreads2; i++)
+            thread_ws2[i] = (i == 0) ? this : 
+                new LocusCoalWorkspace(nnodes, nlocus_nodes);
+        delete [] thread_ws;
+        thread_ws = thread_ws2;
+        nthreads = nthreads2;
+    }
+
+    int nnodes;
+    int nlocus_nodes;
+
+    intnode *itree;      // coal tree
+    intnode *iltree;     // locus tree
+    double *ltimes;      // locus tree node times
+    int *stack;          // traversal stack for either tree
+    int *stack_pushes;   // number of children visited per locus node
+    int *sizes;          // max number of lineages per locus node
+    int *gene_counts;    // lineages entering each daughter subtree leaf
+    int *subleaves;      // leaves of a daughter subtree
+    bool *daughters_set; // true for locus nodes that are daughters
+
+    LineageCounts counts;
+    TopStats top_stats;
+    ProbCounts prob_counts;
+    CoalCountsCache cache;
+
+    // per-thread workspaces for multithreaded sampling
+    int nthreads;
+    LocusCoalWorkspace **thread_ws;
+};
+
+
 
 //=============================================================================
 
@@ -209,7 +385,7 @@ void get_topology_stats2(TopStats *top_stats,
         descend_nodes[node]++;
 
         const int parent = itree[node].parent;
-        if (recon[node] == recon[parent])
+        if (parent >= 0 && recon[node] == recon[parent])
             descend_nodes[parent] += descend_nodes[node];
     }
 }
@@ -263,25 +439,26 @@ double prob_multicoal_recon_topology(int *ptree, int nnodes, int *recon,
 // Returns the log probability of a reconciled gene tree ('tree', 'recon')
 // from the coalescent model given a species tree 'stree' and
 // population sizes 'n'
+//
+// Lineage counts and topology stats are written to 'counts' and 'top_stats'.
 double prob_multicoal_recon_topology2(intnode *itree, int nnodes, int *recon, 
                                       int *pstree, int nsnodes, 
-                                      double *stimes, double *popsizes)
+                                      double *stimes, double *popsizes,
+                                      LineageCounts *counts,
+                                      TopStats *top_stats)
 {
-    LineageCounts counts(nsnodes);
-    count_lineages_per_branch(&counts, nnodes, recon, pstree, nsnodes);
-
-    TopStats top_stats(nnodes, nsnodes);
-    get_topology_stats2(&top_stats, itree, nnodes, recon, pstree, nsnodes);
+    count_lineages_per_branch(counts, nnodes, recon, pstree, nsnodes);
+    get_topology_stats2(top_stats, itree, nnodes, recon, pstree, nsnodes);
     
     // iterate through species tree branches
     double lnp = 0.0; // log probability
     for (int snode=0; snode<nsnodes-1; snode++) {
-        const int a = counts.starts[snode];
-        const int b = counts.ends[snode];
+        const int a = counts->starts[snode];
+        const int b = counts->ends[snode];
         if (a == 1)
             continue;
 
-        const int n = top_stats.nodes_per_species[snode];
+        const int n = top_stats->nodes_per_species[snode];
         double fact = 1.0; for (int i=2; i<=n; i++) fact *= i; // fact(n)
             
         const double t = stimes[pstree[snode]] - stimes[snode];
@@ -291,14 +468,14 @@ double prob_multicoal_recon_topology2(intnode *itree, int nnodes, int *recon,
 
     // root branch
     const int snode = nsnodes - 1;
-    const int a = counts.starts[snode];
-    const int n = top_stats.nodes_per_species[snode];
+    const int a = counts->starts[snode];
+    const int n = top_stats->nodes_per_species[snode];
     double fact = 1.0; for (int i=2; i<=n; i++) fact *= i; // fact(n)
     lnp += log(fact / num_labeled_histories(a, 1));
 
     const int nleaves = (nnodes + 1) / 2;
     for (int node=nleaves; node<nnodes; node++)
-        lnp -= log(top_stats.descend_nodes[node]);
+        lnp -= log(top_stats->descend_nodes[node]);
 
     return lnp;
 }
@@ -311,14 +488,14 @@ void calc_prob_counts_table(ProbCounts *prob_counts,
                             intnode *istree, int nsnodes, 
                             double *popsizes,
                             int sroot, int *sleaves, int nsleaves,
-                            double *stimes)
+                            double *stimes, LocusCoalWorkspace *ws)
 {
     // array of max number of lineages per snode
-    int* sizes = new int [nsnodes];
+    int* sizes = ws->sizes;
 
     // stack of snodes to visit
-    int *stack = new int [nsnodes];
-    int *stack_pushes = new int [nsnodes];
+    int *stack = ws->stack;
+    int *stack_pushes = ws->stack_pushes;
     for (int i=0; i<nsnodes; i++) stack_pushes[i] = 0;
 
     // push sleaves onto stack
@@ -337,7 +514,7 @@ void calc_prob_counts_table(ProbCounts *prob_counts,
             if (++stack_pushes[sparent] == 2)
                 stack[stack_len++] = sparent;
 
-        double *start;
+        double *start = prob_counts->starts[snode];
         int M;
 
         if (stack_i < nsleaves) {
@@ -345,7 +522,6 @@ void calc_prob_counts_table(ProbCounts *prob_counts,
             M = gene_counts[snode];
             
             // populate starting lineage counts
-            start = new double [M+1];
             for (int i=0; i<M; i++) start[i] = 0.0;
             start[M] = 1.0;
         } else {
@@ -359,7 +535,6 @@ void calc_prob_counts_table(ProbCounts *prob_counts,
             double *end2 = prob_counts->ends[c2];
 
             // populate starting lineage counts
-            start = new double [M+1];
             start[0] = 0.0; start[1] = 0.0;
             for (int k=2; k<=M; k++) {
                 start[k] = 0.0;
@@ -374,7 +549,7 @@ void calc_prob_counts_table(ProbCounts *prob_counts,
         // populate ending lineage counts
         const double n = popsizes[snode];
         double ptime = (sparent >= 0) ? stimes[istree[snode].parent] : T;
-        double *end = new double [M+1];
+        double *end = prob_counts->ends[snode];
         if (ptime < 0) {
             // unbounded end time, i.e. complete coalescence
             for (int i=0; i<=M; i++) end[i] = 0.0;
@@ -382,62 +557,53 @@ void calc_prob_counts_table(ProbCounts *prob_counts,
         } else {
             // fixed end time
             const double t = ptime - stimes[snode];
+            int stride;
+            const double *table = ws->cache.get(snode, t, n, M, &stride);
 
-            // TODO: there is a lot of work that could be reused between
-            // iterations of these loops
             end[0] = 0.0;
             for (int k=1; k<=M; k++) {
                 end[k] = 0.0;
                 for (int i=k; i<=M; i++) 
-                    end[k] += prob_coal_counts(i, k, t, n) * start[i];
+                    end[k] += table[i*stride + k] * start[i];
             }
         }
-
-        prob_counts->starts[snode] = start;
-        prob_counts->ends[snode] = end;
     }
-
-    // clean up
-    delete [] sizes;
-    delete [] stack;
-    delete [] stack_pushes;
 }
 
 
 
-double prob_locus_coal_recon_topology(int *ptree, int nnodes, int *recon, 
-                                      int *plocus_tree, intnode *iltree,
-                                      int nlocus_nodes, 
-                                      double *popsizes, double *ltimes,
-                                      int *daughters, int ndaughters)
+// Returns the log probability of a coal tree ('ptree', 'recon') within a 
+// locus tree with node times 'ltimes'.
+//
+// 'iltree' must already be populated for 'plocus_tree'.  All scratch space
+// is taken from the workspace 'ws'.
+double prob_locus_coal_recon_topology_workspace(
+    int *ptree, int nnodes, int *recon, 
+    int *plocus_tree, intnode *iltree, int nlocus_nodes, 
+    double *popsizes, double *ltimes,
+    int *daughters, int ndaughters, LocusCoalWorkspace *ws)
 {
-    bool own_iltree = false;
-    if (!iltree) {
-        own_iltree = true;
-        iltree = make_itree(nlocus_nodes, plocus_tree);
-    }
-    intnode *itree = make_itree(nnodes, ptree);
+    intnode *itree = ws->itree;
+    init_itree(itree, nnodes, ptree);
 
+    LineageCounts &counts = ws->counts;
     double lnp = prob_multicoal_recon_topology2(itree, nnodes, recon, 
                                                 plocus_tree, nlocus_nodes, 
-                                                ltimes, popsizes);
+                                                ltimes, popsizes,
+                                                &counts, &ws->top_stats);
 
     const int nleaves = (nnodes + 1) / 2;
 
-    ProbCounts prob_counts(nlocus_nodes);
-    int *stack = new int [nnodes];
+    ProbCounts &prob_counts = ws->prob_counts;
+    int *stack = ws->stack;
     int stack_len = 0;
 
-    int *gene_counts = new int [nlocus_nodes];
-    int *subleaves = new int [nlocus_nodes];
+    int *gene_counts = ws->gene_counts;
+    int *subleaves = ws->subleaves;
     int nsubleaves;
 
-    LineageCounts counts(nlocus_nodes);
-    count_lineages_per_branch(&counts, nnodes, recon, 
-                              plocus_tree, nlocus_nodes);
-
     // make daughter set
-    bool *daughters_set = new bool [nlocus_nodes];
+    bool *daughters_set = ws->daughters_set;
     for (int i=0; i<nlocus_nodes; i++) daughters_set[i] = false;
     for (int i=0; i<ndaughters; i++) daughters_set[daughters[i]] = true;
 
@@ -475,27 +641,46 @@ double prob_locus_coal_recon_topology(int *ptree, int nnodes, int *recon,
                                iltree, nlocus_nodes, 
                                popsizes,
                                daughter, subleaves, nsubleaves,
-                               ltimes);
+                               ltimes, ws);
         lnp -= log(prob_counts.ends[daughter][1]);
 
         if (lnp == -INFINITY)
             break;
     }
 
+    return lnp;
+}
 
-     // deallocates 'int tree'
-    if (own_iltree)
-        free_itree(iltree);
-    free_itree(itree);
 
-    // clean up
-    delete [] stack;
-    delete [] gene_counts;
-    delete [] subleaves;
-    delete [] daughters_set;
+double prob_locus_coal_recon_topology(int *ptree, int nnodes, int *recon, 
+                                      int *plocus_tree, intnode *iltree,
+                                      int nlocus_nodes, 
+                                      double *popsizes, double *ltimes,
+                                      int *daughters, int ndaughters)
+{
+    LocusCoalWorkspace ws(nnodes, nlocus_nodes);
+    if (!iltree) {
+        iltree = ws.iltree;
+        init_itree(iltree, nlocus_nodes, plocus_tree);
+    }
+
+    return prob_locus_coal_recon_topology_workspace(
+        ptree, nnodes, recon, plocus_tree, iltree, nlocus_nodes,
+        popsizes, ltimes, daughters, ndaughters, &ws);
+}
 
 
-    return lnp;
+// Allocates a workspace for coal trees of 'nnodes' nodes and locus trees
+// of 'nlocus_nodes' nodes
+LocusCoalWorkspace *new_locus_coal_workspace(int nnodes, int nlocus_nodes)
+{
+    return new LocusCoalWorkspace(nnodes, nlocus_nodes);
+}
+
+
+void delete_locus_coal_workspace(LocusCoalWorkspace *ws)
+{
+    delete ws;
 }
 
 
@@ -509,7 +694,7 @@ void sample_dup_times_subtree(double *times, intnode *itree,
                               int duproot, 
                               int *recon, int *events,
                               double birth, double death,
-                              int *stack)
+                              int *stack, RandomStream *rand)
 {
     // init stack
     int stack_len = 1;
@@ -528,7 +713,7 @@ void sample_dup_times_subtree(double *times, intnode *itree,
         } else {
             double t;
             do {
-                t = sampleBirthWaitTime1(remain, birth, death);
+                t = sampleBirthWaitTime1(remain, birth, death, rand);
                 times[node] = parent_time - t;
             } while (times[node] == parent_time);
         }
@@ -550,7 +735,8 @@ void sample_dup_times(double *times,
                       intnode *itree, int nnodes, int *pstree, int nsnodes,
                       double *stimes,
                       int *recon, int *events, double birth, double death,
-                      double pretime, double premean, int *stack)
+                      double pretime, double premean, int *stack,
+                      RandomStream *rand)
 {
     
 
@@ -575,7 +761,7 @@ void sample_dup_times(double *times,
 
                 pretime = 0.0;
                 do {
-                    pretime = expovariate(1.0/premean);
+                    pretime = rand->expovariate(1.0/premean);
                 } while (pretime == 0.0);
             }
             start_time = stimes[sroot] + pretime;
@@ -586,7 +772,7 @@ void sample_dup_times(double *times,
                                  start_time, time_span, 
                                  root, 
                                  recon, events,
-                                 birth, death, stack);
+                                 birth, death, stack, rand);
     }
 
     // set times
@@ -610,7 +796,7 @@ void sample_dup_times(double *times,
                                      start_time, time_span, 
                                      node, 
                                      recon, events,
-                                     birth, death, stack);
+                                     birth, death, stack, rand);
 
         } else if (events[node] == EVENT_GENE) {
             times[node] = 0.0;
@@ -619,47 +805,235 @@ void sample_dup_times(double *times,
 }
 
 
-double prob_locus_coal_recon_topology_samples(
-    int *ptree, int nnodes, int *recon, 
+// Arguments for one thread of prob_locus_coal_recon_topology_samples_batch
+struct LocusCoalSamplesThread
+{
+    int *ptree;
+    int nnodes;
+    int *recons;
+    int nrecons;
+    int *plocus_tree;
+    int nlocus_nodes;
+    int *locus_recon;
+    int *locus_events;
+    double *popsizes;
+    int *pstree;
+    int nsnodes;
+    double *stimes;
+    int *daughters;
+    int *ndaughters;
+    double birth;
+    double death;
+    double pretime;
+    double premean;
+
+    int nsamples;          // number of samples for this thread
+    int first_sample;      // index of the first sample of this thread
+    LocusCoalWorkspace *ws;
+    RandomStream *rand;
+    RandomStream *crn;     // key of the per-sample streams (or NULL)
+
+    double *probs;         // log sum of sample probabilities per recon
+                           // (output)
+    double *sqprobs;       // log sum of squared sample probabilities per
+                           // recon (output)
+};
+
+
+// Sums the probabilities of the samples assigned to one thread
+void *prob_locus_coal_recon_topology_samples_thread(void *data)
+{
+    LocusCoalSamplesThread *args = (LocusCoalSamplesThread*) data;
+    LocusCoalWorkspace *ws = args->ws;
+    intnode *iltree = ws->iltree;
+    init_itree(iltree, args->nlocus_nodes, args->plocus_tree);
+
+    for (int k=0; k<args->nrecons; k++) {
+        args->probs[k] = -INFINITY;
+        args->sqprobs[k] = -INFINITY;
+    }
+    RandomStream sample_rand;
+    RandomStream *rand = args->rand;
+    for (int i=0; i<args->nsamples; i++) {
+        if (args->crn) {
+            args->crn->substream(&sample_rand, args->first_sample + i);
+            rand = &sample_rand;
+        }
+
+        // sample duplication times
+        sample_dup_times(ws->ltimes,
+                         iltree, args->nlocus_nodes, 
+                         args->pstree, args->nsnodes, args->stimes,
+                         args->locus_recon, args->locus_events, 
+                         args->birth, args->death,
+                         args->pretime, args->premean, ws->stack,
+                         rand);
+
+        // coal topology probability of each recon for these times
+        int *daughters = args->daughters;
+        for (int k=0; k<args->nrecons; k++) {
+            double const coal_prob = prob_locus_coal_recon_topology_workspace(
+                args->ptree, args->nnodes, &args->recons[k * args->nnodes],
+                args->plocus_tree, iltree, args->nlocus_nodes, 
+                args->popsizes, ws->ltimes,
+                daughters, args->ndaughters[k], ws);
+            args->probs[k] = logadd(args->probs[k], coal_prob);
+            args->sqprobs[k] = logadd(args->sqprobs[k], 2.0 * coal_prob);
+            daughters += args->ndaughters[k];
+        }
+    }
+
+    return NULL;
+}
+
+
+// Computes the log probabilities of 'nrecons' reconciliations of a coal
+// tree within a locus tree integrated over duplication times by sampling.
+//
+// 'recons' holds the reconciliations one after another ('nnodes' entries
+// each) and 'daughters' holds their daughter sets one after another with
+// 'ndaughters[k]' entries for reconciliation k.  Every reconciliation is
+// evaluated against the same sampled duplication times, so the samples and
+// the lineage count transition tables are shared.  The results are written
+// to 'probs'.  If 'sqprobs' is not NULL, the log mean of the squared sample
+// probabilities is written there, from which the Monte Carlo error of
+// 'probs' can be estimated.
+//
+// 'ws' is an optional workspace from new_locus_coal_workspace().  If it is
+// NULL or does not fit the given trees, a temporary workspace is used.
+//
+// Random numbers are drawn from 'rand', or from default_random_stream() if
+// it is NULL.  If 'nthreads' > 1, samples are split evenly across that many
+// threads, each drawing from its own stream split from 'rand'.  Results are
+// therefore reproducible for a given stream and number of threads.
+//
+// If 'crn' is not NULL, 'rand' is not used.  Instead sample i draws from
+// substream 'first_sample' + i of 'crn' (see RandomStream::substream),
+// which is not advanced.  Calls with the same 'crn' state then use common
+// random numbers: each sample starts from the same variates whatever the
+// trees and the number of threads.  More samples can be added to an
+// estimate by a call with 'first_sample' set to the samples drawn so far.
+void prob_locus_coal_recon_topology_samples_batch(
+    int *ptree, int nnodes, int *recons, int nrecons,
     int *plocus_tree, int nlocus_nodes, 
     int *locus_recon, int *locus_events,
     double *popsizes, 
     int *pstree, int nsnodes, double *stimes,
-    int *daughters, int ndaughters, 
+    int *daughters, int *ndaughters, 
     double birth, double death,
-    int nsamples, double pretime, double premean)
+    int nsamples, double pretime, double premean,
+    LocusCoalWorkspace *ws, int nthreads, RandomStream *rand,
+    RandomStream *crn, int first_sample, double *probs, double *sqprobs)
 {
     // alloc datastructures
-    double *ltimes = new double [nlocus_nodes];
-    intnode *iltree = make_itree(nlocus_nodes, plocus_tree);
-    int *stack = new int [nnodes];
-    
-    // integrate over duplication times using sampling
-    double prob = -INFINITY;
-    for (int i=0; i<nsamples; i++) {
-        // sample duplication times
-        sample_dup_times(ltimes,
-                         iltree, nlocus_nodes, pstree, nsnodes,
-                         stimes,
-                         locus_recon, locus_events, birth, death,
-                         pretime, premean, stack);
+    LocusCoalWorkspace *own_ws = NULL;
+    if (!ws || !ws->fits(nnodes, nlocus_nodes))
+        ws = own_ws = new LocusCoalWorkspace(nnodes, nlocus_nodes);
+    if (!rand)
+        rand = default_random_stream();
+
+    if (nthreads > nsamples)
+        nthreads = nsamples;
+    if (nthreads < 1)
+        nthreads = 1;
+    ws->alloc_threads(nthreads);
+
+    // setup threads
+    LocusCoalSamplesThread *args = new LocusCoalSamplesThread [nthreads];
+    RandomStream *thread_rands = new RandomStream [nthreads];
+    pthread_t *threads = new pthread_t [nthreads];
+    double *thread_probs = new double [2 * nthreads * nrecons];
+    double *thread_sqprobs = &thread_probs[nthreads * nrecons];
+    for (int j=0; j<nthreads; j++) {
+        LocusCoalSamplesThread &arg = args[j];
+        arg.ptree = ptree;
+        arg.nnodes = nnodes;
+        arg.recons = recons;
+        arg.nrecons = nrecons;
+        arg.plocus_tree = plocus_tree;
+        arg.nlocus_nodes = nlocus_nodes;
+        arg.locus_recon = locus_recon;
+        arg.locus_events = locus_events;
+        arg.popsizes = popsizes;
+        arg.pstree = pstree;
+        arg.nsnodes = nsnodes;
+        arg.stimes = stimes;
+        arg.daughters = daughters;
+        arg.ndaughters = ndaughters;
+        arg.birth = birth;
+        arg.death = death;
+        arg.pretime = pretime;
+        arg.premean = premean;
+        const int start = int(j * (long) nsamples / nthreads);
+        arg.first_sample = first_sample + start;
+        arg.nsamples = int((j + 1) * (long) nsamples / nthreads) - start;
+        arg.ws = ws->thread_ws[j];
+        arg.probs = &thread_probs[j * nrecons];
+        arg.sqprobs = &thread_sqprobs[j * nrecons];
         
-        // coal topology probability
-        double const coal_prob = prob_locus_coal_recon_topology(
-            ptree, nnodes, recon, 
-            plocus_tree, iltree, nlocus_nodes, 
-            popsizes, ltimes,
-            daughters, ndaughters);
-
-        prob = logadd(prob, coal_prob);
+        arg.crn = crn;
+        if (nthreads == 1 || crn) {
+            arg.rand = rand;
+        } else {
+            rand->split(&thread_rands[j], j);
+            arg.rand = &thread_rands[j];
+        }
+    }
+
+    // integrate over duplication times using sampling
+    for (int j=1; j<nthreads; j++)
+        pthread_create(&threads[j], NULL, 
+                       prob_locus_coal_recon_topology_samples_thread,
+                       &args[j]);
+    prob_locus_coal_recon_topology_samples_thread(&args[0]);
+
+    // combine thread results
+    for (int j=1; j<nthreads; j++)
+        pthread_join(threads[j], NULL);
+    for (int k=0; k<nrecons; k++) {
+        double prob = thread_probs[k];
+        double sqprob = thread_sqprobs[k];
+        for (int j=1; j<nthreads; j++) {
+            prob = logadd(prob, thread_probs[j * nrecons + k]);
+            sqprob = logadd(sqprob, thread_sqprobs[j * nrecons + k]);
+        }
+        probs[k] = prob - log(nsamples);
+        if (sqprobs)
+            sqprobs[k] = sqprob - log(nsamples);
     }
 
     // clean up
-    delete [] ltimes;
-    free_itree(iltree);
-    delete [] stack;
+    delete [] args;
+    delete [] thread_rands;
+    delete [] threads;
+    delete [] thread_probs;
+    if (own_ws)
+        delete own_ws;
+}
 
-    return prob - log(nsamples);
+
+// Returns the log probability of a coal tree within a locus tree
+// integrated over duplication times by sampling.
+//
+// See prob_locus_coal_recon_topology_samples_batch() for the arguments.
+double prob_locus_coal_recon_topology_samples(
+    int *ptree, int nnodes, int *recon, 
+    int *plocus_tree, int nlocus_nodes, 
+    int *locus_recon, int *locus_events,
+    double *popsizes, 
+    int *pstree, int nsnodes, double *stimes,
+    int *daughters, int ndaughters, 
+    double birth, double death,
+    int nsamples, double pretime, double premean,
+    LocusCoalWorkspace *ws, int nthreads, RandomStream *rand)
+{
+    double prob;
+    prob_locus_coal_recon_topology_samples_batch(
+        ptree, nnodes, recon, 1, plocus_tree, nlocus_nodes,
+        locus_recon, locus_events, popsizes, pstree, nsnodes, stimes,
+        daughters, &ndaughters, birth, death, nsamples, pretime, premean,
+        ws, nthreads, rand, NULL, 0, &prob, NULL);
+    return prob;
 }
 
 
@@ -1,13 +1,19 @@
-
 // c/c++ includes
 #include <math.h>
 #include <stdio.h>
+#include <string.h>
 #include <assert.h>
 
 #include "common.h"
+#include "random.h"
+#include "spidir/Tree.h"
+#include "spidir/phylogeny.h"
+#include "spidir/top_change.h"
+#include "spidir/top_prior.h"
 #include "duploss.h"
 
 
+using namespace spidir;
 
 namespace dlcoal
 {
@@ -15,6 +21,263 @@ namespace dlcoal
 extern "C" {
 
 
+//=============================================================================
+// Prescreening of gene tree proposals
+
+// A species tree prepared for reconciling many gene trees
+class Prescreener
+{
+public:
+    Prescreener(int *pstree, int nsnodes, float *sdists) :
+        stree(nsnodes)
+    {
+        ptree2tree(nsnodes, pstree, &stree);
+        stree.setDists(sdists);
+        stree.setDepths();
+    }
+
+    SpeciesTree stree;
+};
+
+
+// A topology change made while building a prescreen pool.
+// NNI swaps nodes 'a' and 'b'.  SPR moves 'a' above 'b', and 'c' is the
+// original sibling of 'a' (the move is undone by moving 'a' above 'c').
+struct PrescreenMove
+{
+    int kind;
+    Node *a;
+    Node *b;
+    Node *c;
+    bool kept;
+};
+
+enum {
+    MOVE_NNI = 0,
+    MOVE_SPR = 1
+};
+
+// number of tries to find a topology that is not already in the pool
+// (see compbio.phylo.TreeSearchUnique)
+static const int PRESCREEN_MAXTRIES = 5;
+
+
+static inline int rand_int(RandomStream *rand, int max)
+{
+    int i = int(rand->frand(max));
+    return (i < max) ? i : max - 1;
+}
+
+
+// Chooses a random NNI (see compbio.phylo.propose_random_nni)
+static void propose_nni(Tree *tree, RandomStream *rand, PrescreenMove *move)
+{
+    Node *node1;
+    do {
+        node1 = tree->nodes[rand_int(rand, tree->nnodes)];
+    } while (node1->isLeaf() || node1->parent == NULL);
+    Node *node2 = node1->parent;
+
+    move->kind = MOVE_NNI;
+    move->a = node1->children[rand_int(rand, 2)];
+    move->b = (node2->children[0] == node1) ? node2->children[1] :
+                                              node2->children[0];
+    move->c = NULL;
+}
+
+
+// Chooses a random SPR (see compbio.phylo.propose_random_spr)
+static void propose_spr(Tree *tree, RandomStream *rand, PrescreenMove *move)
+{
+    // find subtree (a) that is not the root or a child of the root
+    Node *a;
+    do {
+        a = tree->nodes[rand_int(rand, tree->nnodes)];
+    } while (a->parent == NULL || a->parent->parent == NULL);
+
+    // find sibling (b) of a
+    Node *c = a->parent;
+    Node *b = (c->children[0] == a) ? c->children[1] : c->children[0];
+
+    // choose newpos (e) that is not the root, a, c, b, or below a
+    Node *e;
+    while (true) {
+        e = tree->nodes[rand_int(rand, tree->nnodes)];
+        if (e->parent == NULL || e == a || e == c || e == b)
+            continue;
+
+        bool under_a = false;
+        for (Node *ptr = e->parent; ptr != NULL; ptr = ptr->parent) {
+            if (ptr == a) {
+                under_a = true;
+                break;
+            }
+        }
+        if (!under_a)
+            break;
+    }
+
+    move->kind = MOVE_SPR;
+    move->a = a;
+    move->b = e;
+    move->c = b;
+}
+
+
+static void perform_move(Tree *tree, PrescreenMove *move)
+{
+    if (move->kind == MOVE_NNI)
+        performNni(tree, move->a, move->b);
+    else
+        performSpr(tree, move->a, move->b);
+}
+
+
+static void undo_move(Tree *tree, PrescreenMove *move)
+{
+    if (move->kind == MOVE_NNI)
+        performNni(tree, move->b, move->a);
+    else
+        performSpr(tree, move->a, move->c);
+}
+
+
+// Returns true if topology key 'key' is one of the first 'nkeys' keys
+// in 'keys'.  Each key has 'nnodes' entries (see Tree::hashkey).
+static bool seen_topology(int *keys, int nkeys, int *key, int nnodes)
+{
+    for (int i=0; i<nkeys; i++)
+        if (memcmp(keys + i*nnodes, key, nnodes * sizeof(int)) == 0)
+            return true;
+    return false;
+}
+
+
+// Returns the duplication-loss prior of a gene tree after reconciling it
+static double prescreen_score(Prescreener *pre, Tree *tree,
+                              int *gene2species, int *recon, int *events,
+                              float birth, float death, double *doomtable)
+{
+    reconcile(tree, &pre->stree, gene2species, recon);
+    labelEvents(tree, recon, events);
+    return birthDeathTreePriorFull(tree, &pre->stree, recon, events,
+                                   birth, death, doomtable);
+}
+
+
+Prescreener *new_prescreener(int *pstree, int nsnodes, float *sdists)
+{
+    return new Prescreener(pstree, nsnodes, sdists);
+}
+
+
+void delete_prescreener(Prescreener *pre)
+{
+    delete pre;
+}
+
+
+// Proposes a new gene tree topology by prescreening a pool of NNI and SPR
+// moves with the duplication-loss prior (see
+// compbio.phylo.TreeSearchPrescreen).
+//
+// 'ptree' is the current gene tree as a parent array (root last) and
+// 'gene2species' gives the species index of each leaf.  'npool' moves are
+// made in turn, each chosen as an NNI with probability 'nni_weight' and an
+// SPR otherwise.  A move whose topology is already in the pool (or is the
+// current tree) is replaced by a new one, up to PRESCREEN_MAXTRIES tries.
+// A move is kept if it scores better than every tree before it, otherwise
+// it is undone.  One tree of the pool is then chosen with probability
+// proportional to its prior.
+//
+// The pool is built in place on one tree, so only the chosen tree is
+// written out, to 'chosen_ptree'.  Leaves and the root keep their indices.
+// The log prior of each pool member is written to 'scores'.  Returns the
+// pool index of the chosen tree, or -1 if the tree is too small for any
+// move, in which case 'chosen_ptree' is a copy of 'ptree'.
+int prescreen_propose(Prescreener *pre, int *ptree, int nnodes,
+                      int *gene2species, float birth, float death,
+                      double *doomtable, int npool, double nni_weight,
+                      RandomStream *rand, int *chosen_ptree, double *scores)
+{
+    if (nnodes < 5 || npool < 1) {
+        for (int i=0; i<nnodes; i++)
+            chosen_ptree[i] = ptree[i];
+        return -1;
+    }
+    if (!rand)
+        rand = default_random_stream();
+
+    Tree *tree = makeTree(nnodes, ptree);
+    int *recon = new int [nnodes];
+    int *events = new int [nnodes];
+    PrescreenMove *moves = new PrescreenMove [npool];
+    int *keys = new int [(npool + 1) * nnodes];
+    tree->hashkey(keys);
+
+    // make pool of subproposals
+    double best_score = prescreen_score(pre, tree, gene2species,
+                                        recon, events, birth, death,
+                                        doomtable);
+    double total = -INFINITY;
+    for (int i=0; i<npool; i++) {
+        int *key = keys + (i+1) * nnodes;
+        for (int j=0; j<PRESCREEN_MAXTRIES; j++) {
+            if (j > 0)
+                undo_move(tree, &moves[i]);
+            if (rand->frand() < nni_weight)
+                propose_nni(tree, rand, &moves[i]);
+            else
+                propose_spr(tree, rand, &moves[i]);
+            perform_move(tree, &moves[i]);
+
+            tree->hashkey(key);
+            if (!seen_topology(keys, i+1, key, nnodes))
+                break;
+        }
+
+        scores[i] = prescreen_score(pre, tree, gene2species,
+                                    recon, events, birth, death, doomtable);
+        total = logadd(total, scores[i]);
+
+        moves[i].kept = (scores[i] > best_score);
+        if (moves[i].kept)
+            best_score = scores[i];
+        else
+            undo_move(tree, &moves[i]);
+    }
+
+    // choose one of the subproposals
+    double choice = rand->frand();
+    double partsum = -INFINITY;
+    int chosen = npool - 1;
+    for (int i=0; i<npool; i++) {
+        partsum = logadd(partsum, scores[i]);
+        if (choice < exp(partsum - total)) {
+            chosen = i;
+            break;
+        }
+    }
+
+    // rewind the kept moves made after the chosen one
+    for (int i=npool-1; i>chosen; i--)
+        if (moves[i].kept)
+            undo_move(tree, &moves[i]);
+    if (!moves[chosen].kept)
+        perform_move(tree, &moves[chosen]);
+    tree2ptree(tree, chosen_ptree);
+
+    // clean up
+    delete tree;
+    delete [] recon;
+    delete [] events;
+    delete [] moves;
+    delete [] keys;
+
+    return chosen;
+}
+
+
 } // extern C
 
 } // namespace dlcoal
@@ -14,6 +14,16 @@ enum {
 };
 
 
+class Prescreener;
+class RandomStream;
+
+Prescreener *new_prescreener(int *pstree, int nsnodes, float *sdists);
+void delete_prescreener(Prescreener *pre);
+int prescreen_propose(Prescreener *pre, int *ptree, int nnodes,
+                      int *gene2species, float birth, float death,
+                      double *doomtable, int npool, double nni_weight,
+                      RandomStream *rand, int *chosen_ptree, double *scores);
+
 }
 
 } // namespace dlcoal
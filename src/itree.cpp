@@ -10,7 +10,15 @@ namespace dlcoal {
 intnode *make_itree(int nnodes, int *ptree)
 {
     intnode *itree = new intnode [nnodes];
-    
+    init_itree(itree, nnodes, ptree);
+    return itree;
+}
+
+
+// populates an already allocated int tree from a parent tree
+// Note: assumes binary tree
+void init_itree(intnode *itree, int nnodes, int *ptree)
+{
     // initialize
     for (int i=0; i<nnodes; i++) {
         itree[i].parent = ptree[i];
@@ -29,8 +37,6 @@ intnode *make_itree(int nnodes, int *ptree)
                 itree[parent].child[1] = i;
         }
     }
-
-    return itree;
 }
 
 
@@ -13,6 +13,7 @@ struct intnode
 };
 
 intnode *make_itree(int nnodes, int *ptree);
+void init_itree(intnode *itree, int nnodes, int *ptree);
 void free_itree(intnode *itree);
 
 
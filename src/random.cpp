@@ -0,0 +1,63 @@
+
+#include "random.h"
+
+
+namespace dlcoal {
+
+extern "C" {
+
+// stream used when the caller does not provide one
+static RandomStream g_default_stream;
+
+
+RandomStream *new_random_stream(uint64_t seed, uint64_t family,
+                                uint64_t chain, uint64_t thread)
+{
+    return new RandomStream(seed, family, chain, thread);
+}
+
+
+void delete_random_stream(RandomStream *rand)
+{
+    delete rand;
+}
+
+
+void seed_random_stream(RandomStream *rand, uint64_t seed, uint64_t family,
+                        uint64_t chain, uint64_t thread)
+{
+    rand->set_seed(seed, family, chain, thread);
+}
+
+
+double random_stream_frand(RandomStream *rand)
+{
+    return rand->frand();
+}
+
+
+// Copies the generator state of 'rand' into 'state' (4 integers)
+void random_stream_get_state(RandomStream *rand, uint64_t *state)
+{
+    for (int i=0; i<4; i++)
+        state[i] = rand->state[i];
+}
+
+
+// Restores a generator state saved with random_stream_get_state()
+void random_stream_set_state(RandomStream *rand, uint64_t *state)
+{
+    for (int i=0; i<4; i++)
+        rand->state[i] = state[i];
+}
+
+
+RandomStream *default_random_stream()
+{
+    return &g_default_stream;
+}
+
+
+} // extern "C"
+
+} // namespace dlcoal
@@ -0,0 +1,114 @@
+/*=============================================================================
+
+  Random number streams
+
+  Each stream holds its own generator state, so that native code can sample
+  from several threads without locking and reproduce its results exactly.
+
+=============================================================================*/
+
+#ifndef DLCOAL_RANDOM_H
+#define DLCOAL_RANDOM_H
+
+#include <math.h>
+#include <stdint.h>
+
+
+namespace dlcoal {
+
+
+// Scrambles a 64-bit integer (SplitMix64 finalizer)
+inline uint64_t mix64(uint64_t z)
+{
+    z += 0x9e3779b97f4a7c15ULL;
+    z = (z ^ (z >> 30)) * 0xbf58476d1ce4e5b9ULL;
+    z = (z ^ (z >> 27)) * 0x94d049bb133111ebULL;
+    return z ^ (z >> 31);
+}
+
+
+// A random number stream using the xoshiro256** generator
+//
+// A stream is identified by the key (seed, family, chain, thread).  Streams
+// with different keys are statistically independent, so each gene family,
+// search chain, and thread can be given its own stream.
+class RandomStream
+{
+public:
+    RandomStream(uint64_t seed=0, uint64_t family=0, uint64_t chain=0,
+                 uint64_t thread=0)
+    {
+        set_seed(seed, family, chain, thread);
+    }
+
+    void set_seed(uint64_t seed, uint64_t family, uint64_t chain,
+                  uint64_t thread)
+    {
+        uint64_t x = mix64(mix64(mix64(mix64(seed) ^ family) ^ chain) ^ 
+                           thread);
+        for (int i=0; i<4; i++)
+            state[i] = x = mix64(x);
+    }
+
+    // Seeds 'child' with a new stream derived from this one and 'id'
+    void split(RandomStream *child, uint64_t id)
+    {
+        child->set_seed(next(), 0, 0, id);
+    }
+
+    // Seeds 'child' with substream 'id' of this stream without advancing
+    // it, so that the same state and 'id' always give the same substream
+    void substream(RandomStream *child, uint64_t id) const
+    {
+        child->set_seed(state[0] ^ state[2], state[1] ^ state[3], id, 0);
+    }
+
+    // Returns the next random 64-bit integer
+    uint64_t next()
+    {
+        const uint64_t result = rotl(state[1] * 5, 7) * 9;
+        const uint64_t t = state[1] << 17;
+
+        state[2] ^= state[0];
+        state[3] ^= state[1];
+        state[1] ^= state[2];
+        state[0] ^= state[3];
+        state[2] ^= t;
+        state[3] = rotl(state[3], 45);
+
+        return result;
+    }
+
+    // Returns a uniform random number in [0, max)
+    double frand(double max=1.0)
+    { return (next() >> 11) * (1.0 / 9007199254740992.0) * max; }
+
+    // Returns an exponential random variable with rate 'lambda'
+    double expovariate(double lambda)
+    { return -log(1.0 - frand()) / lambda; }
+
+    uint64_t state[4];
+
+protected:
+    static inline uint64_t rotl(const uint64_t x, int k)
+    { return (x << k) | (x >> (64 - k)); }
+};
+
+
+extern "C" {
+
+RandomStream *new_random_stream(uint64_t seed, uint64_t family,
+                                uint64_t chain, uint64_t thread);
+void delete_random_stream(RandomStream *rand);
+void seed_random_stream(RandomStream *rand, uint64_t seed, uint64_t family,
+                        uint64_t chain, uint64_t thread);
+double random_stream_frand(RandomStream *rand);
+void random_stream_get_state(RandomStream *rand, uint64_t *state);
+void random_stream_set_state(RandomStream *rand, uint64_t *state);
+RandomStream *default_random_stream();
+
+}
+
+} // namespace dlcoal
+
+#endif // DLCOAL_RANDOM_H
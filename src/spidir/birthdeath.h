@@ -24,9 +24,90 @@ double birthDeathCountsLog(int start, int end, float time,
                            float birth, float death);
 double sampleBirthWaitTime1(float T, float birth, float death);
 
+double birthWaitTime(float t, int n, float T, float birth, float death);
+double birthWaitTime1(float t, float T, float birth, float death);
+double birthWaitTimeNumer(float t, int n, float T, 
+                          float birth, float death, double denom);
+double birthWaitTimeDenom(int n, float T, float birth, float death);
+double birthWaitTimeNumer1(float t, float T, float birth, float death, 
+                           float denom);
+double birthWaitTimeDenom1(float T, float birth, float death);
 
+
+}
+
+
+// Same as sampleBirthWaitTime, but draws uniform random numbers from
+// 'rand', which must provide 'double frand(double max=1.0)'
+template <class Random>
+double sampleBirthWaitTime(int n, float T, float birth, float death,
+                           Random *rand)
+{
+    // uses rejection sampling
+    if (birth == death) {
+        double start_y = birthWaitTime(0, n, T, birth, death);
+        double end_y = birthWaitTime(T, n, T, birth, death);
+        double M = (start_y > end_y) ? start_y : end_y;
+    
+        while (true) {
+            double t = rand->frand(T);
+            double f = birthWaitTime(t, n, T, birth, death);
+            
+            if (rand->frand() <= f / M)
+                return t;
+        }
+    } else {
+        double denom = birthWaitTimeDenom(n, T, birth, death);
+        double start_y = birthWaitTimeNumer(0, n, T, birth, death, denom);
+        double end_y = birthWaitTimeNumer(T, n, T, birth, death, denom);
+        double M = (start_y > end_y) ? start_y : end_y;
+    
+        while (true) {
+            double t = rand->frand(T);
+            double f = birthWaitTimeNumer(t, n, T, birth, death, denom);
+
+            if (rand->frand() <= f / M)
+                return t;
+        }
+    }
 }
 
+
+// Same as sampleBirthWaitTime1, but draws uniform random numbers from
+// 'rand', which must provide 'double frand(double max=1.0)'
+template <class Random>
+double sampleBirthWaitTime1(float T, float birth, float death, Random *rand)
+{
+    // uses rejection sampling
+    if (birth == death) {
+        double start_y = birthWaitTime1(0, T, birth, death);
+        double end_y = birthWaitTime1(T, T, birth, death);
+        double M = (start_y > end_y) ? start_y : end_y;
+    
+        while (true) {
+            double t = rand->frand(T);
+            double f = birthWaitTime1(t, T, birth, death);
+            
+            if (rand->frand() <= f / M)
+                return t;
+        }
+    } else {
+        double denom = birthWaitTimeDenom1(T, birth, death);
+        double start_y = birthWaitTimeNumer1(0, T, birth, death, denom);
+        double end_y = birthWaitTimeNumer1(T, T, birth, death, denom);
+        double M = (start_y > end_y) ? start_y : end_y;
+    
+        while (true) {
+            double t = rand->frand(T);
+            double f = birthWaitTimeNumer1(t, T, birth, death, denom);
+
+            if (rand->frand() <= f / M)
+                return t;
+        }
+    }
+}
+
+
 } // namespace spidir
 
 #endif // SPIDIR_BIRTHDEATH_H
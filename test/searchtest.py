@@ -0,0 +1,58 @@
+# shared setup for tests of the reconciliation search
+
+import unittest
+import random
+
+import dlcoal
+import dlcoal.recon
+
+from rasmus import treelib
+
+from compbio import phylo
+
+
+class SearchTest (unittest.TestCase):
+    """
+    Base class for tests that search reconciliations of the 96 flies coal
+    tree with few samples
+    """
+
+    def setUp(self):
+        self.stree = treelib.read_tree("../examples/config/flies.stree")
+        self.gene2species = phylo.read_gene2species(
+            "../examples/config/flies.smap")
+        self.coal_tree = treelib.read_tree("data/flies/96/96.coal.tree")
+        self.times = treelib.get_tree_timestamps(self.stree)
+        self.popsize = 1e6 * 1e-9 * 2
+        self.duprate = .0012
+        self.lossrate = .0011
+        self.premean = .5 * self.times[self.stree.root]
+        self.nsamples = 10
+
+
+    def seed(self, seed=1):
+        """Seeds the python and native random numbers"""
+        random.seed(seed)
+        if dlcoal.dlcoalc:
+            dlcoal.seed_random(seed)
+
+
+    def dlcoal_recon(self, **kwargs):
+        """Runs dlcoal.recon.dlcoal_recon() with the shared arguments"""
+        kwargs.setdefault("log", dlcoal.NullLog())
+        return dlcoal.recon.dlcoal_recon(
+            self.coal_tree, self.stree, self.gene2species, self.popsize,
+            self.duprate, self.lossrate, premean=self.premean,
+            nsamples=self.nsamples, **kwargs)
+
+
+    def make_recon(self, **kwargs):
+        """Runs dlcoal.recon.make_recon() with the shared arguments"""
+        kwargs.setdefault("log", dlcoal.NullLog())
+        stree = dlcoal.compile_species_tree(self.stree, self.popsize)
+        search = lambda tree: dlcoal.recon.DLCoalTreeSearch(
+            tree, stree, self.gene2species, self.duprate, self.lossrate)
+        return dlcoal.recon.make_recon(
+            self.coal_tree, stree, self.gene2species, self.popsize,
+            self.duprate, self.lossrate, search, premean=self.premean,
+            nsamples=self.nsamples, **kwargs)
@@ -0,0 +1,151 @@
+# test archives of reconciled gene trees
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import dlcoal
+import dlcoal.sim
+from dlcoal.archive import ReconArchive
+
+from rasmus import treelib
+from rasmus.testing import *
+
+
+class Archive (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.stree = treelib.read_tree("../examples/config/flies.stree")
+        self.n = 2 * 1e7 * 1e-9 * 1000
+        self.filename = os.path.join(self.tmpdir, "sims.dlcr")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def read_files(self, prefix):
+        return dict((key, open(prefix + ext).read()) for key, ext in
+                    (("coal_tree", ".coal.tree"),
+                     ("coal_recon", ".coal.recon"),
+                     ("locus_tree", ".locus.tree"),
+                     ("locus_recon", ".locus.recon"),
+                     ("daughters", ".daughters")))
+
+
+    def test_sims(self):
+        """Archived simulations should match simulation files"""
+
+        outdir = os.path.join(self.tmpdir, "sims")
+        args = (self.stree, self.n, .01, .008)
+        dlcoal.sim.dlcoal_sims(outdir, 4, *args, seed=1)
+
+        archive = ReconArchive(self.filename, "w")
+        dlcoal.sim.dlcoal_sims(None, 2, *args, seed=1, archive=archive)
+        archive.close()
+        archive = ReconArchive(self.filename, "a")
+        dlcoal.sim.dlcoal_sims(None, 4, *args, seed=1, start=2,
+                               archive=archive)
+        archive.close()
+
+        archive = ReconArchive(self.filename)
+        self.assertEqual(archive.keys(), ["0", "1", "2", "3"])
+        for i in xrange(4):
+            prefix = os.path.join(outdir, str(i), str(i))
+            self.assertEqual(archive.read_files(i), self.read_files(prefix))
+
+            coal_tree, extra = archive.read(i, self.stree)
+            self.assertEqual(
+                dlcoal.format_dlcoal_recon(coal_tree, extra),
+                self.read_files(prefix))
+        archive.close()
+
+
+    def open_child(self, mode, famid=None, files=None):
+        """
+        Opens the archive from another process (writing a family if given)
+        and returns its process id
+        """
+        pid = os.fork()
+        if pid == 0:
+            try:
+                archive = ReconArchive(self.filename, mode)
+                if famid is not None:
+                    archive.write_files(famid, files)
+                archive.close()
+                os._exit(0)
+            except Exception:
+                os._exit(1)
+        return pid
+
+
+    def wait_child(self, pid):
+        """Returns True if the child process opened the archive"""
+        return os.waitpid(pid, 0)[1] == 0
+
+
+    def test_writers(self):
+        """A second writer should not damage an open archive"""
+
+        coal_tree, extra = dlcoal.sim.sample_dlcoal(
+            self.stree, self.n, .01, .008)
+        files = dlcoal.format_dlcoal_recon(coal_tree, extra)
+
+        archive = ReconArchive(self.filename, "w")
+        archive.write_files(0, files)
+        archive.stream.flush()
+        self.assertFalse(self.wait_child(self.open_child("w")))
+        archive.write_files(1, files)
+
+        # an appending writer waits for the archive
+        pid = self.open_child("a", 2, files)
+        archive.close()
+        self.assertTrue(self.wait_child(pid))
+
+        archive = ReconArchive(self.filename)
+        self.assertEqual(archive.keys(), ["0", "1", "2"])
+        for famid in archive:
+            self.assertEqual(archive.read_files(famid), files)
+        archive.close()
+
+
+    def test_recover(self):
+        """An archive that was not closed should be readable"""
+
+        archive = ReconArchive(self.filename, "w")
+        files = []
+        for i in xrange(3):
+            coal_tree, extra = dlcoal.sim.sample_dlcoal(
+                self.stree, self.n, .01, .008)
+            files.append(dlcoal.format_dlcoal_recon(coal_tree, extra))
+            archive.write_files(i, files[i])
+        archive.close()
+
+        # replace a family and stop without writing the index
+        archive = ReconArchive(self.filename, "a")
+        archive.write_files(0, files[2])
+        archive.stream.flush()
+        archive.stream.close()
+
+        # add an incomplete record
+        out = open(self.filename, "a")
+        out.write('{"coal_recon": "')
+        out.close()
+
+        archive = ReconArchive(self.filename)
+        self.assertEqual(archive.keys(), ["0", "1", "2"])
+        self.assertEqual(archive.read_files(0), files[2])
+        self.assertEqual(archive.read_files(1), files[1])
+        archive.close()
+
+        # a writer repairs the archive
+        ReconArchive(self.filename, "a").close()
+        archive = ReconArchive(self.filename)
+        self.assertEqual(archive.keys(), ["0", "1", "2"])
+        self.assertEqual(archive.read_files(2), files[2])
+        archive.close()
+
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,85 @@
+# test dlcoal.arraytree
+
+import unittest
+
+import dlcoal
+from dlcoal.arraytree import ArrayTree
+
+from rasmus import treelib
+from rasmus.testing import *
+
+from compbio import phylo
+
+
+def check_layout(test, atree):
+    """Leaves first, root last, parents after children"""
+    nnodes = len(atree)
+    test.assertEqual(atree.parent[nnodes-1], -1)
+    for i in xrange(nnodes):
+        test.assertEqual(atree.is_leaf(i), i < atree.nleaves)
+        if i != nnodes - 1:
+            test.assertTrue(atree.parent[i] > i)
+        for child in atree.children(i):
+            test.assertEqual(atree.parent[child], i)
+
+
+def check_nodes(test, atree):
+    """The treelib nodes should match the arrays"""
+    nodes = atree.nodes
+    test.assertEqual(sorted(nodes), sorted(atree.tree))
+    test.assertTrue(atree.tree.root is nodes[-1])
+    for i, node in enumerate(nodes):
+        test.assertEqual(atree.nodelookup[node], i)
+        test.assertEqual(node.name, atree.names[i])
+        test.assertEqual(node.children,
+                         [nodes[child] for child in atree.children(i)])
+
+
+class ArrayTreeTest (unittest.TestCase):
+
+    def setUp(self):
+        self.tree = treelib.parse_newick(
+            "(((a:1,b:2):3,(c:4,d:5):6):7,(e:8,f:9):10);")
+
+
+    def test_convert(self):
+        """Array trees should round trip with treelib"""
+
+        atree = ArrayTree(self.tree)
+        check_layout(self, atree)
+        check_nodes(self, atree)
+
+        ptree, nodes, nodelookup = dlcoal.make_ptree(self.tree)
+        self.assertEqual(list(atree.parent), ptree)
+
+        tree2 = atree.get_tree()
+        self.assertEqual(phylo.hash_tree(tree2), phylo.hash_tree(self.tree))
+        for node in self.tree.leaves():
+            self.assertEqual(tree2.nodes[node.name].dist, node.dist)
+
+
+    def test_prob(self):
+        """An array tree should evaluate like its treelib tree"""
+
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        coal_tree, extra = dlcoal.read_dlcoal_recon("data/flies/96/96", stree)
+        locus_tree = extra["locus_tree"]
+        atree = ArrayTree(coal_tree)
+        check_nodes(self, atree)
+
+        if not dlcoal.dlcoalc:
+            return
+        rand = dlcoal.RandomStream(1)
+        probs = []
+        for tree in (coal_tree, atree):
+            rand.seed(1)
+            probs.append(dlcoal.prob_dlcoal_recon_topology(
+                tree, extra["coal_recon"], locus_tree,
+                extra["locus_recon"], extra["locus_events"],
+                extra["daughters"], stree, 1e6, .0012, .0011,
+                premean=1000.0, nsamples=50, rand=rand))
+        self.assertEqual(probs[0], probs[1])
+
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,67 @@
+# test batch evaluation of coal reconciliations
+
+import unittest
+
+import dlcoal
+
+from rasmus import treelib
+from rasmus.testing import *
+
+from compbio import phylo
+
+
+class Batch (unittest.TestCase):
+
+    def test_batch(self):
+        """Batch probabilities should match individual evaluations"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        coal_tree, extra = dlcoal.read_dlcoal_recon(
+            "data/flies/96/96", stree)
+        locus_tree = extra["locus_tree"]
+        n = 1e6
+        duprate = .0012
+        lossrate = .0011
+
+        # alternative coal recons
+        coal_recons = []
+        keys = set()
+        events = phylo.label_events(coal_tree, extra["coal_recon"])
+        for recon, events in phylo.enum_recon(
+            coal_tree, locus_tree, depth=2,
+            recon=extra["coal_recon"].copy(), events=events):
+            key = tuple(sorted((node.name, recon[node].name)
+                               for node in coal_tree))
+            if key not in keys:
+                keys.add(key)
+                coal_recons.append(recon.copy())
+            if len(coal_recons) == 4:
+                break
+        self.assertEqual(len(coal_recons), 4)
+        daughters_list = [extra["daughters"]] * len(coal_recons)
+
+        rand = dlcoal.RandomStream(1)
+        probs = [] 
+        for coal_recon in coal_recons:
+            rand.seed(1)
+            probs.append(dlcoal.prob_dlcoal_recon_topology(
+                coal_tree, coal_recon, locus_tree,
+                extra["locus_recon"], extra["locus_events"],
+                extra["daughters"], stree, n, duprate, lossrate,
+                premean=1000.0, nsamples=50, rand=rand))
+
+        rand.seed(1)
+        probs2 = dlcoal.prob_dlcoal_recon_topology_batch(
+            coal_tree, coal_recons, locus_tree,
+            extra["locus_recon"], extra["locus_events"],
+            daughters_list, stree, n, duprate, lossrate,
+            premean=1000.0, nsamples=50, rand=rand)
+
+        self.assertEqual(probs, probs2)
+
+
+if __name__ == "__main__":
+    test_main()
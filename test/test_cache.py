@@ -0,0 +1,90 @@
+# test the cache of proposal probabilities
+
+import dlcoal
+import dlcoal.recon
+
+from rasmus.testing import *
+
+from searchtest import SearchTest
+
+
+class Cache (SearchTest):
+
+    def make_cached(self, cache_size):
+        """
+        Returns a DLCoalRecon with cache 'cache_size' that counts the
+        likelihood evaluations of each proposal key, and three distinct
+        proposals
+        """
+        self.seed()
+        reconer = self.make_recon(cache_size=cache_size)
+        reconer.init_search()
+
+        proposals = {}
+        proposal = reconer.proposer.init_proposal()
+        while len(proposals) < 3:
+            proposals.setdefault(proposal.get_key(), proposal.copy())
+            proposal = reconer.proposer.next_proposal()
+        proposals = proposals.values()
+
+        self.calls = []
+        eval_proposal = reconer._eval_proposal
+        def record(proposal):
+            self.calls.append(proposal.get_key())
+            return eval_proposal(proposal)
+        reconer._eval_proposal = record
+
+        return reconer, proposals
+
+
+    def test_hit(self):
+        """Repeated proposals should not call the likelihood"""
+
+        reconer, (a, b, c) = self.make_cached(10)
+        p = reconer.eval_proposal(a)
+        data = dict(a.data)
+        self.assertEqual(self.calls, [a.get_key()])
+
+        a.data = {}
+        self.assertEqual(reconer.eval_proposal(a), p)
+        self.assertEqual(a.data, data)
+        self.assertEqual(self.calls, [a.get_key()])
+        self.assertEqual(reconer.nevals, 1)
+        self.assertEqual((reconer.cache_hits, reconer.cache_misses), (1, 1))
+
+
+    def test_evict(self):
+        """The cache should keep the 'cache_size' latest proposals"""
+
+        reconer, (a, b, c) = self.make_cached(2)
+        reconer.eval_proposal(a)
+        reconer.eval_proposal(b)
+        reconer.eval_proposal(a)
+        self.assertEqual(len(self.calls), 2)
+
+        # b is the least recently used and is evicted
+        reconer.eval_proposal(c)
+        self.assertEqual(len(reconer.cache), 2)
+        self.assertEqual(reconer.cache.keys(), [a.get_key(), c.get_key()])
+
+        reconer.eval_proposal(a)
+        self.assertEqual(len(self.calls), 3)
+        reconer.eval_proposal(b)
+        self.assertEqual(self.calls, [a.get_key(), b.get_key(),
+                                      c.get_key(), b.get_key()])
+        self.assertEqual(len(reconer.cache), 2)
+        self.assertEqual((reconer.cache_hits, reconer.cache_misses), (2, 4))
+
+
+    def test_no_cache(self):
+        """Without a cache every proposal calls the likelihood"""
+
+        reconer, (a, b, c) = self.make_cached(0)
+        reconer.eval_proposal(a)
+        reconer.eval_proposal(a)
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(len(reconer.cache), 0)
+
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,46 @@
+# test multiple chains of the reconciliation search
+
+import random
+import StringIO
+
+import dlcoal
+
+from rasmus.testing import *
+
+from searchtest import SearchTest
+
+
+class Chains (SearchTest):
+
+    def recon(self, log, **kwargs):
+        random.seed(1)
+        return self.dlcoal_recon(nsearch=30, nchains=2, share_interval=10,
+                                 log=log, **kwargs)
+
+
+    def test_share(self):
+        """Chains should continue their searches between intervals"""
+
+        log = StringIO.StringIO()
+        maxrecon = self.recon(log)
+
+        # the cache of the best chain counts every iteration
+        data = maxrecon["data"]
+        self.assertEqual(data["cache_hits"] + data["cache_misses"], 30)
+
+        log.seek(0)
+        iters = {}
+        for recon in dlcoal.read_log(log):
+            iters.setdefault(recon["data"]["chain"], []).append(recon["iter"])
+        self.assertEqual(iters, {0: range(30), 1: range(30)})
+
+        # processes should not change the result
+        maxrecon2 = self.recon(dlcoal.NullLog(), nprocs=2)
+        self.assertEqual(
+            dlcoal.format_dlcoal_recon(self.coal_tree, maxrecon2),
+            dlcoal.format_dlcoal_recon(self.coal_tree, maxrecon))
+        self.assertEqual(maxrecon2["data"], maxrecon["data"])
+
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,67 @@
+# test checkpoints of the reconciliation search
+
+import os
+import tempfile
+
+from dlcoal.recon import SearchCheckpoint
+
+from rasmus.testing import *
+
+from searchtest import SearchTest
+
+
+class Interrupt (Exception):
+    pass
+
+
+class Checkpoint (SearchTest):
+
+    def setUp(self):
+        SearchTest.setUp(self)
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.filename)
+
+
+    def tearDown(self):
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+
+    def make_recon(self, **kwargs):
+        self.seed()
+        return SearchTest.make_recon(self, **kwargs)
+
+
+    def test_resume(self):
+        """A resumed search should match an uninterrupted one"""
+
+        for incremental in (False, True):
+            reconer = self.make_recon(incremental=incremental)
+            expected = reconer.recon(60)
+
+            # interrupt a search after 25 evaluations
+            reconer = self.make_recon(
+                incremental=incremental,
+                checkpoint=SearchCheckpoint(self.filename, 10))
+            eval_proposal = reconer.eval_proposal
+            def interrupt(proposal):
+                if reconer.cache_hits + reconer.cache_misses == 25:
+                    raise Interrupt()
+                return eval_proposal(proposal)
+            reconer.eval_proposal = interrupt
+            self.assertRaises(Interrupt, reconer.recon, 60)
+            self.assertTrue(os.path.exists(self.filename))
+
+            reconer = self.make_recon(
+                incremental=incremental,
+                checkpoint=SearchCheckpoint(self.filename, 10, resume=True))
+            maxrecon = reconer.recon(60)
+            self.assertEqual(maxrecon.get_key(), expected.get_key())
+            self.assertTrue(maxrecon.data.pop("resumed_at") > 0)
+            self.assertEqual(maxrecon.data, expected.data)
+            os.remove(self.filename)
+
+
+if __name__ == "__main__":
+    test_main()
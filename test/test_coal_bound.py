@@ -0,0 +1,98 @@
+# test bounded enumeration of coal reconciliations
+
+import unittest
+import random
+
+import dlcoal
+from dlcoal import recon as reconlib
+
+from rasmus import treelib, util
+from rasmus.testing import *
+
+from compbio import phylo, coal
+
+
+class CoalBound (unittest.TestCase):
+
+    def setUp(self):
+        self.stree = treelib.read_tree("../examples/config/flies.stree")
+        self.gene2species = phylo.read_gene2species(
+            "../examples/config/flies.smap")
+        self.coal_tree = treelib.read_tree("data/flies/96/96.coal.tree")
+        self.locus_tree = treelib.read_tree("data/flies/96/96.locus.tree")
+
+        self.locus_recon = phylo.reconcile(self.locus_tree, self.stree,
+                                           self.gene2species)
+        self.locus_events = phylo.label_events(self.locus_tree,
+                                               self.locus_recon)
+        self.coal_recon = phylo.reconcile(self.coal_tree, self.locus_tree,
+                                          lambda x: x)
+
+
+    def key(self, recon):
+        return sorted((x.name, y.name) for x, y in recon.iteritems())
+
+
+    def test_enum(self):
+        """Without a bound, enumeration should match phylo.enum_recon"""
+
+        recons = reconlib.enum_coal_recon_bounded(
+            self.coal_tree, self.locus_tree, self.coal_recon, set(), 2,
+            lambda: -util.INF)
+        expected = [self.key(r) for r, events in phylo.enum_recon(
+            self.coal_tree, self.locus_tree, recon=dict(self.coal_recon),
+            depth=2)]
+
+        # phylo.enum_recon also yields the starting reconciliation
+        self.assertEqual(sorted(self.key(r) for r in recons),
+                         sorted(expected[1:]))
+
+
+    def test_bound(self):
+        """The bound should be above the probability for any dup times"""
+
+        random.seed(1)
+        n = 1e6
+        cstree = dlcoal.compile_species_tree(self.stree)
+        stimes = cstree.times
+        daughters = reconlib.propose_daughters(
+            self.coal_tree, self.coal_recon, self.locus_tree,
+            self.locus_events)
+        branch_bound = dlcoal.coal.make_coal_branch_bound(
+            self.locus_tree, self.locus_recon, self.locus_events, daughters,
+            stimes, cstree.get_popsizes(n))
+
+        recons = list(reconlib.enum_coal_recon_bounded(
+            self.coal_tree, self.locus_tree, self.coal_recon, daughters, 2,
+            lambda: -util.INF, branch_bound))
+        self.assertTrue(len(recons) > 0)
+
+        for recon in recons[::5] + [self.coal_recon]:
+            lineages = coal.count_lineages_per_branch(
+                self.coal_tree, recon, self.locus_tree)
+            bound = dlcoal.coal.prob_coal_recon_topology_bound(
+                lineages, branch_bound)
+            self.assertTrue(
+                bound <= dlcoal.coal.prob_coal_recon_topology_bound(lineages))
+
+            # sample duplication times within their species branches
+            times = {}
+            for node in self.locus_tree.postorder():
+                snode = self.locus_recon[node]
+                if self.locus_events[node] == "dup":
+                    low = max([stimes[snode]] +
+                              [times[child] for child in node.children])
+                    high = (stimes[snode.parent] if snode.parent
+                            else low + 100)
+                    times[node] = random.uniform(low, high)
+                else:
+                    times[node] = stimes[snode]
+            treelib.set_dists_from_timestamps(self.locus_tree, times)
+
+            p = dlcoal.prob_locus_coal_recon_topology(
+                self.coal_tree, recon, self.locus_tree, n, daughters)
+            self.assertTrue(p <= bound + 1e-6)
+
+
+if __name__ == "__main__":
+    test_main()
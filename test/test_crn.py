@@ -0,0 +1,160 @@
+# test common random numbers for evaluating proposals
+
+import unittest
+import random
+
+import dlcoal
+import dlcoal.recon
+import dlcoal.sim
+
+from rasmus import stats
+from rasmus import treelib
+from rasmus import util
+from rasmus.testing import *
+
+from compbio import phylo
+
+
+class CommonRandom (unittest.TestCase):
+
+    def setUp(self):
+        self.stree = treelib.read_tree("../examples/config/flies.stree")
+        self.gene2species = phylo.read_gene2species(
+            "../examples/config/flies.smap")
+        self.times = treelib.get_tree_timestamps(self.stree)
+        self.n = 2 * 1e7 * 1e-9 * 1000
+        self.duprate = .02
+        self.lossrate = .01
+        self.premean = .5 * self.times[self.stree.root]
+
+        # a family with duplications, so that estimates are noisy
+        random.seed(2)
+        self.coal_tree, extra = dlcoal.sim.sample_dlcoal(
+            self.stree, self.n, self.duprate, self.lossrate, minsize=8)
+        self.recon = dlcoal.recon.Recon(
+            extra["coal_recon"], extra["locus_tree"], extra["locus_recon"],
+            extra["locus_events"], extra["daughters"])
+
+        # a closely related proposal: the other daughter of the duplication
+        # whose subtrees differ most in size
+        def sibling(node):
+            return [child for child in node.parent.children
+                    if child is not node][0]
+        daughters = set(extra["daughters"])
+        daughter = max(daughters, key=lambda node: (
+            abs(len(node.leaves()) - len(sibling(node).leaves())),
+            node.name))
+        daughters.remove(daughter)
+        daughters.add(sibling(daughter))
+        self.recon2 = dlcoal.recon.Recon(
+            extra["coal_recon"], extra["locus_tree"], extra["locus_recon"],
+            extra["locus_events"], daughters)
+
+
+    def make_recon(self, common_random, **kwargs):
+        stree = dlcoal.compile_species_tree(self.stree, self.n)
+        search = lambda tree: dlcoal.recon.DLCoalTreeSearch(
+            tree, stree, self.gene2species, self.duprate, self.lossrate)
+        reconer = dlcoal.recon.make_recon(
+            self.coal_tree, stree, self.gene2species, self.n,
+            self.duprate, self.lossrate, search, premean=self.premean,
+            nsamples=4, cache_size=0, common_random=common_random,
+            log=dlcoal.NullLog(), **kwargs)
+        reconer.init_search()
+        return reconer
+
+
+    def prob(self, recon, crn=None, rand=None):
+        return dlcoal.prob_dlcoal_recon_topology(
+            self.coal_tree, recon.coal_recon, recon.locus_tree,
+            recon.locus_recon, recon.locus_events, recon.daughters,
+            self.stree, self.n, self.duprate, self.lossrate,
+            premean=self.premean, nsamples=2, crn=crn, rand=rand)
+
+
+    def test_identical(self):
+        """Identical proposals should get identical estimates"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        dlcoal.seed_random(1)
+        reconer = self.make_recon(True)
+        p = reconer.eval_proposal(self.recon)
+        reconer.eval_proposal(self.recon2)
+        self.assertEqual(reconer.eval_proposal(self.recon), p)
+        self.assertNotEqual(p, -util.INF)
+
+        # without common random numbers the estimates are noisy
+        reconer = self.make_recon(False)
+        p = reconer.eval_proposal(self.recon)
+        self.assertNotEqual(reconer.eval_proposal(self.recon), p)
+
+
+    def test_correlated(self):
+        """Closely related proposals should get correlated estimates"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        probs = []
+        probs2 = []
+        indep = []
+        indep2 = []
+        for i in xrange(30):
+            crn = dlcoal.RandomStream(i)
+            probs.append(self.prob(self.recon, crn=crn))
+            probs2.append(self.prob(self.recon2, crn=crn))
+            indep.append(self.prob(self.recon,
+                                   rand=dlcoal.RandomStream(i)))
+            indep2.append(self.prob(self.recon2,
+                                    rand=dlcoal.RandomStream(i, chain=1)))
+
+        self.assertNotEqual(probs, probs2)
+        self.assertTrue(stats.corr(probs, probs2) > .7)
+        self.assertTrue(stats.corr(indep, indep2) < .5)
+
+
+    def test_threads(self):
+        """Common random numbers should not depend on the thread count"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        reconer = self.make_recon(True)
+        p = reconer.eval_proposal(self.recon)
+        reconer.nthreads = 2
+        self.assertAlmostEqual(reconer.eval_proposal(self.recon), p)
+
+
+    def test_screen_reuse(self):
+        """Full evaluations should add samples to the screening samples"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        p = self.make_recon(True).eval_proposal(self.recon)
+
+        # record the samples drawn
+        nsamples = []
+        prob = dlcoal.prob_dlcoal_recon_topology
+        def record(*args, **kwargs):
+            nsamples.append(kwargs["nsamples"])
+            return prob(*args, **kwargs)
+
+        reconer = self.make_recon(
+            True, screen=dlcoal.recon.SearchScreen(1))
+        reconer.maxp = p - 100
+        dlcoal.prob_dlcoal_recon_topology = record
+        try:
+            p2 = reconer.eval_proposal(self.recon)
+        finally:
+            dlcoal.prob_dlcoal_recon_topology = prob
+
+        self.assertEqual(self.recon.data["stage"], 2)
+        self.assertEqual(nsamples, [1, 3])
+        self.assertAlmostEqual(p2, p)
+
+
+if __name__ == "__main__":
+    test_main()
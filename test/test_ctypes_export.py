@@ -0,0 +1,75 @@
+# test dlcoal.ctypes_export
+
+import unittest
+from array import array
+
+import dlcoal
+from dlcoal import duploss
+from dlcoal.ctypes_export import *
+
+from rasmus import treelib
+from rasmus.testing import *
+
+
+class CArrays (unittest.TestCase):
+
+    def test_buffer(self):
+        """Buffers of the right type should be shared, not copied"""
+
+        buf = array("d", [1.0, 2.0, 3.0])
+        carr = c_array(c_double, buf)
+        carr[1] = 5.0
+        self.assertEqual(list(buf), [1.0, 5.0, 3.0])
+
+        # ctypes arrays pass through
+        self.assertTrue(c_array(c_double, carr) is carr)
+
+
+    def test_copy(self):
+        """Lists and buffers of the wrong type should be copied"""
+
+        for seq in ([1, 2, 3], array("l", [1, 2, 3])):
+            carr = c_array(c_int, seq)
+            carr[1] = 5
+            self.assertEqual(list(seq), [1, 2, 3])
+            self.assertEqual(list(carr), [1, 5, 3])
+
+
+    def test_export(self):
+        """Exported array arguments should accept buffers and lists"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        stree = treelib.parse_newick(
+            "((A:1000, B:1000):500, (C:700, D:700):800);")
+        ctree = dlcoal.tree2ctree(stree)
+
+        doom1 = array("d", [0.0] * len(stree.nodes))
+        doom2 = [0.0] * len(stree.nodes)
+        duploss.calcDoomTable(ctree, .000012, .000011, doom1)
+        duploss.calcDoomTable(ctree, .000012, .000011, doom2)
+        dlcoal.deleteTree(ctree)
+
+        self.assertEqual(list(doom1), doom2)
+        self.assertTrue(max(doom2) < 0.0)
+
+
+    def test_inputs(self):
+        """Lists passed as input arrays should not be written back"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        class ReadOnly (list):
+            def __setslice__(self, i, j, values):
+                raise Exception("input array was written back")
+
+        stree = treelib.parse_newick(
+            "((A:1000, B:1000):500, (C:700, D:700):800);")
+        ptree, nodes, nodelookup = dlcoal.make_ptree(stree)
+        dlcoal.deleteTree(dlcoal.makeTree(len(ptree), ReadOnly(ptree)))
+
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,88 @@
+# test the LCA index of compiled species trees
+
+import unittest
+
+import dlcoal
+
+from rasmus import treelib
+from rasmus.testing import *
+
+from compbio import phylo
+
+
+class LCA (unittest.TestCase):
+
+    def setUp(self):
+        self.stree = treelib.read_tree("../examples/config/flies.stree")
+        self.gene2species = phylo.read_gene2species(
+            "../examples/config/flies.smap")
+        self.cstree = dlcoal.compile_species_tree(self.stree)
+
+
+    def test_lca(self):
+        """The index should match treelib.lca for every pair of nodes"""
+
+        for node1 in self.stree:
+            for node2 in self.stree:
+                self.assertTrue(self.cstree.lca(node1, node2) is
+                                treelib.lca([node1, node2]))
+
+
+    def test_reconcile(self):
+        """Reconciliations should match phylo.reconcile"""
+
+        trees = [treelib.read_tree("data/flies/96/96.coal.tree"),
+                 treelib.read_tree("data/flies/96/96.locus.tree")]
+
+        # a gene node with three children
+        tree = trees[0].copy()
+        node = [child for child in tree.root.children
+                if not child.is_leaf()][0]
+        tree.remove(node)
+        for child in node.children:
+            tree.add_child(tree.root, child)
+        self.assertEqual(len(tree.root.children), 3)
+        trees.append(tree)
+
+        recons = dlcoal.reconcile_many(trees, self.stree, self.gene2species)
+        for tree, recon in zip(trees, recons):
+            self.assertEqual(
+                recon, phylo.reconcile(tree, self.stree, self.gene2species))
+
+
+
+    def test_multifurcating(self):
+        """Species trees that are only reconciled need not be binary"""
+
+        stree = treelib.parse_newick("((A:1,B:2,C:1):1,D:1);")
+        cstree = dlcoal.compile_species_tree(stree)
+        for node1 in stree:
+            for node2 in stree:
+                self.assertTrue(cstree.lca(node1, node2) is
+                                treelib.lca([node1, node2]))
+
+        gene2species = lambda name: name[0]
+        tree = treelib.parse_newick("(((A1,B1),(C1,D1)),(A2,C2,B2));")
+        self.assertEqual(cstree.reconcile(tree, gene2species),
+                         phylo.reconcile(tree, stree, gene2species))
+
+        # the native tree would have room for only two children
+        self.assertRaises(Exception, lambda: cstree.ctree)
+
+
+    def test_compile_once(self):
+        """A species tree should be compiled once, and indexed on use"""
+
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        cstree = dlcoal.compile_species_tree(stree)
+        self.assertTrue(dlcoal.compile_species_tree(stree) is cstree)
+        self.assertTrue(dlcoal.compile_species_tree(cstree) is cstree)
+        self.assertTrue(cstree._lca_table is None)
+
+        cstree.reconcile(treelib.read_tree("data/flies/96/96.coal.tree"),
+                         self.gene2species)
+        self.assertTrue(cstree._lca_table is not None)
+
+
+if __name__ == "__main__":
+    test_main()
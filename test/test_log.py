@@ -0,0 +1,59 @@
+# test writing and reading search logs
+
+import unittest
+import os
+import tempfile
+
+import dlcoal
+from dlcoal import recon as reconlib
+
+from rasmus import treelib
+from rasmus.testing import *
+
+from compbio import phylo
+
+
+class Log (unittest.TestCase):
+
+    def test_round_trip(self):
+        """Logged proposals should be read back with shared locus records"""
+
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        gene2species = phylo.read_gene2species("../examples/config/flies.smap")
+        coal_tree = treelib.read_tree("data/flies/96/96.coal.tree")
+        locus_tree = coal_tree.copy()
+
+        locus_recon = phylo.reconcile(locus_tree, stree, gene2species)
+        locus_events = phylo.label_events(locus_tree, locus_recon)
+        coal_recon = phylo.reconcile(coal_tree, locus_tree, lambda x: x)
+        daughters = set()
+        recon = reconlib.Recon(coal_recon, locus_tree, locus_recon,
+                               locus_events, daughters, data={"logp": -1.5})
+
+        fd, filename = tempfile.mkstemp()
+        try:
+            stream = os.fdopen(fd, "w")
+            writer = dlcoal.LogWriter(stream, interval=2)
+            for i in xrange(5):
+                writer.write_recon(recon)
+            stream.close()
+
+            lines = open(filename).readlines()
+            self.assertEqual(len(lines), 4)
+
+            records = list(dlcoal.read_log(filename))
+            self.assertEqual([x["iter"] for x in records], [0, 2, 4])
+            for record in records:
+                self.assertEqual(record["locus_top"],
+                                 phylo.hash_tree(locus_tree))
+                self.assertEqual(
+                    sorted(map(tuple, record["coal_recon"])),
+                    sorted((x.name, y.name)
+                           for x, y in coal_recon.iteritems()))
+                self.assertEqual(record["data"], {"logp": -1.5})
+        finally:
+            os.remove(filename)
+
+
+if __name__ == "__main__":
+    test_main()
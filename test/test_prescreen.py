@@ -0,0 +1,111 @@
+# test prescreening of gene tree proposals
+
+import unittest
+import random
+
+import dlcoal
+from dlcoal import duploss
+from dlcoal import recon as reconlib
+
+from rasmus import treelib
+from rasmus.testing import *
+
+from compbio import phylo
+
+
+class Prescreen (unittest.TestCase):
+
+    def test_scores(self):
+        """Pool scores should match the python topology prior"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        gene2species = phylo.read_gene2species("../examples/config/flies.smap")
+        tree = treelib.read_tree("data/flies/96/96.locus.tree")
+        hashes = set([phylo.hash_tree(tree)])
+        duprate = .0012
+        lossrate = .0011
+        cstree = dlcoal.compile_species_tree(stree)
+        prescreener = duploss.Prescreener(cstree)
+        rand = dlcoal.RandomStream(1)
+
+        for i in xrange(10):
+            ptree, nodes, nodelookup = dlcoal.make_ptree(tree)
+            chosen, index, scores = prescreener.propose(
+                ptree, nodes, gene2species, duprate, lossrate, 10,
+                rand=rand)
+            self.assertTrue(0 <= index < 10)
+            self.assertEqual(chosen[-1], -1)
+
+            dlcoal.set_tree_ptree(tree, chosen, nodes)
+            treelib.assert_tree(tree)
+            hashes.add(phylo.hash_tree(tree))
+
+            recon = phylo.reconcile(tree, stree, gene2species)
+            events = phylo.label_events(tree, recon)
+            p = duploss.prob_dup_loss(tree, cstree, recon, events,
+                                      duprate, lossrate)
+            self.assertAlmostEqual(p, scores[index], places=4)
+
+        # the search should move
+        self.assertTrue(len(hashes) > 1)
+
+
+    def test_unique_pool(self):
+        """The python pool should not repeat topologies"""
+
+        random.seed(1)
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        gene2species = phylo.read_gene2species("../examples/config/flies.smap")
+        tree = treelib.read_tree("data/flies/96/96.locus.tree")
+        search = reconlib.DLCoalPrescreen(
+            tree, stree, gene2species, .0012, .0011, 10)
+        search.prescreener = None
+
+        # record the topology of each scored tree
+        tops = []
+        score = search.score
+        def record(tree):
+            tops.append(phylo.hash_tree(tree))
+            return score(tree)
+        search.score = record
+
+        for i in xrange(10):
+            tops[:] = []
+            search.propose()
+            self.assertEqual(len(tops), 11)
+            self.assertEqual(len(set(tops)), 11)
+
+
+    def test_sync(self):
+        """The native parent array should follow the moves of a search"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        random.seed(1)
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        gene2species = phylo.read_gene2species("../examples/config/flies.smap")
+        tree = treelib.read_tree("data/flies/96/96.coal.tree")
+        search = reconlib.DLCoalTreeSearch(
+            tree, stree, gene2species, .0012, .0011, nprescreen=10, weight=.5)
+        prescreen = search.prescreen
+
+        for i in xrange(40):
+            search.propose()
+            if random.random() < .5:
+                search.revert()
+            treelib.assert_tree(tree)
+
+            if prescreen._ptree is not None:
+                nodes = prescreen._nodes
+                self.assertEqual(
+                    prescreen._ptree,
+                    [nodes.index(node.parent) if node.parent else -1
+                     for node in nodes])
+
+
+if __name__ == "__main__":
+    test_main()
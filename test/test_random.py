@@ -0,0 +1,70 @@
+# test dlcoal native random streams
+
+import unittest
+
+import dlcoal
+
+from rasmus import stats
+from rasmus.testing import *
+
+
+class RandomStreams (unittest.TestCase):
+
+    def test_reproducible(self):
+        """Streams with the same key should give the same numbers"""
+        
+        rand1 = dlcoal.RandomStream(7, family=3, chain=1)
+        rand2 = dlcoal.RandomStream(7, family=3, chain=1)
+        
+        vals1 = [rand1.random() for i in xrange(100)]
+        vals2 = [rand2.random() for i in xrange(100)]
+        self.assertEqual(vals1, vals2)
+
+        # reseeding restarts the stream
+        rand1.seed(7, family=3, chain=1)
+        self.assertEqual(vals1, [rand1.random() for i in xrange(100)])
+        
+
+    def test_independent(self):
+        """Streams with different keys should give different numbers"""
+
+        keys = [(7, 0, 0), (8, 0, 0), (7, 1, 0), (7, 0, 1)]
+        vals = [tuple(dlcoal.RandomStream(*key).random() for i in xrange(10))
+                for key in keys]
+        self.assertEqual(len(set(vals)), len(keys))
+        
+        for row in vals:
+            for x in row:
+                self.assertTrue(0.0 <= x < 1.0)
+
+
+    def test_uniform(self):
+        """Stream should be uniform on [0, 1)"""
+
+        rand = dlcoal.RandomStream(1)
+        n = 100000
+        vals = [rand.random() for i in xrange(n)]
+        fequal(stats.mean(vals), .5, .01)
+        fequal(stats.variance(vals), 1/12., .01)
+
+
+    def test_state(self):
+        """Restoring a saved state should repeat the stream"""
+
+        rand = dlcoal.RandomStream(5)
+        rand.random()
+        state = rand.get_state()
+        vals = [rand.random() for i in xrange(10)]
+
+        rand2 = dlcoal.RandomStream()
+        rand2.set_state(state)
+        self.assertEqual(vals, [rand2.random() for i in xrange(10)])
+        self.assertEqual(rand2.get_state(), rand.get_state())
+
+        
+
+
+#=============================================================================
+
+if __name__ == "__main__":
+    test_main()
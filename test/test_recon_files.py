@@ -0,0 +1,136 @@
+# test reconciling files of several coal trees with dlcoal_recon
+
+import unittest
+import os
+import sys
+import shutil
+import subprocess
+import tempfile
+import StringIO
+
+import dlcoal
+
+from rasmus import treelib
+from rasmus.testing import *
+
+from compbio import phylo
+
+
+class ReconFiles (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+        # coal trees with the same leaves and different topologies
+        self.coal_tree = treelib.read_tree("data/flies/96/96.coal.tree")
+        self.coal_tree2 = self.coal_tree.copy()
+        node = [node for node in self.coal_tree2.root.children
+                if not node.is_leaf()][0]
+        phylo.perform_nni(self.coal_tree2, node.parent, node, 0)
+        self.assertNotEqual(phylo.hash_tree(self.coal_tree2),
+                            phylo.hash_tree(self.coal_tree))
+
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def recon(self, name, coal_trees, *args):
+        """
+        Reconciles 'coal_trees' in one file with dlcoal_recon and returns
+        the text of the log of each tree
+
+        Runs are kept in directories 'name', since the random numbers of a
+        family depend on its file name.
+        """
+
+        os.mkdir(os.path.join(self.tmpdir, name))
+        treefile = os.path.join(self.tmpdir, name, "fam.coal.tree")
+        out = open(treefile, "w")
+        for tree in coal_trees:
+            tree.write(out, oneline=True)
+            out.write("\n")
+        out.close()
+
+        devnull = open(os.devnull, "w")
+        subprocess.check_call(
+            [sys.executable, "../bin/dlcoal_recon",
+             "-s", "../examples/config/flies.stree",
+             "-S", "../examples/config/flies.smap",
+             "-n", "1e7", "-D", ".0012", "-L", ".0011", "-g", ".1",
+             "-I", ".coal.tree", "-O", ".dlcoal", "-i", "30",
+             "--nsamples", "2", "-x", "1", "-l", "-q"] +
+            list(args) + [treefile], stderr=devnull)
+        devnull.close()
+
+        # each search log ends with summary lines after its records
+        logs = [[]]
+        done = False
+        for line in open(os.path.join(self.tmpdir, name, "fam.dlcoal.log")):
+            if line.startswith("stop:"):
+                done = True
+            elif line.startswith("{") and done:
+                logs.append([])
+                done = False
+            logs[-1].append(line)
+        return ["".join(lines) for lines in logs]
+
+
+    def read_log(self, text):
+        return list(dlcoal.read_log(StringIO.StringIO(text)))
+
+
+    def get_results(self, text):
+        """
+        Returns the records of a log with locus trees reduced to their
+        topologies, since duplication times are sampled for the output
+        """
+        records = self.read_log(text)
+        for record in records:
+            if "locus_tree" in record:
+                record["locus_tree"] = phylo.hash_tree(
+                    treelib.parse_newick(record["locus_tree"]))
+        return records
+
+
+    def test_tree_procs(self):
+        """Parallel searches should give the same results as serial ones"""
+
+        coal_trees = [self.coal_tree, self.coal_tree2, self.coal_tree]
+        logs = self.recon("serial", coal_trees)
+        logs2 = self.recon("parallel", coal_trees, "--tree-procs", "2")
+
+        results = map(self.get_results, logs)
+        results2 = map(self.get_results, logs2)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(map(len, results), map(len, results2))
+        for records, records2 in zip(results, results2):
+            for record, record2 in zip(records, records2):
+                data = record.pop("data", {})
+                data2 = record2.pop("data", {})
+                self.assertEqual(record, record2)
+                self.assertEqual(sorted(data), sorted(data2))
+                for key in data:
+                    self.assertAlmostEqual(data[key], data2[key])
+
+        # coal trees have their own random numbers
+        self.assertNotEqual(results[0], results[2])
+
+
+    def test_warm_start(self):
+        """A warm start should begin from the best earlier locus tree"""
+
+        logs = self.recon("warm", [self.coal_tree, self.coal_tree2],
+                          "--warm-start")
+
+        best = max(self.read_log(logs[0]),
+                   key=lambda record: record["data"]["prob"])
+        first = self.read_log(logs[1])[0]
+        top = phylo.hash_tree(treelib.parse_newick(best["locus_tree"]))
+        self.assertEqual(
+            phylo.hash_tree(treelib.parse_newick(first["locus_tree"])), top)
+        self.assertNotEqual(phylo.hash_tree(self.coal_tree2), top)
+
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,155 @@
+# test incremental reconciliation updates
+
+import unittest
+import random
+
+import dlcoal
+from dlcoal import recon as reconlib
+
+from rasmus import treelib
+from rasmus.testing import *
+
+from compbio import phylo
+
+
+class ReconUpdate (unittest.TestCase):
+
+    def test_moves(self):
+        """Incremental updates should match reconciling from scratch"""
+
+        random.seed(1)
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        gene2species = phylo.read_gene2species("../examples/config/flies.smap")
+        coal_tree = treelib.read_tree("data/flies/96/96.coal.tree")
+        locus_tree = coal_tree.copy()
+
+        locus_recon = phylo.reconcile(locus_tree, stree, gene2species)
+        locus_events = phylo.label_events(locus_tree, locus_recon)
+        coal_recon = phylo.reconcile(coal_tree, locus_tree, lambda x: x)
+        coal_nodes = reconlib.get_recon_inverse(locus_tree, coal_recon)
+
+        search = phylo.TreeSearchMix(locus_tree)
+        search.add_proposer(phylo.TreeSearchNni(locus_tree), .5)
+        search.add_proposer(phylo.TreeSearchSpr(locus_tree), .5)
+
+        for i in xrange(100):
+            old = (locus_recon.copy(), locus_events.copy(),
+                   coal_recon.copy())
+
+            search.propose()
+            undo = reconlib.ReconUndo()
+            reconlib.update_recon_lca(
+                reconlib.get_move_nodes(search), stree,
+                locus_recon, locus_events, coal_recon, coal_nodes, undo)
+
+            self.assertEqual(
+                locus_recon, phylo.reconcile(locus_tree, stree, gene2species))
+            self.assertEqual(
+                locus_events, phylo.label_events(locus_tree, locus_recon))
+            self.assertEqual(
+                coal_recon,
+                phylo.reconcile(coal_tree, locus_tree, lambda x: x))
+            self.assertEqual(
+                coal_nodes,
+                reconlib.get_recon_inverse(locus_tree, coal_recon))
+
+            # revert every other move
+            if i % 2 == 0:
+                search.revert()
+                undo.undo()
+                self.assertEqual((locus_recon, locus_events, coal_recon),
+                                 old)
+
+
+    def test_prescreen(self):
+        """Prescreened moves should report their changes and revert"""
+
+        random.seed(1)
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        gene2species = phylo.read_gene2species("../examples/config/flies.smap")
+        locus_tree = treelib.read_tree("data/flies/96/96.locus.tree")
+
+        locus_recon = phylo.reconcile(locus_tree, stree, gene2species)
+        locus_events = phylo.label_events(locus_tree, locus_recon)
+        coal_recon = {}
+        coal_nodes = reconlib.get_recon_inverse(locus_tree, coal_recon)
+
+        for native in (True, False):
+            search = reconlib.DLCoalPrescreen(
+                locus_tree, stree, gene2species, .0012, .0011, 10)
+            if not native:
+                search.prescreener = None
+
+            for i in xrange(10):
+                top = phylo.hash_tree(locus_tree)
+                search.propose()
+                treelib.assert_tree(locus_tree)
+
+                undo = reconlib.ReconUndo()
+                reconlib.update_recon_lca(
+                    reconlib.get_move_nodes(search), stree,
+                    locus_recon, locus_events, coal_recon, coal_nodes, undo)
+                self.assertEqual(
+                    locus_recon,
+                    phylo.reconcile(locus_tree, stree, gene2species))
+
+                search.revert()
+                undo.undo()
+                treelib.assert_tree(locus_tree)
+                self.assertEqual(phylo.hash_tree(locus_tree), top)
+
+
+    def test_snapshot(self):
+        """Snapshots should keep the state at the time they were taken"""
+
+        random.seed(1)
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        gene2species = phylo.read_gene2species("../examples/config/flies.smap")
+        coal_tree = treelib.read_tree("data/flies/96/96.coal.tree")
+        locus_tree = coal_tree.copy()
+
+        locus_recon = phylo.reconcile(locus_tree, stree, gene2species)
+        locus_events = phylo.label_events(locus_tree, locus_recon)
+        coal_recon = phylo.reconcile(coal_tree, locus_tree, lambda x: x)
+        coal_nodes = reconlib.get_recon_inverse(locus_tree, coal_recon)
+        log = reconlib.ReconLog(locus_tree, locus_recon, locus_events,
+                                coal_recon)
+
+        search = phylo.TreeSearchMix(locus_tree)
+        search.add_proposer(phylo.TreeSearchNni(locus_tree), .5)
+        search.add_proposer(phylo.TreeSearchSpr(locus_tree), .5)
+
+        def names(recon):
+            return (phylo.hash_tree(recon.locus_tree),
+                    sorted((x.name, y.name)
+                           for x, y in recon.locus_recon.iteritems()),
+                    sorted((x.name, y.name)
+                           for x, y in recon.coal_recon.iteritems()))
+
+        snapshots = []
+        for i in xrange(50):
+            search.propose()
+            undo = reconlib.ReconUndo()
+            changed = reconlib.get_move_nodes(search)
+            reconlib.update_recon_lca(
+                changed, stree,
+                locus_recon, locus_events, coal_recon, coal_nodes, undo)
+            log.touch(changed, undo)
+
+            if i % 3 == 0:
+                search.revert()
+                undo.undo()
+            elif i % 5 == 0:
+                recon = reconlib.Recon(coal_recon, locus_tree, locus_recon,
+                                       locus_events, set(), source=log)
+                snapshots.append((recon.copy(), names(recon)))
+
+        for snap, expected in snapshots:
+            self.assertEqual(names(snap.copy()), expected)
+            self.assertEqual(names(snap), expected)
+            treelib.assert_tree(snap.locus_tree)
+        self.assertEqual(names(log.snapshot(recon)), names(recon))
+
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,24 @@
+# test screening of proposals with few samples
+
+from dlcoal.recon import SearchScreen
+
+from rasmus.testing import *
+
+from searchtest import SearchTest
+
+
+class Screen (SearchTest):
+
+    def test_screen_counts(self):
+        """Screening counts should be kept with the reconciliation"""
+
+        self.seed()
+        maxrecon = self.dlcoal_recon(nsearch=20, screen=SearchScreen(5))
+
+        data = maxrecon["data"]
+        self.assertTrue(data["nfull"] > 0)
+        self.assertTrue(data["nscreened"] + data["nfull"] <= 20)
+
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,64 @@
+# test simulation of gene trees
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import dlcoal
+import dlcoal.sim
+
+from rasmus import treelib
+from rasmus.testing import *
+
+
+def read_files(outdir):
+    """Returns the contents of every file in a simulation directory"""
+    files = {}
+    for famid in os.listdir(outdir):
+        for name in os.listdir(os.path.join(outdir, famid)):
+            files[name] = open(os.path.join(outdir, famid, name)).read()
+    return files
+
+
+class Sim (unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+    def test_seeds(self):
+        """Replicates should not depend on processes or start"""
+
+        stree = treelib.read_tree("../examples/config/flies.stree")
+        n = 2 * 1e7 * 1e-9 * 1000
+        args = (stree, n, .01, .008)
+
+        dlcoal.sim.dlcoal_sims(os.path.join(self.tmpdir, "a"), 6, *args,
+                               seed=1)
+        dlcoal.sim.dlcoal_sims(os.path.join(self.tmpdir, "b"), 6, *args,
+                               seed=1, nprocs=2)
+        dlcoal.sim.dlcoal_sims(os.path.join(self.tmpdir, "c"), 3, *args,
+                               seed=1)
+        dlcoal.sim.dlcoal_sims(os.path.join(self.tmpdir, "c"), 6, *args,
+                               seed=1, start=3)
+
+        files = read_files(os.path.join(self.tmpdir, "a"))
+        self.assertEqual(len(files), 6 * 5)
+        self.assertEqual(read_files(os.path.join(self.tmpdir, "b")), files)
+        self.assertEqual(read_files(os.path.join(self.tmpdir, "c")), files)
+
+
+    def test_seed_mix(self):
+        """Replicate seeds should not depend on the python build"""
+
+        self.assertEqual(dlcoal.sim.get_sim_seed(1, 2), 1004099625906077600)
+        self.assertNotEqual(dlcoal.sim.get_sim_seed(2, 1),
+                            dlcoal.sim.get_sim_seed(1, 2))
+
+
+if __name__ == "__main__":
+    test_main()
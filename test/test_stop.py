@@ -0,0 +1,80 @@
+# test early stopping of the reconciliation search
+
+import StringIO
+
+import dlcoal
+import dlcoal.recon
+
+from rasmus.testing import *
+
+from searchtest import SearchTest
+
+
+class Stop (SearchTest):
+
+    def search(self, nsearch=1000, **kwargs):
+        """
+        Runs a search with the stop rules 'kwargs' and returns its
+        DLCoalRecon, maxrecon, and number of iterations
+        """
+        self.seed()
+        log = StringIO.StringIO()
+        reconer = self.make_recon(log=log,
+                                  stop=dlcoal.recon.SearchStop(**kwargs))
+        maxrecon = reconer.recon(nsearch)
+        log.seek(0)
+        niters = len(list(dlcoal.read_log(log)))
+        return reconer, maxrecon, niters
+
+
+    def test_stop_iters(self):
+        """Search should stop when it no longer improves"""
+
+        reconer, maxrecon, niters = self.search(stop_iters=5)
+        self.assertEqual(maxrecon.data["stop_reason"],
+                         "no improvement in 5 iterations")
+        self.assertTrue(niters < 1000)
+        self.assertEqual(niters - reconer.stop.last_improve, 5)
+
+
+    def test_max_time(self):
+        """Search should stop at the time limit"""
+
+        reconer, maxrecon, niters = self.search(max_time=0)
+        self.assertEqual(maxrecon.data["stop_reason"],
+                         "time limit of 0 seconds")
+        self.assertEqual(niters, 1)
+
+
+    def test_max_evals(self):
+        """Search should stop at the evaluation limit"""
+
+        reconer, maxrecon, niters = self.search(max_evals=5)
+        self.assertEqual(maxrecon.data["stop_reason"],
+                         "evaluation limit of 5")
+        self.assertEqual(reconer.nevals, 5)
+        self.assertTrue(niters >= 5)
+
+
+    def test_min_improve(self):
+        """Search should stop when a window improves too little"""
+
+        # the first window sets the baseline, the second is checked
+        reconer, maxrecon, niters = self.search(min_improve=1.0,
+                                                improve_window=10)
+        self.assertEqual(maxrecon.data["stop_reason"],
+                         "improvement below 1 in 10 iterations")
+        self.assertEqual(niters, 20)
+
+
+    def test_completed(self):
+        """Search without stop rules should run every iteration"""
+
+        reconer, maxrecon, niters = self.search(nsearch=20)
+        self.assertEqual(maxrecon.data["stop_reason"],
+                         "completed 20 iterations")
+        self.assertEqual(niters, 20)
+
+
+if __name__ == "__main__":
+    test_main()
@@ -0,0 +1,62 @@
+# test multithreaded sampling of duplication times
+
+import unittest
+import random
+from math import exp, sqrt
+
+import dlcoal
+import dlcoal.sim
+
+from rasmus import treelib
+from rasmus.testing import *
+
+
+class Threads (unittest.TestCase):
+
+    def setUp(self):
+        self.stree = treelib.read_tree("../examples/config/flies.stree")
+        times = treelib.get_tree_timestamps(self.stree)
+        self.n = 2 * 1e7 * 1e-9 * 1000
+        self.duprate = .02
+        self.lossrate = .01
+        self.premean = .5 * times[self.stree.root]
+
+        # a family with duplications, so that samples differ
+        random.seed(2)
+        self.coal_tree, self.extra = dlcoal.sim.sample_dlcoal(
+            self.stree, self.n, self.duprate, self.lossrate, minsize=8)
+
+
+    def prob(self, nthreads, seed, info=None):
+        extra = self.extra
+        return dlcoal.prob_dlcoal_recon_topology(
+            self.coal_tree, extra["coal_recon"], extra["locus_tree"],
+            extra["locus_recon"], extra["locus_events"], extra["daughters"],
+            self.stree, self.n, self.duprate, self.lossrate,
+            premean=self.premean, nsamples=400, info=info,
+            nthreads=nthreads, rand=dlcoal.RandomStream(seed))
+
+
+    def test_threads(self):
+        """Threaded sampling should be reproducible and match one thread"""
+
+        if not dlcoal.dlcoalc:
+            return
+
+        # reproducible for a given seed and thread count
+        p = self.prob(2, 1)
+        self.assertEqual(self.prob(2, 1), p)
+        self.assertNotEqual(self.prob(2, 2), p)
+
+        # same estimate as one thread within Monte Carlo error
+        info = {}
+        p1 = self.prob(1, 1, info)
+        relvar = exp(info["coal_prob_sq"] - 2 * info["coal_prob"]) - 1.0
+        relerr = sqrt(relvar / 400)
+        self.assertNotEqual(p1, p)
+        self.assertTrue(abs(p - p1) < 4 * sqrt(2) * relerr,
+                        (p, p1, relerr))
+
+
+if __name__ == "__main__":
+    test_main()